@@ -3,7 +3,14 @@ import json
 import requests
 import base64
 import subprocess
+import threading
+import time
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from response_cache import get_cache
+from search_derivative import get_derivatives, MultipartFile
+from instrumentation import get_metrics, timed
 
 load_dotenv()
 
@@ -12,29 +19,95 @@ SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 TINEYE_API_KEY = os.getenv("TINEYE_API_KEY")  # Optional, if/when available
 BING_API_KEY = os.getenv("BING_API_KEY")  # Optional, if/when available
 
+# Endpoints can point at local stand-ins (see benchmarks/servers.py)
+SERPAPI_ENDPOINT = os.getenv("SERPAPI_ENDPOINT", "https://serpapi.com/search")
+BING_VISUAL_ENDPOINT = os.getenv("BING_VISUAL_ENDPOINT", "https://api.bing.microsoft.com/v7.0/images/visualsearch")
+ENGINE_TIMEOUT = float(os.getenv("ENGINE_TIMEOUT", "30"))
+# Requests in flight per engine; each API rate-limits per key
+ENGINE_CONCURRENCY = {
+    "google": int(os.getenv("GOOGLE_CONCURRENCY", "4")),
+    "tineye": int(os.getenv("TINEYE_CONCURRENCY", "2")),
+    "bing": int(os.getenv("BING_CONCURRENCY", "3")),
+}
+READ_WORKERS = 4
+# Upload downscaled derivatives instead of originals (0 to disable)
+OPTIMIZE_UPLOADS = os.getenv("OPTIMIZE_UPLOADS", "1") != "0"
+
 INPUT_IMAGE_DIR = "./input_images"
 OUTPUT_DIR = "./reverse_image_results"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def search_google_reverse(image_path):
+class SearchImage:
+    """An image prepared once and shared by every engine.
+
+    Engines upload `upload_path`: a downscaled, metadata-free derivative
+    (see search_derivative.py). If none can be built the image is not
+    searched, so its GPS and captions never leave the machine.
+    """
+
+    def __init__(self, path, optimize=None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0] + ".jpg"
+        self.upload_path = path
+        if optimize is None:
+            optimize = OPTIMIZE_UPLOADS
+        if optimize:
+            try:
+                self.upload_path = get_derivatives().derivative(path)
+            except Exception as e:
+                raise OSError(f"couldn't build a metadata-free derivative: {e}") from e
+
+    @cached_property
+    def data(self):
+        with open(self.upload_path, "rb") as f:
+            return f.read()
+
+    @cached_property
+    def encoded(self):
+        return base64.b64encode(self.data).decode("utf-8")
+
+class EngineStats:
+    """Per-engine request latencies for the run summary."""
+
+    def __init__(self):
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, engine, seconds):
+        with self._lock:
+            self.latencies.setdefault(engine, []).append(seconds)
+
+    def summary(self):
+        lines = []
+        for engine, times in sorted(self.latencies.items()):
+            times = sorted(times)
+            lines.append(f"{engine}: {len(times)} requests, p50 {times[len(times) // 2]:.2f} s, "
+                         f"mean {sum(times) / len(times):.2f} s, max {times[-1]:.2f} s")
+        return "\n".join(lines)
+
+@timed("search.google_reverse")
+def search_google_reverse(image):
+    if isinstance(image, str):
+        image = SearchImage(image)
     if not SERPAPI_KEY:
         print("[!] Missing SerpAPI key. Skipping Google reverse image search.")
         return []
     try:
-        print(f"[INFO] Submitting to Google Reverse Image Search: {image_path}")
-        with open(image_path, "rb") as f:
-            encoded_image = base64.b64encode(f.read()).decode("utf-8")
-
+        print(f"[INFO] Submitting to Google Reverse Image Search: {image.path}")
         payload = {
             "engine": "google_reverse_image",
-            "image_content": encoded_image,
+            "image_content": image.encoded,
             "api_key": SERPAPI_KEY
         }
-        response = requests.post("https://serpapi.com/search", json=payload)
-        if response.status_code != 200:
-            raise Exception(f"SerpAPI error: {response.text}")
 
-        data = response.json()
+        def fetch():
+            response = requests.post(SERPAPI_ENDPOINT, json=payload, timeout=ENGINE_TIMEOUT)
+            if response.status_code != 200:
+                raise Exception(f"SerpAPI error: {response.text}")
+            return response.json()
+
+        # The cache keys image_content by its hash, so identical files share one entry
+        data = get_cache().fetch("serpapi", payload, fetch)
         results = []
         for result in data.get("image_results", []):
             results.append({
@@ -42,13 +115,16 @@ def search_google_reverse(image_path):
                 "link": result.get("link"),
                 "source": result.get("source")
             })
+        get_metrics().count("search.hits", len(results))
         return results
 
     except Exception as e:
-        print(f"[ERROR] Google reverse image search failed for {image_path}: {e}")
+        get_metrics().count("search.errors")
+        print(f"[ERROR] Google reverse image search failed for {image.path}: {e}")
         return []
 
-def search_tineye_stub(image_path):
+def search_tineye_stub(image):
+    image_path = image if isinstance(image, str) else image.path
     if not TINEYE_API_KEY:
         print(f"[!] TinEye API key not provided. Skipping TinEye search for {image_path}.")
         return []
@@ -56,18 +132,22 @@ def search_tineye_stub(image_path):
     # Placeholder for when TinEye API access is available
     return []
 
-def search_bing_visual(image_path):
+@timed("search.bing_visual")
+def search_bing_visual(image):
+    if isinstance(image, str):
+        image = SearchImage(image)
     if not BING_API_KEY:
-        print(f"[!] Bing API key not provided. Skipping Bing search for {image_path}.")
+        print(f"[!] Bing API key not provided. Skipping Bing search for {image.path}.")
         return []
     try:
-        print(f"[INFO] Submitting to Bing Visual Search: {image_path}")
-        with open(image_path, "rb") as f:
-            files = {"image": (os.path.basename(image_path), f, "multipart/form-data")}
+        print(f"[INFO] Submitting to Bing Visual Search: {image.path}")
+        # Bing takes multipart uploads, so the file is streamed rather than held in memory
+        with MultipartFile("image", image.upload_path, image.name) as body:
             headers = {
-                "Ocp-Apim-Subscription-Key": BING_API_KEY
+                "Ocp-Apim-Subscription-Key": BING_API_KEY,
+                "Content-Type": body.content_type
             }
-            response = requests.post("https://api.bing.microsoft.com/v7.0/images/visualsearch", headers=headers, files=files)
+            response = requests.post(BING_VISUAL_ENDPOINT, headers=headers, data=body, timeout=ENGINE_TIMEOUT)
         if response.status_code != 200:
             raise Exception(f"Bing API error: {response.text}")
 
@@ -83,12 +163,86 @@ def search_bing_visual(image_path):
                             "link": img.get("contentUrl"),
                             "source": img.get("hostPageDisplayUrl")
                         })
+        get_metrics().count("search.hits", len(results))
         return results
 
     except Exception as e:
-        print(f"[ERROR] Bing reverse image search failed for {image_path}: {e}")
+        get_metrics().count("search.errors")
+        print(f"[ERROR] Bing reverse image search failed for {image.path}: {e}")
         return []
 
+ENGINES = {
+    "google": search_google_reverse,
+    "tineye": search_tineye_stub,
+    "bing": search_bing_visual,
+}
+
+def read_image(image_path):
+    try:
+        return SearchImage(image_path)
+    except OSError as e:
+        print(f"[ERROR] Couldn't read {image_path}: {e}")
+        return None
+
+def merge_results(merged, seen, engine, results):
+    """Fold one engine's results into `merged`, deduplicating by link."""
+    for result in results:
+        link = result.get("link")
+        if link and link in seen:
+            if engine not in seen[link]["engines"]:
+                seen[link]["engines"].append(engine)
+            continue
+        entry = dict(result, engines=[engine])
+        merged.append(entry)
+        if link:
+            seen[link] = entry
+
+def search_all_engines(image_paths, engines=None, on_result=None, stats=None):
+    """Query every engine for every image concurrently; returns {path: merged results}.
+
+    Each image is read and encoded once. Every engine gets its own pool sized
+    by ENGINE_CONCURRENCY, so a slow engine can't hold up the others.
+    `on_result(path, engine, results, merged)` is called as each response
+    arrives, with the image's deduplicated results so far. Request latencies
+    are recorded in `stats` (an EngineStats) if given.
+    """
+    engines = ENGINES if engines is None else engines
+    pools = {name: ThreadPoolExecutor(max_workers=ENGINE_CONCURRENCY.get(name, 1)) for name in engines}
+    merged = {path: [] for path in image_paths}
+    seen = {path: {} for path in image_paths}
+    futures = {}
+
+    def _run_engine(name, search, image):
+        start = time.perf_counter()
+        try:
+            return search(image)
+        finally:
+            if stats is not None:
+                stats.record(name, time.perf_counter() - start)
+
+    try:
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as readers:
+            for path, image in zip(image_paths, readers.map(read_image, image_paths)):
+                if image is None:
+                    continue
+                for name, search in engines.items():
+                    futures[pools[name].submit(_run_engine, name, search, image)] = (path, name)
+
+        for future in as_completed(futures):
+            path, name = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"[ERROR] {name} search failed for {path}: {e}")
+                results = []
+            merge_results(merged[path], seen[path], name, results)
+            if on_result:
+                on_result(path, name, results, merged[path])
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+    return merged
+
 def save_results(image_name, engine, results):
     filename = os.path.join(OUTPUT_DIR, f"{image_name}_{engine}_results.json")
     with open(filename, "w") as f:
@@ -97,22 +251,20 @@ def save_results(image_name, engine, results):
 
 if __name__ == "__main__":
     image_files = [f for f in os.listdir(INPUT_IMAGE_DIR) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    image_paths = [os.path.join(INPUT_IMAGE_DIR, f) for f in image_files]
 
-    for image_file in image_files:
-        image_path = os.path.join(INPUT_IMAGE_DIR, image_file)
-        base_name = os.path.splitext(image_file)[0]
-
-        # Google Reverse Image Search via SerpAPI
-        google_results = search_google_reverse(image_path)
-        if google_results:
-            save_results(base_name, "google", google_results)
+    def report(image_path, engine, results, merged):
+        if results:
+            save_results(os.path.splitext(os.path.basename(image_path))[0], engine, results)
 
-        # TinEye stub
-        tineye_results = search_tineye_stub(image_path)
-        if tineye_results:
-            save_results(base_name, "tineye", tineye_results)
+    stats = EngineStats()
+    with get_metrics().stage("reverse_search"):
+        merged = search_all_engines(image_paths, on_result=report, stats=stats)
+    for image_path, results in merged.items():
+        if results:
+            save_results(os.path.splitext(os.path.basename(image_path))[0], "merged", results)
 
-        # Bing Visual Search
-        bing_results = search_bing_visual(image_path)
-        if bing_results:
-            save_results(base_name, "bing", bing_results)
+    print(f"[✓] Uploads: {get_derivatives().summary()}")
+    if stats.latencies:
+        print(f"[✓] Engine latency:\n{stats.summary()}")
+    print(f"[✓] SerpAPI cache: {get_cache().summary()}")
@@ -1,9 +1,14 @@
 import os
+import sys
 import json
+import time
 import exifread
-from PIL import Image
-from transformers import BlipProcessor, BlipForConditionalGeneration
-import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blob_store import file_sha256
+from metadata_catalog import get_catalog
+import analyzeimage
+from analyzeimage import CAPTION_MODEL, generate_captions
 
 # Setup paths
 PHOTO_DIR = "../photos"
@@ -11,18 +16,6 @@ METADATA_DIR = "../metadata"
 
 os.makedirs(METADATA_DIR, exist_ok=True)
 
-# Load BLIP model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(device)
-
-def generate_caption(image_path):
-    raw_image = Image.open(image_path).convert('RGB')
-    inputs = processor(images=raw_image, return_tensors="pt").to(device)
-    out = model.generate(**inputs)
-    caption = processor.decode(out[0], skip_special_tokens=True)
-    return caption
-
 def extract_exif(image_path):
     exif_data = {}
     with open(image_path, 'rb') as f:
@@ -32,25 +25,50 @@ def extract_exif(image_path):
     return exif_data
 
 def main():
-    for filename in os.listdir(PHOTO_DIR):
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            img_path = os.path.join(PHOTO_DIR, filename)
-            print(f"Processing {filename}...")
+    filenames = [f for f in os.listdir(PHOTO_DIR) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    paths = {f: os.path.join(PHOTO_DIR, f) for f in filenames}
+    hashes = {f: file_sha256(p) for f, p in paths.items()}
+
+    # Captions are cached by content hash, so unchanged photos are never re-captioned
+    catalog = get_catalog()
+    captions = catalog.cached_captions(set(hashes.values()), CAPTION_MODEL)
+    missing = {}
+    for f in filenames:
+        if hashes[f] not in captions:
+            missing.setdefault(hashes[f], paths[f])
+
+    start = time.perf_counter()
+    generated = generate_captions(list(missing.values()))
+    elapsed = time.perf_counter() - start
+    fresh = {sha: generated[path] for sha, path in missing.items() if path in generated}
+    catalog.store_captions(fresh, CAPTION_MODEL)
+    captions.update(fresh)
+
+    for filename in filenames:
+        img_path = paths[filename]
+        print(f"Processing {filename}...")
+
+        caption = captions.get(hashes[filename])
+        if caption is None:
+            print(f"Failed to caption {filename}")
+            continue
+        exif = extract_exif(img_path)
 
-            caption = generate_caption(img_path)
-            exif = extract_exif(img_path)
+        output = {
+            "filename": filename,
+            "caption": caption,
+            "EXIF": exif
+        }
 
-            output = {
-                "filename": filename,
-                "caption": caption,
-                "EXIF": exif
-            }
+        out_path = os.path.join(METADATA_DIR, f"{os.path.splitext(filename)[0]}.json")
+        with open(out_path, "w") as f:
+            json.dump(output, f, indent=2)
 
-            out_path = os.path.join(METADATA_DIR, f"{os.path.splitext(filename)[0]}.json")
-            with open(out_path, "w") as f:
-                json.dump(output, f, indent=2)
+        print(f"Saved metadata to {out_path}")
 
-            print(f"Saved metadata to {out_path}")
+    rate = len(generated) / elapsed if elapsed and generated else 0.0
+    print(f"Captions: {len(filenames) - len(missing)} cached, {len(generated)} generated "
+          f"in {elapsed:.1f} s ({rate:.2f} images/s on {analyzeimage.device or 'no device'})")
 
 if __name__ == "__main__":
     main()
@@ -1,37 +1,39 @@
 import exifread
-from geopy.geocoders import Nominatim
 import requests
-from waybackpy import WaybackMachineCDXServerAPI
 from newspaper import Article
 import os
 from serpapi import GoogleSearch
 import snscrape.modules.reddit as reddit
 from dotenv import load_dotenv
-import subprocess
+import sys
 import re
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metadata_reader import read_one
+from response_cache import get_cache
+from instrumentation import get_metrics, timed
+from wayback import snapshots
+from article_harvester import ArticleHarvester
+from geocoder import get_geocoder
+
 load_dotenv()
 
 # 1. Extract GPS from EXIF
+@timed("extract.gps")
 def extract_gps(image_path):
     print(image_path)
     try:
-        result = subprocess.run(["exiftool", image_path], capture_output=True, text=True)
-        output = result.stdout
-
-        lat = None
-        lon = None
-
-        for line in output.splitlines():
-            if "GPS Latitude" in line and "Ref" not in line:
-                lat_str = line.split(":")[1].strip()
-                lat = convert_to_decimal(lat_str)
-            elif "GPS Longitude" in line and "Ref" not in line:
-                lon_str = line.split(":")[1].strip()
-                lon = convert_to_decimal(lon_str)
-
-        if lat is not None and lon is not None:
-            return lat, lon
+        # Composite GPS tags with -n are already signed decimal degrees
+        metadata = read_one(
+            image_path,
+            tags=["Composite:GPSLatitude", "Composite:GPSLongitude"],
+            numeric=True
+        )
+        lat = metadata.get("Composite:GPSLatitude")
+        lon = metadata.get("Composite:GPSLongitude")
+
+        if isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            return float(lat), float(lon)
         else:
             return None
     except Exception as e:
@@ -53,12 +55,14 @@ def convert_to_decimal(coord_str):
 
 
 # 2. Reverse geocode
+@timed("geocode.reverse")
 def reverse_geocode(lat, lon):
-    geolocator = Nominatim(user_agent="geoapi")
-    location = geolocator.reverse((lat, lon), timeout=10)
-    return location.address if location else None
+    # Local gazetteer first; Nominatim (cached, 1 request/s) only when no known place is near
+    place = get_geocoder().reverse(lat, lon)
+    return place["address"] if place else None
 
 # 3. SerpAPI search
+@timed("search.serpapi_news")
 def search_serpapi(query):
     api_key = os.getenv("SERPAPI_API_KEY")
     if not api_key:
@@ -70,9 +74,10 @@ def search_serpapi(query):
         "tbm": "nws",
         "api_key": api_key
     }
-    search = GoogleSearch(params)
-    results = search.get_dict()
-    return [item["link"] for item in results.get("news_results", [])]
+    results = get_cache().fetch("serpapi", params, lambda: GoogleSearch(params).get_dict())
+    links = [item["link"] for item in results.get("news_results", [])]
+    get_metrics().count("search.hits", len(links))
+    return links
 
 # 4. Reddit fallback
 # def search_reddit(query, max_results=5):
@@ -85,11 +90,13 @@ def search_serpapi(query):
     # return results
 
 # 5. Wayback Machine lookup
-def find_archived_urls(query_url):
-    cdx = WaybackMachineCDXServerAPI(query_url, user_agent="contextual-capture")
-    return [page.archive_url for page in cdx.snapshots()]
+@timed("wayback.snapshots")
+def find_archived_urls(query_url, limit=3, start=None, end=None):
+    """Archive URLs of up to `limit` distinct captures of `query_url` (see wayback.py)."""
+    return [capture["archive_url"] for capture in snapshots(query_url, limit, start, end)]
 
 # 6. Scrape news article
+@timed("article.scrape")
 def scrape_article(url):
     article = Article(url)
     article.download()
@@ -150,17 +157,27 @@ def main():
 
     print(f"[INFO] Found {len(urls)} URLs")
 
-    # Step 5: Scrape first article
+    # Step 5: Scrape every article, printed as each one is parsed
     if urls:
-        article_data = scrape_article(urls[0])
-        print(f"\n[ARTICLE] {article_data['title']}\n\n{article_data['text'][:500]}...")
+        harvester = ArticleHarvester()
+        try:
+            for article_data in harvester.harvest(urls):
+                if "error" in article_data:
+                    print(f"[WARN] Couldn't scrape {article_data['url']}: {article_data['error']}")
+                    continue
+                print(f"\n[ARTICLE] {article_data['title']} ({article_data['url']})\n\n"
+                      f"{article_data['text'][:500]}...")
+        finally:
+            harvester.close()
 
         # Step 6: Wayback Machine
-        archived = find_archived_urls(urls[0])
+        archived = find_archived_urls(urls[0], limit=3)
         if archived:
-            print(f"\n[ARCHIVED VERSIONS]\n" + "\n".join(archived[:3]))
+            print(f"\n[ARCHIVED VERSIONS]\n" + "\n".join(archived))
     else:
         print("[INFO] No results found on any source.")
 
+    print(f"[INFO] SerpAPI cache: {get_cache().summary()}")
+
 if __name__ == "__main__":
     main()
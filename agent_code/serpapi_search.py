@@ -1,7 +1,11 @@
 from serpapi import GoogleSearch
 import os
+import sys
 import urllib.request
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from response_cache import get_cache
+
 
 SERPAPI_KEY = os.getenv("SERPAPI_API_KEY")  # or hardcode
 
@@ -13,8 +17,7 @@ def search_serpapi_images(query, num=5):
         "num": num,
         "api_key": SERPAPI_KEY
     }
-    search = GoogleSearch(params)
-    results = search.get_dict()
+    results = get_cache().fetch("serpapi", params, lambda: GoogleSearch(params).get_dict())
     return [img["original"] for img in results.get("images_results", [])]
 
 def download_images(urls, folder="bing_results"):
@@ -31,4 +34,5 @@ def download_images(urls, folder="bing_results"):
 if __name__ == "__main__":
     images = search_serpapi_images("Panmunjom DMZ soldiers")
     for i, url in enumerate(images):
-        print(f"{i+1}: {url}")
\ No newline at end of file
+        print(f"{i+1}: {url}")
+    print(f"[✓] SerpAPI cache: {get_cache().summary()}")
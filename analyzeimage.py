@@ -1,11 +1,14 @@
 import os
 import json
+import time
+import argparse
 import requests
 from dotenv import load_dotenv
-import exiftool
 from PIL import Image
-import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
+from metadata_reader import read_metadata, strip_groups
+from metadata_catalog import get_catalog
+from image_prefetch import prefetch_batches
+from instrumentation import get_metrics, timed
 
 # Load environment variables
 load_dotenv()
@@ -15,11 +18,26 @@ INPUT_FOLDER = "./input_images"
 OUTPUT_FOLDER = "./metadata"
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Load BLIP model for image captioning
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
+# BLIP model for image captioning, loaded on the first image that needs a caption
+CAPTION_MODEL = "Salesforce/blip-image-captioning-base"
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "8"))
+# BLIP's processor resizes to 384x384, so JPEGs can be draft-decoded near that size
+CAPTION_IMAGE_SIZE = (384, 384)
+processor = None
+model = None
+device = None
+
+def load_caption_model():
+    global processor, model, device
+    if model is None:
+        import torch
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+        print(f"[INFO] Loading {CAPTION_MODEL}")
+        processor = BlipProcessor.from_pretrained(CAPTION_MODEL)
+        model = BlipForConditionalGeneration.from_pretrained(CAPTION_MODEL)
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+    return processor, model, device
 
 # Priority EXIF fields to extract
 PRIORITY_FIELDS = [
@@ -31,11 +49,12 @@ PRIORITY_FIELDS = [
     "XPSubject"
 ]
 
-def extract_priority_metadata_fields(image_path):
+@timed("extract.priority_metadata_fields")
+def extract_priority_metadata_fields(image_path, metadata=None):
     try:
-        with exiftool.ExifTool() as et:
-            metadata = et.execute_json(image_path)[0]
-        normalized_metadata = {k.split(":")[-1]: v for k, v in metadata.items()}
+        if metadata is None:
+            metadata = get_catalog().metadata([image_path])[image_path]
+        normalized_metadata = strip_groups(metadata)
         for field in PRIORITY_FIELDS:
             value = normalized_metadata.get(field)
             if value:
@@ -49,34 +68,106 @@ def extract_priority_metadata_fields(image_path):
         print(f"[WARN] Failed to read EXIF from {image_path}: {e}")
         return None, {}
 
+@timed("caption.generate")
 def generate_caption(image_path):
     raw_image = Image.open(image_path).convert("RGB")
+    processor, model, device = load_caption_model()
     inputs = processor(raw_image, return_tensors="pt").to(device)
     out = model.generate(**inputs)
     return processor.decode(out[0], skip_special_tokens=True)
 
-def main():
-    for fname in os.listdir(INPUT_FOLDER):
-        if not fname.lower().endswith((".jpg", ".jpeg")):
+@timed("caption.generate_batch")
+def generate_captions(image_paths, batch_size=CAPTION_BATCH_SIZE):
+    """Caption many images, decoding on a thread pool and generating in batches.
+
+    Returns {path: caption}; images that fail to decode are left out.
+    """
+    captions = {}
+    if not image_paths:
+        return captions
+    processor, model, device = load_caption_model()
+    for paths, images in prefetch_batches(list(image_paths), CAPTION_IMAGE_SIZE, batch_size):
+        inputs = processor(images=images, return_tensors="pt").to(device)
+        out = model.generate(**inputs)
+        for path, caption in zip(paths, processor.batch_decode(out, skip_special_tokens=True)):
+            captions[path] = caption
+    get_metrics().count("caption.generated", len(captions))
+    return captions
+
+def caption_images(image_paths, hashes, batch_size=CAPTION_BATCH_SIZE):
+    """Caption images, reusing captions cached by content hash; returns ({path: caption}, stats)."""
+    catalog = get_catalog()
+    cached = catalog.cached_captions({hashes[p] for p in image_paths if p in hashes}, CAPTION_MODEL)
+    captions = {p: cached[hashes[p]] for p in image_paths if hashes.get(p) in cached}
+
+    # Identical pixels under several names are captioned once
+    pending = {}
+    for path in image_paths:
+        if path not in captions:
+            pending.setdefault(hashes.get(path, path), []).append(path)
+
+    start = time.perf_counter()
+    generated = generate_captions([paths[0] for paths in pending.values()], batch_size) if pending else {}
+    elapsed = time.perf_counter() - start
+
+    fresh = {}
+    for key, paths in pending.items():
+        caption = generated.get(paths[0])
+        if caption is None:
             continue
+        for path in paths:
+            captions[path] = caption
+        if paths[0] in hashes:
+            fresh[key] = caption
+    catalog.store_captions(fresh, CAPTION_MODEL)
 
-        image_path = os.path.join(INPUT_FOLDER, fname)
-        print(f"[INFO] Processing {fname}")
+    stats = {"cached": len(image_paths) - sum(len(paths) for paths in pending.values()),
+             "generated": len(generated), "seconds": elapsed}
+    return captions, stats
+
+def main(batch_size=CAPTION_BATCH_SIZE):
+    run_start = time.perf_counter()
+    fnames = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith((".jpg", ".jpeg"))]
+    paths = {f: os.path.join(INPUT_FOLDER, f) for f in fnames}
+    records = get_catalog().records(paths.values(), with_metadata=True)
 
-        query, exif_data = extract_priority_metadata_fields(image_path)
+    outputs = {}
+    uncaptioned = []
+    for fname in fnames:
+        image_path = paths[fname]
+        print(f"[INFO] Processing {fname}")
+        record = records.get(image_path)
+        query, _ = extract_priority_metadata_fields(image_path, record["metadata"] if record else {})
         if not query:
             print(f"[INFO] No valid EXIF fields found in {fname}, generating caption instead...")
-            try:
-                query = generate_caption(image_path)
-                print(f"[✓] Generated caption: {query}")
-            except Exception as e:
-                print(f"[ERROR] Failed to generate caption for {fname}: {e}")
+            uncaptioned.append(image_path)
+        outputs[fname] = query
+
+    # The model is only loaded if some image still needs a caption after the cache
+    hashes = {path: record["sha256"] for path, record in records.items()}
+    try:
+        captions, stats = caption_images(uncaptioned, hashes, batch_size)
+    except Exception as e:
+        print(f"[ERROR] Failed to generate captions: {e}")
+        captions, stats = {}, {"cached": 0, "generated": 0, "seconds": 0.0}
+
+    written = {}
+    for fname, query in outputs.items():
+        if not query:
+            query = captions.get(paths[fname])
+            if not query:
+                print(f"[ERROR] Failed to generate caption for {fname}")
                 continue
+            print(f"[✓] Generated caption: {query}")
+        written[fname] = query
 
+    # The catalog keeps only the fields it normalizes, so the saved EXIF is every tag, read in one pooled batch
+    full_metadata = read_metadata([paths[fname] for fname in written], numeric=True)
+    for fname, query in written.items():
         metadata_output = {
             "filename": fname,
             "caption": query,
-            "EXIF": exif_data
+            "EXIF": strip_groups(full_metadata[paths[fname]])
         }
 
         out_path = os.path.join(OUTPUT_FOLDER, f"{fname}.json")
@@ -84,5 +175,14 @@ def main():
             json.dump(metadata_output, f, indent=2)
         print(f"[✓] Saved metadata to {out_path}")
 
+    rate = stats["generated"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"[✓] {len(fnames)} images in {time.perf_counter() - run_start:.1f} s; captions: "
+          f"{len(fnames) - len(uncaptioned)} from EXIF, {stats['cached']} cached, "
+          f"{stats['generated']} generated ({rate:.2f} images/s on {device or 'no device'})")
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Extract captions from EXIF, falling back to BLIP captioning")
+    parser.add_argument("--batch-size", type=int, default=CAPTION_BATCH_SIZE)
+    args = parser.parse_args()
+    with get_metrics().stage("analyze"):
+        main(args.batch_size)
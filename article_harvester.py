@@ -0,0 +1,230 @@
+import os
+import re
+import time
+import hashlib
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from downloader import HEADERS
+from response_cache import get_cache, cache_key
+from instrumentation import get_metrics
+
+FETCH_WORKERS = int(os.getenv("ARTICLE_FETCH_WORKERS", "16"))
+PER_HOST = int(os.getenv("ARTICLE_PER_HOST", "4"))
+# 0 parses in the calling process (no pool start-up cost for a handful of pages)
+PARSE_WORKERS = int(os.getenv("ARTICLE_PARSE_WORKERS", str(os.cpu_count() or 1)))
+ARTICLE_PARSER = os.getenv("ARTICLE_PARSER", "newspaper")
+# Raw HTML is re-fetched after this long; parsed output is keyed by content, so it never goes stale
+HTML_TTL = float(os.getenv("ARTICLE_HTML_TTL", str(24 * 3600)))
+PARSED_TTL = float("inf")
+TIMEOUT = 20
+MAX_HTML_BYTES = 10_000_000
+
+
+def parse_newspaper(url, html):
+    from newspaper import Article
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return {"title": article.title, "text": article.text, "top_image": article.top_image}
+
+
+class _PageText(HTMLParser):
+    """Title, og:image and the text of <p> elements outside navigation chrome."""
+
+    SKIP = {"script", "style", "nav", "header", "footer", "aside", "noscript"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.top_image = ""
+        self.paragraphs = []
+        self._stack = []
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "meta" and attrs.get("property") in ("og:image", "twitter:image") and not self.top_image:
+            self.top_image = attrs.get("content") or ""
+        elif tag == "meta" and attrs.get("property") == "og:title":
+            self.title = attrs.get("content") or self.title
+        if tag in ("meta", "link", "img", "br", "hr", "input"):
+            return
+        self._stack.append(tag)
+        if tag == "p" and not self.SKIP.intersection(self._stack):
+            self._current = []
+
+    def handle_endtag(self, tag):
+        if tag not in self._stack:
+            return
+        while self._stack and self._stack.pop() != tag:
+            pass
+        if tag == "p" and self._current is not None:
+            text = re.sub(r"\s+", " ", "".join(self._current)).strip()
+            if text:
+                self.paragraphs.append(text)
+            self._current = None
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current.append(data)
+        elif self._stack and self._stack[-1] == "title" and not self.title:
+            self.title = data.strip()
+
+
+def parse_html(url, html):
+    page = _PageText()
+    page.feed(html)
+    page.close()
+    return {"title": page.title, "text": "\n\n".join(page.paragraphs), "top_image": page.top_image}
+
+
+PARSERS = {
+    "newspaper": parse_newspaper,
+    "html": parse_html,
+}
+
+
+def parse_article(parser, url, html):
+    """Process-pool entry point: (parsed fields, seconds spent parsing)."""
+    start = time.perf_counter()
+    return PARSERS[parser](url, html), time.perf_counter() - start
+
+
+class ArticleHarvester:
+    """Fetch many article URLs concurrently and parse them on a process pool, yielding each as it's done.
+
+    Raw HTML goes through the response cache keyed by URL (for HTML_TTL) and
+    parsed fields keyed by the HTML's SHA-256 and the parser, so a page
+    served under several URLs, or unchanged since the last run, is parsed
+    once.
+    """
+
+    def __init__(self, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS, per_host=PER_HOST,
+                 parser=ARTICLE_PARSER, html_ttl=HTML_TTL):
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser '{parser}' (choose from {', '.join(PARSERS)})")
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = parse_workers
+        self.per_host = max(1, per_host)
+        self.parser = parser
+        self.html_ttl = html_ttl
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=self.fetch_workers, pool_maxsize=self.fetch_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._hosts_lock = threading.Lock()
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._parse_pool = None
+
+    def _slot(self, url):
+        with self._hosts_lock:
+            return self._host_slots[urlparse(url).netloc.lower()]
+
+    def _download(self, url):
+        with self._slot(url), get_metrics().span("article.fetch", url=url):
+            response = self.session.get(url, timeout=TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        content_type = response.headers.get("Content-Type", "")
+        if content_type and "html" not in content_type:
+            raise RuntimeError(f"not an HTML page ({content_type})")
+        if len(response.content) > MAX_HTML_BYTES:
+            raise RuntimeError(f"page is {len(response.content) / 1e6:.1f} MB")
+        get_metrics().count("article.bytes", len(response.content))
+        return {"html": response.text, "final_url": response.url}
+
+    def fetch_html(self, url):
+        """{"html", "final_url"} for `url`, from the cache when fresh."""
+        return get_cache().fetch("article_html", {"url": url}, lambda: self._download(url), self.html_ttl)
+
+    def harvest(self, urls):
+        """Yield {"url", "title", "text", "top_image", "sha256"} (or {"url", "error"}) per URL, as each completes."""
+        urls = list(dict.fromkeys(u for u in urls if u))
+        if not urls:
+            return
+        cache = get_cache()
+        with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(urls))) as fetch_pool:
+            pending = {fetch_pool.submit(self.fetch_html, url): ("fetch", url, None) for url in urls}
+            # Pages with identical HTML wait for the first one's parse
+            parsing = {}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, url, digest = pending.pop(future)
+                    if kind == "fetch":
+                        try:
+                            page = future.result()
+                        except Exception as e:
+                            get_metrics().count("article.errors")
+                            yield {"url": url, "error": str(e)}
+                            continue
+                        digest = hashlib.sha256(page["html"].encode("utf-8")).hexdigest()
+                        key, request = cache_key("article_parsed", {"sha256": digest, "parser": self.parser})
+                        parsed = cache.get(key, PARSED_TTL)
+                        if parsed is not None:
+                            get_metrics().count("article.parse_cached")
+                            yield dict(parsed, url=url, sha256=digest)
+                        elif digest in parsing:
+                            parsing[digest][2].append(url)
+                        else:
+                            parsing[digest] = (key, request, [url])
+                            pending[self._submit_parse(url, page["html"])] = ("parse", url, digest)
+                    else:
+                        key, request, waiting = parsing.pop(digest)
+                        try:
+                            parsed, seconds = future.result()
+                        except Exception as e:
+                            get_metrics().count("article.errors")
+                            for waiter in waiting:
+                                yield {"url": waiter, "error": f"parse failed: {e}"}
+                            continue
+                        get_metrics().observe("article.parse", seconds, url=url)
+                        cache.put(key, "article_parsed", request, parsed)
+                        for waiter in waiting:
+                            yield dict(parsed, url=waiter, sha256=digest)
+
+    def _submit_parse(self, url, html):
+        if self.parse_workers <= 0:
+            # Parsed here; wrapped in a Future so harvest() treats both paths alike
+            future = Future()
+            try:
+                future.set_result(parse_article(self.parser, url, html))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self._parse_pool.submit(parse_article, self.parser, url, html)
+
+    def close(self):
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+        self.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch and parse news articles concurrently")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--parser", choices=sorted(PARSERS), default=ARTICLE_PARSER)
+    parser.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS)
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    args = parser.parse_args()
+
+    harvester = ArticleHarvester(args.fetch_workers, args.parse_workers, parser=args.parser)
+    try:
+        for article in harvester.harvest(args.urls):
+            if "error" in article:
+                print(f"[ERROR] {article['url']}: {article['error']}")
+            else:
+                print(f"[✓] {article['url']}: {article['title']} ({len(article['text'])} chars)")
+    finally:
+        harvester.close()
+    print(f"[✓] Cache: {get_cache().summary()}")
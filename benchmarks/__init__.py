@@ -0,0 +1,4 @@
+"""Benchmarks for the capture pipeline. Run from the repository root, e.g.
+
+    python -m benchmarks.bench_metadata ./downloaded_images
+"""
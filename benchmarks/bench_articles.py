@@ -0,0 +1,93 @@
+import os
+import time
+import random
+import argparse
+import importlib.util
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_articles_")
+os.environ.setdefault("RESPONSE_CACHE", os.path.join(WORK_DIR, "response_cache.sqlite"))
+
+import requests  # noqa: E402
+from article_harvester import ArticleHarvester, PARSERS  # noqa: E402
+from benchmarks.corpus import WORDS, CITIES  # noqa: E402
+from benchmarks.servers import ImageHostServer  # noqa: E402
+
+
+def article_html(i, paragraphs, rng):
+    city = rng.choice(CITIES)[0]
+    title = f"{city}: " + " ".join(rng.choices(WORDS, k=8))
+    body = "\n".join(f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(40, 120)))}.</p>" for _ in range(paragraphs))
+    chrome = "".join(f'<li><a href="/section/{j}">{rng.choice(WORDS)}</a></li>' for j in range(200))
+    return (f'<!DOCTYPE html><html><head><title>{title} | News</title>'
+            f'<meta property="og:title" content="{title}">'
+            f'<meta property="og:image" content="https://news.example.com/images/{i}.jpg">'
+            f'<script>var tracking = "{"x" * 5000}";</script></head>'
+            f'<body><header><nav><ul>{chrome}</ul></nav></header>'
+            f'<article><h1>{title}</h1>{body}</article>'
+            f'<footer><p>Copyright News Example</p></footer></body></html>')
+
+
+def main():
+    default_parser = "newspaper" if importlib.util.find_spec("newspaper") else "html"
+    parser = argparse.ArgumentParser(description="Serial fetch-then-parse of news hits vs the article harvester")
+    parser.add_argument("--articles", type=int, default=60)
+    parser.add_argument("--syndicated", type=float, default=0.2, help="share of URLs republishing another's HTML")
+    parser.add_argument("--paragraphs", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.25)
+    parser.add_argument("--bandwidth", type=float, default=2e6, help="bytes/s per connection")
+    parser.add_argument("--parser", choices=sorted(PARSERS), default=default_parser)
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with ImageHostServer(latency=args.latency, bandwidth=args.bandwidth) as server:
+        pages = []
+        urls = []
+        for i in range(args.articles):
+            if pages and rng.random() < args.syndicated:
+                html = rng.choice(pages)
+            else:
+                html = article_html(i, args.paragraphs, rng)
+                pages.append(html)
+            urls.append(server.serve(f"story-{i}.html", html.encode("utf-8"), "text/html; charset=utf-8"))
+        print(f"[INFO] {len(urls)} articles ({len(pages)} distinct, {sum(map(len, pages)) / len(pages) / 1e3:.0f} KB "
+              f"each), parser {args.parser}, {args.parse_workers} parse workers on {os.cpu_count()} cores")
+
+        # The old path: download, then parse, one article after another
+        parse = PARSERS[args.parser]
+        session = requests.Session()
+        start = time.perf_counter()
+        serial = {}
+        first_serial = None
+        for url in urls:
+            serial[url] = parse(url, session.get(url).text)
+            first_serial = first_serial or time.perf_counter() - start
+        serial_seconds = time.perf_counter() - start
+
+        rows = []
+        for label in ("harvester", "cached"):
+            harvester = ArticleHarvester(parse_workers=args.parse_workers, parser=args.parser)
+            start = time.perf_counter()
+            first = None
+            harvested = {}
+            for article in harvester.harvest(urls):
+                first = first or time.perf_counter() - start
+                harvested[article["url"]] = article
+            rows.append((label, first, time.perf_counter() - start))
+            harvester.close()
+
+    print(f"{'mode':<10} {'first s':>8} {'total s':>8}")
+    print(f"{'serial':<10} {first_serial:8.2f} {serial_seconds:8.2f}")
+    for label, first, total in rows:
+        print(f"{label:<10} {first:8.2f} {total:8.2f}")
+    errors = [a for a in harvested.values() if "error" in a]
+    same = all(harvested[url]["text"] == serial[url]["text"] and harvested[url]["title"] == serial[url]["title"]
+               for url in urls if url in harvested and "error" not in harvested[url])
+    print(f"[✓] {len(harvested) - len(errors)} of {len(urls)} articles, {len(errors)} errors, "
+          f"same text as the serial parse: {same}; {serial_seconds / rows[0][2]:.1f}x faster cold, "
+          f"first article {first_serial / rows[0][1]:.1f}x sooner")
+
+
+if __name__ == "__main__":
+    main()
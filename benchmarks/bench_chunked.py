@@ -0,0 +1,80 @@
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import itertools
+import subprocess
+
+from benchmarks.bench_similarity import VOCABULARY_SIZE, WORDS_PER_CAPTION
+
+
+def stream_captions(n, seed):
+    """Same distribution as bench_similarity.synthetic_captions, generated lazily."""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(VOCABULARY_SIZE)))
+    for _ in range(n):
+        yield " ".join(rng.choices(words, cum_weights=cum_weights, k=WORDS_PER_CAPTION))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; children covers the worker processes (largest one)
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, workers
+
+
+def child(mode, targets, candidates, chunk_size, workers, top_k, threshold):
+    target_texts = list(stream_captions(targets, seed=1))
+    start = time.perf_counter()
+    if mode == "chunked":
+        from chunked_scoring import ChunkedScorer
+        scorer = ChunkedScorer(chunk_size=chunk_size, workers=workers)
+        pairs = ((f"c{i}", text) for i, text in enumerate(stream_captions(candidates, seed=2)))
+        matches = scorer.score(target_texts, pairs, threshold, top_k)
+    else:
+        from similarity_search import score_all
+        matches = score_all(target_texts, list(stream_captions(candidates, seed=2)), threshold, top_k)
+    elapsed = time.perf_counter() - start
+    own, worker = peak_rss_mb()
+    print(json.dumps({"seconds": elapsed, "rss_mb": own, "worker_rss_mb": worker,
+                      "kept": sum(len(m) for m in matches)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of in-memory vs chunked scoring as the corpus grows 10x")
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=50000, help="smallest corpus; the largest is 10x this")
+    parser.add_argument("--chunk-size", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--skip-baseline", action="store_true", help="only run the chunked scorer")
+    parser.add_argument("--child", choices=["chunked", "in-memory"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.targets, args.candidates, args.chunk_size, args.workers, args.top_k, args.threshold)
+        return
+
+    modes = ["chunked"] if args.skip_baseline else ["in-memory", "chunked"]
+    print(f"{'mode':<10} {'candidates':>10} {'seconds':>8} {'peak MB':>8} {'worker MB':>9}")
+    for mode in modes:
+        for scale in (1, 3, 10):
+            n = args.candidates * scale
+            # A fresh process per run, so each peak RSS is its own
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_chunked", "--child", mode, "--targets", str(args.targets),
+                 "--candidates", str(n), "--chunk-size", str(args.chunk_size), "--workers", str(args.workers),
+                 "--top-k", str(args.top_k), "--threshold", str(args.threshold)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(out)
+            worker = f"{result['worker_rss_mb']:9.0f}" if mode == "chunked" else f"{'-':>9}"
+            print(f"{mode:<10} {n:>10} {result['seconds']:8.1f} {result['rss_mb']:8.0f} {worker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import requests
+
+from downloader import Downloader
+from benchmarks.servers import ImageHostServer
+
+
+# Baseline: the original download_image loop, one blocking request at a time
+def download_sequential(jobs):
+    headers = {"User-Agent": "Mozilla/5.0"}
+    for url, save_path in jobs:
+        r = requests.get(url, headers=headers, stream=True, timeout=15)
+        if r.status_code == 200:
+            with open(save_path, "wb") as f:
+                shutil.copyfileobj(r.raw, f)
+
+
+def run(label, fn, jobs):
+    start = time.perf_counter()
+    fn(jobs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {len(jobs):>5} files  {elapsed:7.2f} s  {len(jobs) / elapsed:8.1f} files/s")
+    return elapsed
+
+
+def mixed_hosts(args, tmp):
+    """A slow host's backlog queued ahead of a fast host's jobs: the fast ones shouldn't wait behind it."""
+    slow_jobs, fast_jobs = args.images // 2, args.images // 2
+    with ImageHostServer(latency=args.slow_latency, image_size=args.size) as slow, \
+            ImageHostServer(latency=args.latency, image_size=args.size) as fast:
+        folder = os.path.join(tmp, "mixed")
+        os.makedirs(folder)
+        jobs = [(slow.url(f"slow{i}.jpg"), os.path.join(folder, f"slow{i}.jpg")) for i in range(slow_jobs)]
+        jobs += [(fast.url(f"fast{i}.jpg"), os.path.join(folder, f"fast{i}.jpg")) for i in range(fast_jobs)]
+        per_host = max(1, args.concurrency // 4)
+        downloader = Downloader(max_concurrency=args.concurrency, per_host=per_host)
+        start = time.perf_counter()
+        finished = {}
+        downloader.fetch_all(jobs, lambda outcome: finished.setdefault(outcome[0], time.perf_counter() - start))
+        total = time.perf_counter() - start
+        downloader.close()
+    fast_done = max(t for url, t in finished.items() if url.startswith(fast.url("")))
+    # With workers blocked on the slow host, the fast host would get only the leftover workers
+    # until the slow backlog drained
+    print(f"{'mixed hosts (per host ' + str(per_host) + ')':<36} {len(jobs):>5} files  {total:7.2f} s  "
+          f"fast host done after {fast_done:.2f} s")
+    return fast_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential vs pooled concurrent downloads against a local image host")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1, help="server-side delay per request (s)")
+    parser.add_argument("--size", type=int, default=200_000, help="bytes per image")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--per-host", type=int, default=16)
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="delay of the slow host in the mixed run (s)")
+    args = parser.parse_args()
+
+    with ImageHostServer(latency=args.latency, image_size=args.size) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        def jobs(tag):
+            folder = os.path.join(tmp, tag)
+            os.makedirs(folder)
+            return [(server.url(f"{i}.jpg"), os.path.join(folder, f"{i}.jpg")) for i in range(args.images)]
+
+        baseline = run("sequential requests.get", download_sequential, jobs("sequential"))
+
+        downloader = Downloader(max_concurrency=args.concurrency, per_host=args.per_host)
+        pooled = run(f"pooled x{args.concurrency} (per host {args.per_host})",
+                     lambda j: downloader.fetch_all(j), jobs("pooled"))
+        print(f"[✓] {downloader.stats.summary()}")
+        downloader.close()
+        print(f"[✓] Speedup: {baseline / pooled:.1f}x")
+        mixed_hosts(args, tmp)
+
+
+if __name__ == "__main__":
+    main()
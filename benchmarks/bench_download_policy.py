@@ -0,0 +1,70 @@
+import os
+import time
+import argparse
+import tempfile
+
+from downloader import Downloader
+from download_manifest import DownloadManifest
+from download_policy import DownloadPolicy
+from blob_store import BlobStore
+from benchmarks.servers import ImageHostServer, JUNK_KINDS
+
+
+class AcceptEverything(DownloadPolicy):
+    """The old behavior: any 200 response is saved."""
+
+    def check_size(self, nbytes):
+        pass
+
+    def check_headers(self, content_type, length):
+        pass
+
+    def check_head(self, head, complete=False):
+        return True
+
+
+def run(label, policy, jobs, tmp, store=None):
+    """Download `jobs` into tmp/<store> (default: the label), with its own manifest and blob store."""
+    store = store or label
+    os.makedirs(os.path.join(tmp, store), exist_ok=True)
+    downloader = Downloader(max_concurrency=8, per_host=8, policy=policy,
+                            manifest=DownloadManifest(os.path.join(tmp, f"{store}.sqlite")),
+                            blobs=BlobStore(os.path.join(tmp, f"{store}-blobs")))
+    start = time.perf_counter()
+    done = downloader.fetch_all([(url, os.path.join(tmp, store, name)) for url, name in jobs])
+    elapsed = time.perf_counter() - start
+    stats = downloader.stats
+    downloader.close()
+    downloader.manifest.close()
+    saved = sum(nbytes is not None for _, _, nbytes in done)
+    received = (stats.bytes + stats.wasted_bytes) / 1e6
+    print(f"{label:<10} {elapsed:7.2f} s  {received:8.1f} MB received  {saved:>5} files saved for metadata/scoring")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloads with and without early rejection of junk responses")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--junk", type=float, default=0.3, help="share of hits that are HTML, SVG, thumbnails or huge TIFFs")
+    parser.add_argument("--size", type=int, default=400_000, help="bytes per real image")
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    junk_every = max(1, round(1 / args.junk)) if args.junk else None
+    jobs = []
+    with ImageHostServer(latency=args.latency, image_size=args.size) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        for i in range(args.images):
+            kind = JUNK_KINDS[(i // junk_every) % len(JUNK_KINDS)] if junk_every and i % junk_every == 0 else None
+            jobs.append((server.url(f"{i}.jpg", junk=kind), f"{i}.jpg"))
+        print(f"[INFO] {len(jobs)} hits, {sum('/junk/' in url for url, _ in jobs)} of them junk")
+
+        run("accept", AcceptEverything(), jobs, tmp)
+        stats = run("policy", DownloadPolicy(), jobs, tmp)
+        print(f"[✓] {stats.rejection_summary().lstrip('; ')}")
+        rerun = run("rerun", DownloadPolicy(), jobs, tmp, store="policy")
+        print(f"[✓] Rerun: {rerun.known_rejections} rejections answered from the manifest")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+from PIL import Image, ImageDraw
+
+from embedding_backend import EmbeddingIndex, get_encoder, ENCODERS
+
+
+def synthetic_images(folder, n, size=(640, 480), seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n):
+        img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(8):
+            x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.rectangle([x0, y0, x0 + rng.randrange(200), y0 + rng.randrange(200)],
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+        path = os.path.join(folder, f"img_{i:05d}.jpg")
+        img.save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+class LazyDimEncoder:
+    """Wraps an encoder whose dim, like ClipEncoder's, is unknown until the first encode."""
+
+    def __init__(self, encoder):
+        self._encoder = encoder
+        self.name = encoder.name
+        self.image_size = encoder.image_size
+        self.dim = None
+
+    def encode(self, images):
+        self.dim = self._encoder.dim
+        return self._encoder.encode(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time batched embedding with the memory-mapped vector store")
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--targets", type=int, default=10)
+    parser.add_argument("--encoder", choices=sorted(ENCODERS), default="histogram")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic_images(tmp, args.images)
+        store = os.path.join(tmp, "store")
+        targets, candidates = paths[:args.targets], paths[args.targets:]
+
+        for label in ("cold", "warm"):
+            index = EmbeddingIndex(get_encoder(args.encoder), root=store, batch_size=args.batch_size)
+            start = time.perf_counter()
+            ranked = index.rank(targets, candidates, threshold=0.0, top_k=5)
+            elapsed = time.perf_counter() - start
+            print(f"{label:<5} {len(paths)} images, {index.encoded:>5} encoded  {elapsed:7.2f} s  "
+                  f"{len(paths) / elapsed:8.1f} images/s")
+
+        # A warm run must reuse the store even when the encoder's dim isn't known before it encodes
+        lazy = EmbeddingIndex(LazyDimEncoder(get_encoder(args.encoder)), root=store, batch_size=args.batch_size)
+        lazy.rank(targets, candidates, threshold=0.0, top_k=5)
+        if lazy.encoded:
+            print(f"[✗] Warm run with a lazily sized encoder re-encoded {lazy.encoded} images")
+            raise SystemExit(1)
+        print("[✓] Warm run with a lazily sized encoder encoded nothing")
+        best = ranked[targets[0]][0] if ranked[targets[0]] else None
+        print(f"[✓] Top match for {os.path.basename(targets[0])}: {best}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import argparse
+
+from benchmarks.bench_metadata import collect_images, read_pooled, timed
+from benchmarks.corpus import make_corpus
+import fast_metadata
+
+
+def read_fast(paths):
+    for path in paths:
+        fast_metadata.read_fast(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Files/sec of the in-process header reader vs the pooled exiftool reader")
+    parser.add_argument("root", nargs="?", help="images to read (default: a synthetic JPEG corpus)")
+    parser.add_argument("--count", type=int, default=500, help="size of the synthetic corpus")
+    parser.add_argument("--corpus-dir", default="./bench_fast_metadata")
+    parser.add_argument("--repeat", type=int, default=1, help="replicate the file list to simulate a larger corpus")
+    parser.add_argument("--pool-size", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--skip-exiftool", action="store_true")
+    args = parser.parse_args()
+
+    if args.root:
+        paths = collect_images(args.root)
+    else:
+        paths = [path for path, _ in make_corpus(args.corpus_dir, args.count)]
+    paths *= args.repeat
+    if not paths:
+        print(f"[✗] No images found under {args.root}")
+        sys.exit(1)
+
+    handled = sum(fast_metadata.read_fast(path) is not None for path in set(paths))
+    print(f"[INFO] {handled} of {len(set(paths))} distinct files are JPEG/PNG/TIFF the fast reader handles")
+    fast = timed("fast_metadata (in-process)", lambda: read_fast(paths), len(paths))
+    if not args.skip_exiftool:
+        pooled = timed(f"exiftool pool x{args.pool_size}", lambda: read_pooled(paths, args.pool_size, args.batch_size),
+                       len(paths))
+        print(f"[✓] Speedup: {fast / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
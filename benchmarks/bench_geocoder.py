@@ -0,0 +1,86 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_geocoder_")
+os.environ.setdefault("RESPONSE_CACHE", os.path.join(WORK_DIR, "response_cache.sqlite"))
+
+from geocoder import ReverseGeocoder, EARTH_RADIUS_KM, NOMINATIM_INTERVAL  # noqa: E402
+from benchmarks.corpus import CITIES  # noqa: E402
+
+
+def write_geonames(path, n, rng):
+    """A GeoNames-format dump: the corpus cities plus `n` places scattered uniformly over the globe."""
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lon = rng.uniform(-180, 180, n)
+    with open(path, "w", encoding="utf-8") as f:
+        rows = [(name, la, lo, cc) for name, _, cc, la, lo in CITIES]
+        rows += [(f"Place {i}", lat[i], lon[i], "XX") for i in range(n)]
+        for i, (name, la, lo, cc) in enumerate(rows):
+            f.write(f"{i}\t{name}\t{name}\t\t{la:.5f}\t{lo:.5f}\tP\tPPL\t{cc}\t\t01\t\t\t\t1000\t\t10\tUTC\t2024-01-01\n")
+
+
+def haversine_nearest(lat, lon, glat, glon):
+    """Index and km of the nearest gazetteer entry, by brute force."""
+    p1, p2 = np.radians(lat), np.radians(glat)
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(glon - lon) / 2) ** 2
+    km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+    i = int(np.argmin(km))
+    return i, km[i]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline reverse geocoding: load time, batch lookups, accuracy")
+    parser.add_argument("--places", type=int, default=200000, help="gazetteer size")
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("--max-km", type=float, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    path = os.path.join(WORK_DIR, "cities.txt")
+    write_geonames(path, args.places, rng)
+
+    start = time.perf_counter()
+    cold = ReverseGeocoder(path, args.max_km, fallback=False)
+    cold_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    geocoder = ReverseGeocoder(path, args.max_km, fallback=False)
+    warm_seconds = time.perf_counter() - start
+    print(f"[INFO] {len(cold.gazetteer)} places: {cold_seconds:.2f} s to parse and index, "
+          f"{warm_seconds:.2f} s from the saved arrays")
+
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, args.queries)))
+    lon = rng.uniform(-180, 180, args.queries)
+    points = list(zip(lat.tolist(), lon.tolist()))
+    start = time.perf_counter()
+    places = geocoder.reverse_many(points)
+    seconds = time.perf_counter() - start
+    found = sum(p is not None for p in places)
+    print(f"[✓] {args.queries} points in {seconds:.2f} s ({1e6 * seconds / args.queries:.1f} µs each), "
+          f"{found} within {args.max_km:g} km of a place")
+
+    start = time.perf_counter()
+    indices, distances = geocoder.gazetteer.nearest(lat, lon, args.max_km)
+    tree_seconds = time.perf_counter() - start
+    print(f"[✓] Tree query alone: {1e6 * tree_seconds / args.queries:.2f} µs per point")
+
+    # Same answers as an exhaustive haversine search (ties may pick another index at the same distance)
+    g = geocoder.gazetteer
+    glat, glon = g.lat.astype(np.float64), g.lon.astype(np.float64)
+    sample = range(0, args.queries, max(1, args.queries // 500))
+    mismatches = 0
+    for n in sample:
+        _, km = haversine_nearest(lat[n], lon[n], glat, glon)
+        if km > args.max_km:
+            mismatches += indices[n] != -1
+        else:
+            mismatches += indices[n] == -1 or abs(distances[n] - km) > 1e-3
+    print(f"[✓] {mismatches} mismatches against brute-force haversine on a sample of {len(sample)} points")
+    print(f"[INFO] Nominatim alone, at one request per {NOMINATIM_INTERVAL:g} s: "
+          f"{args.queries * NOMINATIM_INTERVAL / 3600:.1f} h for these points")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+
+from metadata_reader import ExifToolPool
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".cr2")
+
+
+def collect_images(root):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for fname in filenames:
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, fname))
+    return sorted(paths)
+
+
+# Baseline: what the scripts used to do, one exiftool process per file
+def read_per_process(paths):
+    for path in paths:
+        result = subprocess.run(["exiftool", "-j", "-G", path], capture_output=True, text=True)
+        if result.stdout.strip():
+            json.loads(result.stdout)
+
+
+def read_pooled(paths, pool_size, batch_size):
+    pool = ExifToolPool(size=pool_size, batch_size=batch_size)
+    try:
+        pool.read(paths)
+    finally:
+        pool.close()
+
+
+def timed(label, fn, n):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    rate = n / elapsed if elapsed else float("inf")
+    print(f"{label:<32} {n:>7} files  {elapsed:8.2f} s  {rate:10.1f} files/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-file exiftool calls with the pooled -stay_open reader")
+    parser.add_argument("root", nargs="?", default="./downloaded_images")
+    parser.add_argument("--repeat", type=int, default=1, help="replicate the file list to simulate a larger corpus")
+    parser.add_argument("--pool-size", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    paths = collect_images(args.root) * args.repeat
+    if not paths:
+        print(f"[✗] No images found under {args.root}")
+        sys.exit(1)
+
+    baseline = None
+    if not args.skip_baseline:
+        baseline = timed("one process per file", lambda: read_per_process(paths), len(paths))
+    pooled = timed(
+        f"pool x{args.pool_size}, batch {args.batch_size}",
+        lambda: read_pooled(paths, args.pool_size, args.batch_size),
+        len(paths)
+    )
+    if baseline:
+        print(f"[✓] Speedup: {pooled / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+from phash_index import HashCache, DUPLICATE_DISTANCE, SUBSTRINGS, cluster_near_duplicates, popcounts
+
+
+def synthetic_hashes(count, copies, rng):
+    """{path: (dhash, phash, width, height)}: random photos, each with a few re-encodes a few bits off."""
+    hashes = {}
+    while len(hashes) < count:
+        phash = rng.getrandbits(64)
+        hashes[f"/bench/{len(hashes):07d}.jpg"] = (0, phash, 1024, 768)
+        for _ in range(rng.randrange(copies + 1)):
+            near = phash
+            for bit in rng.sample(range(64), rng.randrange(DUPLICATE_DISTANCE + 1)):
+                near ^= 1 << bit
+            hashes[f"/bench/{len(hashes):07d}.jpg"] = (0, near, 800, 600)
+    return hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time multi-index pHash lookups and clustering")
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--copies", type=int, default=2, help="max near-duplicates per photo")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hashes = synthetic_hashes(args.count, args.copies, rng)
+    values = np.array([h[1] for h in hashes.values()], dtype=np.uint64)
+    paths = list(hashes)
+
+    with tempfile.TemporaryDirectory(prefix="bench_phash_") as work:
+        cache = HashCache(os.path.join(work, "phash.sqlite"))
+        start = time.perf_counter()
+        cache.multi_index(hashes)
+        print(f"[INFO] Built and saved {SUBSTRINGS} substring tables over {len(hashes)} hashes in "
+              f"{time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        index = cache.multi_index(hashes)
+        print(f"[INFO] Reloaded them on the next run in {time.perf_counter() - start:.2f}s")
+
+    queries = rng.sample(paths, min(args.queries, len(paths)))
+    candidates = wrong = 0
+    start = time.perf_counter()
+    for path in queries:
+        candidates += len(index.candidates(hashes[path][1], DUPLICATE_DISTANCE))
+        index.search(hashes[path][1], DUPLICATE_DISTANCE)
+    search_time = (time.perf_counter() - start) / len(queries)
+    for path in queries[:200]:
+        found = {other for _, other in index.search(hashes[path][1], DUPLICATE_DISTANCE)}
+        expected = {paths[i] for i in np.flatnonzero(popcounts(values ^ np.uint64(hashes[path][1]))
+                                                      <= DUPLICATE_DISTANCE)}
+        wrong += found != expected
+    print(f"[INFO] r={DUPLICATE_DISTANCE}: {candidates / len(queries):.0f} candidates per query "
+          f"({candidates / len(queries) / len(hashes):.2%} of {len(hashes)}), {search_time * 1e6:.0f}µs per query")
+    if wrong:
+        print(f"[✗] {wrong} of {min(200, len(queries))} queries differ from a brute-force scan")
+    else:
+        print(f"[✓] {min(200, len(queries))} queries match a brute-force scan")
+
+    start = time.perf_counter()
+    clusters = cluster_near_duplicates(hashes, DUPLICATE_DISTANCE, index)
+    print(f"[INFO] Clustered {len(hashes)} hashes into {len(clusters)} groups in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
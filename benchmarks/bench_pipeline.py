@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import time
+import random
+import runpy
+import importlib
+import shutil
+import argparse
+import tempfile
+import functools
+import subprocess
+from urllib.parse import urlsplit, parse_qs
+
+from benchmarks.corpus import scene, synthetic_fields, related_fields, write_jpeg, jpeg_bytes
+from benchmarks.servers import ImageHostServer, SearchEngineServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("exifsearch", "download", "similarity", "analyze")
+# Whole-job runs over a fresh workspace: the three scripts in sequence, and pipeline.py's streaming job
+CHAINS = ("chain", "pipeline")
+SCRIPTS = {"exifsearch": "exifsearch", "download": "download_newimages", "similarity": "similarity_search",
+           "analyze": "analyzeimage", "pipeline": "pipeline"}
+
+
+class CorpusSearchServer(SearchEngineServer):
+    """Fake SerpAPI whose results for a query are the corpus images registered for it."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.hits = {}
+
+    def links_for(self, body):
+        query = parse_qs(urlsplit(body.decode("utf-8", "replace")).query).get("q", [""])[0]
+        return self.hits.get(query, [])
+
+
+def build_corpus(workspace, inputs, hits, related, search, host, seed=0):
+    """Write `inputs` captioned JPEGs to workspace/input_images and register `hits` search results for each.
+
+    A `related` share of each input's hits are other photos of its story
+    (same place and date, a reworded caption); the rest are unrelated.
+    """
+    rng = random.Random(seed)
+    input_dir = os.path.join(workspace, "input_images")
+    os.makedirs(input_dir, exist_ok=True)
+    tmp_path = os.path.join(workspace, "hit.tmp.jpg")
+    for i in range(inputs):
+        fields = synthetic_fields(i, rng)
+        write_jpeg(os.path.join(input_dir, f"input_{i:04d}.jpg"), fields, image=scene(i))
+        links = []
+        for j in range(hits):
+            n = i * hits + j
+            hit_fields = related_fields(fields, n, rng) if j < hits * related else synthetic_fields(n, rng)
+            body = jpeg_bytes(hit_fields, scene(100000 + n, (400, 300)), tmp_path)
+            links.append(host.serve(f"hit_{n:06d}.jpg", body))
+        search.hits[fields["caption"]] = links
+
+
+def time_calls(owner, name, samples):
+    """Replace owner.name with a wrapper appending each call's duration to `samples`."""
+    fn = getattr(owner, name)
+
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    setattr(owner, name, timed)
+
+
+def run_script(module, argv=()):
+    sys.argv = [module + ".py", *argv]
+    runpy.run_module(module, run_name="__main__")
+
+
+def list_images(folder):
+    return [f for f in os.listdir(folder) if f.lower().endswith((".jpg", ".jpeg"))]
+
+
+def child(stage):
+    """Run one stage in the current directory (a workspace); returns items, seconds and per-item latencies."""
+    samples, parts = [], {}
+    # Imports (scikit-learn alone takes seconds here) are timed apart, so `seconds` is the work itself
+    start = time.perf_counter()
+    for script in ("exifsearch", "download", "similarity") if stage == "chain" else (stage,):
+        importlib.import_module(SCRIPTS[script])
+    import_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    if stage == "exifsearch":
+        from response_cache import ResponseCache
+        time_calls(ResponseCache, "fetch", samples)
+        run_script("exifsearch")
+        items = len(samples)
+    elif stage == "download":
+        from downloader import Downloader
+        # fetch_all queues jobs per host, so transfers are timed rather than fetch() calls
+        time_calls(Downloader, "_transfer", samples)
+        run_script("download_newimages")
+        items = len(samples)
+    elif stage == "similarity":
+        # One batch: no per-item latency, throughput is candidates scored per second
+        run_script("similarity_search")
+        from similarity_search import list_candidates
+        items = len(list_candidates("./downloaded_images"))
+    elif stage == "analyze":
+        import analyzeimage
+        time_calls(analyzeimage, "extract_priority_metadata_fields", samples)
+        analyzeimage.main()
+        items = len(samples)
+    elif stage == "chain":
+        # Batch scripts have no per-input latency; each script's share of the time is reported instead
+        for script in ("exifsearch", "download", "similarity"):
+            script_start = time.perf_counter()
+            run_script(SCRIPTS[script])
+            parts[script] = round(time.perf_counter() - script_start, 4)
+        items = len(list_images("./input_images"))
+    else:
+        run_script("pipeline")
+        items = len(list_images("./input_images"))
+    seconds = time.perf_counter() - start
+    return {"items": items, "seconds": seconds, "import_seconds": import_seconds, "samples": samples, "parts": parts}
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def run_child(stage, workspace, env, log):
+    """Run `stage` in a fresh process inside `workspace`; returns the run record including its peak RSS."""
+    result_path = os.path.join(workspace, f".{stage}.json")
+    with open(log, "a") as err:
+        err.write(f"--- {stage} in {workspace}\n")
+        err.flush()
+        process = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_pipeline", "--child", stage,
+                                    "--result", result_path], cwd=workspace, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=err)
+        # wait4 gives this child's own ru_maxrss (KiB on Linux), not the max over all children
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{stage} exited with {process.returncode}; see {log}")
+    with open(result_path) as f:
+        result = json.load(f)
+    samples = result["samples"]
+    run = {
+        "stage": stage,
+        "items": result["items"],
+        "seconds": round(result["seconds"], 4),
+        "import_seconds": round(result["import_seconds"], 4),
+        "throughput": round(result["items"] / result["seconds"], 2) if result["seconds"] else None,
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 3) if samples else None,
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3) if samples else None,
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+    if result["parts"]:
+        run["parts"] = result["parts"]
+    return run
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, report):
+    with open(old_path) as f:
+        old = {(run["stage"], run["scale"]): run for run in json.load(f)["runs"]}
+    print(f"\nvs {old_path}:")
+    print(f"{'stage':<11} {'scale':>5} {'seconds':>17} {'p95 ms':>17} {'peak MB':>15}")
+    for run in report["runs"]:
+        before = old.get((run["stage"], run["scale"]))
+        if not before:
+            continue
+        cells = []
+        for key, width in (("seconds", 17), ("p95_ms", 17), ("peak_rss_mb", 15)):
+            a, b = before.get(key), run.get(key)
+            cell = f"{a:.2f} -> {b:.2f}" + (f" {100 * (b - a) / a:+.0f}%" if a else "") if None not in (a, b) else "-"
+            cells.append(f"{cell:>{width}}")
+        print(f"{run['stage']:<11} {run['scale']:>5} {' '.join(cells)}")
+
+
+def print_run(run):
+    p50 = f"{run['p50_ms']:8.1f}" if run["p50_ms"] is not None else f"{'-':>8}"
+    p95 = f"{run['p95_ms']:8.1f}" if run["p95_ms"] is not None else f"{'-':>8}"
+    print(f"{run['stage']:<11} {run['scale']:>5} {run['items']:>6} {run['seconds']:8.2f} "
+          f"{run['throughput'] or 0:8.1f} {p50} {p95} {run['peak_rss_mb']:8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of every pipeline stage against local "
+                                                 "stand-ins for SerpAPI and image hosts")
+    parser.add_argument("--scales", default="4,16,64", help="comma-separated numbers of input images")
+    parser.add_argument("--hits", type=int, default=10, help="search results per input image")
+    parser.add_argument("--related", type=float, default=0.5, help="share of hits that belong to the input's story")
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--search-failure-rate", type=float, default=0.0)
+    parser.add_argument("--host-latency", type=float, default=0.05)
+    parser.add_argument("--host-failure-rate", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, help="bytes/s per image host connection (default: unpaced)")
+    parser.add_argument("--stages", default=",".join(STAGES + CHAINS))
+    parser.add_argument("--exiftool", action="store_true", help="read metadata with exiftool instead of in-process")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier --output to print deltas against")
+    parser.add_argument("--keep", action="store_true", help="keep the workspaces (printed) for inspection")
+    parser.add_argument("--child", choices=STAGES + CHAINS, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.result, "w") as f:
+            json.dump(child(args.child), f)
+        return
+
+    scales = [int(s) for s in args.scales.split(",")]
+    stages = [s for s in args.stages.split(",") if s]
+    root = tempfile.mkdtemp(prefix="bench_pipeline_")
+    log = os.path.join(root, "stages.log")
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("child", "result", "output", "compare", "keep")},
+        "runs": [],
+    }
+
+    with CorpusSearchServer(default_latency=args.search_latency, failure_rate=args.search_failure_rate) as search, \
+            ImageHostServer(latency=args.host_latency, failure_rate=args.host_failure_rate,
+                            bandwidth=args.bandwidth) as host:
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, SERPAPI_KEY="bench", RESPONSE_CACHE_TTL="0",
+                   SERPAPI_ENDPOINT=search.url("serpapi"), FAST_METADATA="0" if args.exiftool else "1")
+        print(f"{'stage':<11} {'scale':>5} {'items':>6} {'seconds':>8} {'items/s':>8} {'p50 ms':>8} "
+              f"{'p95 ms':>8} {'peak MB':>8}")
+        for scale in scales:
+            # Every stage run reads what the previous one left in the same workspace; chains start over
+            staged = os.path.join(root, f"{scale}-stages")
+            build_corpus(staged, scale, args.hits, args.related, search, host, seed=scale)
+            print(f"[INFO] {scale} inputs x {args.hits} hits in {staged}")
+            for stage in stages:
+                workspace = staged
+                if stage in CHAINS:
+                    workspace = os.path.join(root, f"{scale}-{stage}")
+                    shutil.copytree(os.path.join(staged, "input_images"), os.path.join(workspace, "input_images"))
+                run = {"scale": scale, **run_child(stage, workspace, env, log)}
+                report["runs"].append(run)
+                print_run(run)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[✓] Wrote {len(report['runs'])} runs to {args.output}")
+    if args.compare:
+        compare(args.compare, report)
+    if args.keep:
+        print(f"[INFO] Workspaces and stage output kept in {root}")
+    else:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import time
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+from PIL import Image
+
+from benchmarks.servers import SearchEngineServer
+
+
+def camera_jpeg(path, width, height, seed):
+    """A smooth gradient with sensor-like noise, saved the way cameras do (q95, 4:4:4)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, "JPEG", quality=95, subsampling=0)
+
+
+def run(label, fn, paths, server):
+    before = server.bytes_received
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        fn(paths)
+    elapsed = time.perf_counter() - start
+    uploaded = (server.bytes_received - before) / 1e6
+    print(f"{label:<28} {len(paths):>4} images  {elapsed:7.2f} s  {len(paths) / elapsed:6.1f} images/s  "
+          f"{uploaded:8.1f} MB uploaded")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reverse image search: sequential vs fan-out, originals vs derivatives, "
+                                                 "against local stand-in engines")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--google-latency", type=float, default=0.3)
+    parser.add_argument("--bing-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    latency = {"serpapi": args.google_latency, "bing": args.bing_latency}
+    with SearchEngineServer(latency=latency) as server, tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "SERPAPI_KEY": "benchmark",
+            "BING_API_KEY": "benchmark",
+            "SERPAPI_ENDPOINT": server.url("serpapi"),
+            "BING_VISUAL_ENDPOINT": server.url("bing"),
+            "RESPONSE_CACHE": os.path.join(tmp, "responses.sqlite"),
+            "DERIVATIVE_DIR": os.path.join(tmp, "derivatives"),
+            # Every run must reach the server, not the cache
+            "RESPONSE_CACHE_TTL": "0",
+        })
+        import NEEDSAPI_revimage as revimage
+        from search_derivative import get_derivatives
+
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(tmp, f"{i}.jpg")
+            camera_jpeg(path, args.width, args.height, seed=i)
+            paths.append(path)
+        engines = {"google": revimage.search_google_reverse, "bing": revimage.search_bing_visual}
+
+        # Baseline: the original loop, one engine after another per image, uploading originals
+        def sequential(image_paths):
+            for path in image_paths:
+                for search in engines.values():
+                    search(revimage.SearchImage(path, optimize=False))
+
+        merged = {}
+        raw = []
+        stats = revimage.EngineStats()
+
+        def fan_out(image_paths):
+            on_result = lambda path, engine, results, so_far: raw.append(len(results))
+            merged.update(revimage.search_all_engines(image_paths, engines, on_result, stats))
+
+        baseline = run("sequential, originals", sequential, paths, server)
+        revimage.OPTIMIZE_UPLOADS = False
+        fanned = run("fan-out, originals", fan_out, paths, server)
+        revimage.OPTIMIZE_UPLOADS = True
+        optimized = run("fan-out, derivatives (cold)", fan_out, paths, server)
+        warm = run("fan-out, derivatives (warm)", fan_out, paths, server)
+
+        unique = sum(len(results) for results in merged.values())
+        print(f"[✓] {sum(raw) // 3} raw results per run merged to {unique} unique links")
+        print(f"[✓] {get_derivatives().summary()}")
+        print(f"[✓] Engine latency (all fan-out runs):\n{stats.summary()}")
+        print(f"[✓] Speedup: fan-out {baseline / fanned:.1f}x, with derivatives {baseline / optimized:.1f}x "
+              f"cold / {baseline / warm:.1f}x warm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import time
+import random
+import argparse
+
+from similarity_search import score_all
+
+VOCABULARY_SIZE = 20000
+WORDS_PER_CAPTION = 25
+
+
+def synthetic_captions(n, seed):
+    rng = random.Random(seed)
+    # Zipf-ish word frequencies, like real captions
+    weights = [1.0 / (rank + 1) for rank in range(VOCABULARY_SIZE)]
+    words = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    return [" ".join(rng.choices(words, weights, k=WORDS_PER_CAPTION)) for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time many-to-many caption scoring")
+    parser.add_argument("--targets", type=int, default=1000)
+    parser.add_argument("--candidates", type=int, default=100000)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--top-k", type=int, default=50)
+    args = parser.parse_args()
+
+    targets = synthetic_captions(args.targets, seed=1)
+    candidates = synthetic_captions(args.candidates, seed=2)
+
+    start = time.perf_counter()
+    matches = score_all(targets, candidates, args.threshold, args.top_k)
+    elapsed = time.perf_counter() - start
+    kept = sum(len(m) for m in matches)
+    print(f"{args.targets} x {args.candidates} scored in {elapsed:.2f} s ({kept} matches kept)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_spatial_")
+
+from metadata_catalog import MetadataCatalog  # noqa: E402
+from spatial_index import capture_timestamp, haversine_km, KM_PER_DEGREE  # noqa: E402
+from instrumentation import percentile  # noqa: E402
+from benchmarks.corpus import CITIES  # noqa: E402
+
+START = capture_timestamp("2012-01-01T00:00:00")
+YEARS = 10
+
+
+def synthetic_images(n, rng):
+    """(path, lat, lon, ts) rows: most shot at events around the corpus cities, the rest anywhere, any time.
+
+    One in ten has no GPS and one in twenty no date, as with real downloads.
+    """
+    events = rng.integers(0, len(CITIES), 2000)
+    event_ts = START + rng.integers(0, YEARS * 365 * 86400, len(events))
+    event_lat = np.array([CITIES[e][3] for e in events]) + rng.normal(0, 0.3, len(events))
+    event_lon = np.array([CITIES[e][4] for e in events]) + rng.normal(0, 0.3, len(events))
+    pick = rng.integers(0, len(events), n)
+    lat = event_lat[pick] + rng.normal(0, 0.02, n)
+    lon = event_lon[pick] + rng.normal(0, 0.02, n)
+    ts = event_ts[pick] + rng.normal(0, 4 * 3600, n).astype(np.int64)
+    scattered = rng.random(n) < 0.3
+    lat[scattered] = np.degrees(np.arcsin(rng.uniform(-1, 1, scattered.sum())))
+    lon[scattered] = rng.uniform(-180, 180, scattered.sum())
+    ts[scattered] = START + rng.integers(0, YEARS * 365 * 86400, scattered.sum())
+    has_gps = rng.random(n) >= 0.1
+    has_date = rng.random(n) >= 0.05
+    return lat, lon, ts, has_gps, has_date
+
+
+def seed_catalog(db_path, lat, lon, ts, has_gps, has_date):
+    """Write image rows straight into a catalog file, as if every file had been scanned."""
+    db = sqlite3.connect(db_path)
+    dates = [time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) for t in ts.tolist()]
+    rows = ((f"/photos/{i:08d}.jpg", 1000, 0, f"{i:064x}", dates[i] if has_date[i] else None,
+             int(dates[i][:4]) if has_date[i] else None, float(lat[i]) if has_gps[i] else None,
+             float(lon[i]) if has_gps[i] else None, "{}") for i in range(len(ts)))
+    with db:
+        db.executemany("INSERT INTO images (path, size, mtime_ns, sha256, date, year, gps_lat, gps_lon, metadata) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return db
+
+
+def bbox_query(db, lat, lon, km, start, end):
+    """The catalog's old way: the (gps_lat, gps_lon) index on a bounding box, then date strings and distance."""
+    dlat = km / KM_PER_DEGREE
+    dlon = km / (KM_PER_DEGREE * max(np.cos(np.radians(abs(lat) + dlat)), 1e-6))
+    sql = "SELECT path, gps_lat, gps_lon, date FROM images WHERE gps_lat BETWEEN ? AND ? AND gps_lon BETWEEN ? AND ?"
+    params = [lat - dlat, lat + dlat, lon - dlon, lon + dlon]
+    if start is not None:
+        sql += " AND date BETWEEN ? AND ?"
+        params += [time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) for t in (start, end)]
+    rows = db.execute(sql, params).fetchall()
+    if not rows:
+        return set()
+    km_to = haversine_km(lat, lon, np.array([r[1] for r in rows]), np.array([r[2] for r in rows]))
+    return {r[0] for r, d in zip(rows, km_to) if d <= km}
+
+
+def brute_force(arrays, lat, lon, km, start, end):
+    """Indices of the matching images by an exhaustive scan of in-memory arrays."""
+    all_lat, all_lon, all_ts, has_gps, has_date = arrays
+    keep = np.ones(len(all_ts), dtype=bool)
+    if km is not None:
+        keep &= has_gps & (haversine_km(lat, lon, all_lat, all_lon) <= km)
+    if start is not None:
+        keep &= has_date & (all_ts >= start) & (all_ts <= end)
+    return set(np.flatnonzero(keep).tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Radius + time-window queries on the catalog's places index")
+    parser.add_argument("--images", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    arrays = synthetic_images(args.images, rng)
+    lat, lon, ts, has_gps, has_date = arrays
+    db_path = os.path.join(WORK_DIR, "catalog.sqlite")
+    catalog = MetadataCatalog(db_path)
+    start = time.perf_counter()
+    db = seed_catalog(db_path, *arrays)
+    seed_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed = catalog.rebuild_places()
+    index_seconds = time.perf_counter() - start
+    print(f"[INFO] {args.images} images ({indexed} with GPS or a date): {seed_seconds:.1f} s to insert, "
+          f"{index_seconds:.1f} s to build the places index")
+
+    # Query around real images, as the similarity filter does
+    centers = rng.choice(np.flatnonzero(has_gps & has_date), args.queries, replace=False)
+    cases = [("2 km, 6 h", 2, 6), ("2 km", 2, None), ("50 km, 3 days", 50, 72), ("6 h", None, 6)]
+    print(f"{'query':<14} {'hits':>8} {'index p50 ms':>13} {'p95 ms':>8} {'bbox p50 ms':>12} {'brute p50 ms':>13} "
+          f"{'mismatches':>11}")
+    for label, km, hours in cases:
+        index_times, bbox_times, brute_times, hits, mismatches = [], [], [], [], 0
+        for i in centers.tolist():
+            window = (int(ts[i]) - hours * 3600, int(ts[i]) + hours * 3600) if hours else (None, None)
+            t0 = time.perf_counter()
+            found = catalog.near(lat[i] if km else None, lon[i] if km else None, km, *window)
+            t1 = time.perf_counter()
+            expected = brute_force(arrays, lat[i], lon[i], km, *window)
+            t2 = time.perf_counter()
+            if km:
+                bbox_query(db, float(lat[i]), float(lon[i]), km, *window)
+                bbox_times.append(time.perf_counter() - t2)
+            index_times.append(t1 - t0)
+            brute_times.append(t2 - t1)
+            hits.append(len(found))
+            mismatches += {int(row["path"][8:16]) for row in found} != expected
+        bbox = f"{1000 * percentile(bbox_times, 0.5):12.2f}" if bbox_times else f"{'-':>12}"
+        print(f"{label:<14} {np.mean(hits):8.0f} {1000 * percentile(index_times, 0.5):13.2f} "
+              f"{1000 * percentile(index_times, 0.95):8.2f} {bbox} {1000 * percentile(brute_times, 0.5):13.2f} "
+              f"{mismatches:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import io
+import os
+import time
+import random
+import argparse
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_tiered_")
+# Keep every store this benchmark touches out of the working tree; read the input's IPTC in-process
+os.environ.setdefault("METADATA_CATALOG", os.path.join(WORK_DIR, "catalog.sqlite"))
+os.environ.setdefault("DOWNLOAD_MANIFEST", os.path.join(WORK_DIR, "manifest.sqlite"))
+os.environ.setdefault("BLOB_DIR", os.path.join(WORK_DIR, "blobs"))
+os.environ.setdefault("PHASH_DB", os.path.join(WORK_DIR, "phash.sqlite"))
+os.environ.setdefault("FAST_METADATA", "1")
+
+from PIL import Image  # noqa: E402
+from downloader import Downloader  # noqa: E402
+from download_manifest import DownloadManifest  # noqa: E402
+from blob_store import BlobStore  # noqa: E402
+from tiered_fetch import TieredFetcher, PREFILTER_THRESHOLD  # noqa: E402
+from benchmarks.corpus import scene, synthetic_fields, write_jpeg, WORDS  # noqa: E402
+from benchmarks.servers import ImageHostServer, fake_jpeg  # noqa: E402
+
+# Titles of unrelated hits: the query's words mixed with other topics', as search results are
+OTHER_WORDS = ["wallpaper", "stock", "vector", "logo", "recipe", "sunset", "beach", "wedding", "poster", "sale",
+               "concert", "football", "garden", "cat", "car", "interior", "fashion", "map", "icon", "meme"]
+
+
+def thumbnail(image):
+    buf = io.BytesIO()
+    image.resize((200, 150), Image.Resampling.LANCZOS).save(buf, "JPEG", quality=75)
+    return buf.getvalue()
+
+
+def build_query(server, input_path, hits, same_photo, same_title, original_size, rng):
+    """A results list like search_google_images returns: `same_photo` hits are the input image
+    re-published, `same_title` hits are other pictures captioned like it, the rest are unrelated."""
+    fields = synthetic_fields(0, rng)
+    picture = scene(0, (1024, 768))
+    write_jpeg(input_path, fields, image=picture)
+    results, relevant = [], set()
+    for i in range(hits):
+        if i < same_photo:
+            # Cropped and re-encoded, as sites republish wire photos
+            thumb = thumbnail(picture.crop((20, 15, 1004, 753)))
+            title = " ".join(rng.choices(WORDS, k=6))
+        else:
+            thumb = thumbnail(scene(1000 + i))
+            title = fields["headline"] + " " + fields["city"] if i < same_photo + same_title else \
+                " ".join(rng.choices(WORDS, k=1) + rng.choices(OTHER_WORDS, k=5))
+        if i < same_photo + same_title:
+            relevant.add(i)
+        results.append({
+            "type": "image",
+            "title": title,
+            "link": server.serve(f"original-{i}.jpg", fake_jpeg(original_size, seed=i, width=4000, height=3000)),
+            "thumbnail": server.serve(f"thumb-{i}.jpg", thumb),
+        })
+    return results, relevant
+
+
+def planned(results, output_dir):
+    return [(item, item["link"], os.path.join(output_dir, f"hit_{i}.jpg")) for i, item in enumerate(results)]
+
+
+def downloader(label):
+    return Downloader(max_concurrency=16, per_host=16,
+                      manifest=DownloadManifest(os.path.join(WORK_DIR, f"{label}.sqlite")),
+                      blobs=BlobStore(os.path.join(WORK_DIR, f"{label}-blobs")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-size downloads of every hit vs thumbnail-first tiered fetching")
+    parser.add_argument("--hits", type=int, default=100)
+    parser.add_argument("--same-photo", type=int, default=6, help="hits that republish the input image")
+    parser.add_argument("--same-title", type=int, default=4, help="other pictures titled like the input")
+    parser.add_argument("--original-size", type=int, default=1_500_000, help="bytes per full-size image")
+    parser.add_argument("--bandwidth", type=float, default=4e6, help="bytes/s per connection")
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--threshold", type=float, default=PREFILTER_THRESHOLD)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with ImageHostServer(latency=args.latency, bandwidth=args.bandwidth) as server:
+        input_path = os.path.join(WORK_DIR, "input.jpg")
+        results, relevant = build_query(server, input_path, args.hits, args.same_photo, args.same_title,
+                                        args.original_size, rng)
+
+        full = downloader("full")
+        jobs = [(url, path) for _, url, path in planned(results, os.path.join(WORK_DIR, "full"))]
+        os.makedirs(os.path.join(WORK_DIR, "full"), exist_ok=True)
+        start = time.perf_counter()
+        full.fetch_all(jobs)
+        full_seconds = time.perf_counter() - start
+        full_bytes = full.stats.bytes
+        full.close()
+        full.manifest.close()
+
+        tiered = downloader("tiered")
+        fetcher = TieredFetcher(tiered, args.threshold, thumbnail_dir=os.path.join(WORK_DIR, "thumbnails"))
+        os.makedirs(os.path.join(WORK_DIR, "tiered"), exist_ok=True)
+        start = time.perf_counter()
+        done = fetcher.fetch(input_path, planned(results, os.path.join(WORK_DIR, "tiered")))
+        tiered_seconds = time.perf_counter() - start
+        tiered_bytes = tiered.stats.bytes + fetcher.thumbnails.stats.bytes
+        fetcher.close()
+        tiered.close()
+        tiered.manifest.close()
+
+    fetched = {int(os.path.basename(path)[4:-4]) for _, path, nbytes in done if nbytes is not None}
+    print(f"{'mode':<8} {'seconds':>8} {'MB':>8}")
+    print(f"{'full':<8} {full_seconds:8.2f} {full_bytes / 1e6:8.1f}")
+    print(f"{'tiered':<8} {tiered_seconds:8.2f} {tiered_bytes / 1e6:8.1f}")
+    print(f"[✓] Prefilter: {fetcher.stats.summary()}")
+    print(f"[✓] {len(relevant & fetched)} of {len(relevant)} relevant hits fetched, "
+          f"{len(fetched - relevant)} unrelated ones")
+    print(f"[✓] {full_bytes / max(1, tiered_bytes):.1f}x fewer bytes, {full_seconds / tiered_seconds:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
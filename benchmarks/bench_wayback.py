@@ -0,0 +1,64 @@
+import os
+import time
+import argparse
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_wayback_")
+os.environ.setdefault("RESPONSE_CACHE", os.path.join(WORK_DIR, "response_cache.sqlite"))
+
+from wayback import snapshots, archived_urls  # noqa: E402
+from benchmarks.servers import CdxServer, fake_captures  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wayback lookups: every capture vs the first few distinct ones")
+    parser.add_argument("--urls", type=int, default=20)
+    parser.add_argument("--captures", type=int, default=20000, help="captures per URL")
+    parser.add_argument("--limit", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--page-size", type=int, default=5000, help="rows per page when listing every capture")
+    args = parser.parse_args()
+
+    with CdxServer(latency=args.latency) as server:
+        urls = [f"https://news.example.com/2015/05/story-{i}.html" for i in range(args.urls)]
+        for url in urls:
+            server.captures[url] = fake_captures(url, args.captures)
+
+        # The old way: every capture of every URL, one URL after another, then keep the first few
+        start = time.perf_counter()
+        full = {url: [s["archive_url"] for s in snapshots(url, collapse_digest=False, status=None,
+                                                          page_size=args.page_size, endpoint=server.endpoint)]
+                for url in urls}
+        full_seconds = time.perf_counter() - start
+        full_requests, full_rows = server.requests, server.rows_sent
+
+        server.requests = server.rows_sent = 0
+        start = time.perf_counter()
+        first = archived_urls(urls, args.limit, endpoint=server.endpoint)
+        lazy_seconds = time.perf_counter() - start
+        lazy_requests, lazy_rows = server.requests, server.rows_sent
+
+        start = time.perf_counter()
+        again = archived_urls(urls, args.limit, endpoint=server.endpoint)
+        cached_seconds = time.perf_counter() - start
+        cached_requests = server.requests - lazy_requests
+
+        start = time.perf_counter()
+        windowed = archived_urls(urls, args.limit, start="2012", end="2013", endpoint=server.endpoint)
+        window_seconds = time.perf_counter() - start
+
+    print(f"{'mode':<10} {'seconds':>8} {'requests':>9} {'rows':>9}")
+    print(f"{'all':<10} {full_seconds:8.2f} {full_requests:>9} {full_rows:>9}")
+    print(f"{'first':<10} {lazy_seconds:8.2f} {lazy_requests:>9} {lazy_rows:>9}")
+    print(f"{'cached':<10} {cached_seconds:8.2f} {cached_requests:>9} {0:>9}")
+    print(f"[✓] {sum(map(len, full.values()))} captures listed in full; {args.limit} distinct ones per URL "
+          f"{full_seconds / lazy_seconds:.0f}x faster")
+    assert first == again
+    # Collapsing identical captures means the first few are all different page versions
+    assert all(len(v) == args.limit for v in first.values())
+    print(f"[✓] 2012 window: {sum(map(len, windowed.values()))} captures in {window_seconds:.2f} s, first of "
+          f"{urls[0]}: {windowed[urls[0]][0] if windowed[urls[0]] else '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import argparse
+
+from analyzeimage import extract_priority_metadata_fields
+from benchmarks.bench_metadata import collect_images
+from benchmarks.corpus import make_corpus
+from fast_metadata import read_fast
+from metadata_catalog import normalize_fields
+from metadata_reader import ExifToolPool
+
+
+def same_value(fast, slow):
+    if isinstance(fast, float) or isinstance(slow, float):
+        try:
+            return abs(float(fast) - float(slow)) < 1e-9
+        except (TypeError, ValueError):
+            return False
+    return fast == slow
+
+
+def compare(path, fast, slow):
+    """List the ways the fast reader's view of one file differs from exiftool's."""
+    problems = []
+    for key, value in fast.items():
+        if key == "SourceFile":
+            continue
+        if key not in slow:
+            problems.append(f"{key}: exiftool has no such tag")
+        elif not same_value(value, slow[key]):
+            problems.append(f"{key}: {value!r} != exiftool {slow[key]!r}")
+
+    fast_text, _ = extract_priority_metadata_fields(path, fast)
+    slow_text, _ = extract_priority_metadata_fields(path, slow)
+    if fast_text != slow_text:
+        problems.append(f"priority text: {fast_text!r} != exiftool {slow_text!r}")
+    fast_fields, slow_fields = normalize_fields(fast), normalize_fields(slow)
+    for column, value in fast_fields.items():
+        if not same_value(value, slow_fields[column]):
+            problems.append(f"catalog {column}: {value!r} != exiftool {slow_fields[column]!r}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check fast_metadata against exiftool -G -n, file by file")
+    parser.add_argument("root", nargs="?", help="images to check (default: a synthetic JPEG/PNG/TIFF corpus)")
+    parser.add_argument("--count", type=int, default=60, help="size of the synthetic corpus")
+    parser.add_argument("--corpus-dir", default="./bench_fast_metadata")
+    args = parser.parse_args()
+
+    if args.root:
+        paths = collect_images(args.root)
+    else:
+        paths = [path for path, _ in make_corpus(args.corpus_dir, args.count, formats=("jpg", "png", "tif"))]
+
+    pool = ExifToolPool()
+    try:
+        reference = pool.read(paths, numeric=True)
+    finally:
+        pool.close()
+
+    checked = fallback = 0
+    failures = {}
+    for path in paths:
+        fast = read_fast(path)
+        if fast is None:
+            fallback += 1
+            continue
+        checked += 1
+        problems = compare(path, fast, reference.get(path, {}))
+        if problems:
+            failures[path] = problems
+
+    for path, problems in failures.items():
+        print(f"[✗] {path}")
+        for problem in problems:
+            print(f"    {problem}")
+    print(f"[INFO] {checked} files read in-process, {fallback} left to exiftool")
+    if failures:
+        print(f"[✗] {len(failures)} of {checked} files differ from exiftool")
+        sys.exit(1)
+    print(f"[✓] All {checked} files match exiftool")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import random
+import struct
+import argparse
+import numpy as np
+from PIL import Image, PngImagePlugin, TiffImagePlugin
+
+CITIES = [("Panmunjom", "South Korea", "KR", 37.9561, 126.6772), ("Seoul", "South Korea", "KR", 37.5665, 126.978),
+          ("Kyiv", "Ukraine", "UA", 50.4501, 30.5234), ("Gaza", "Palestine", "PS", 31.5017, 34.4668),
+          ("Caracas", "Venezuela", "VE", 10.4806, -66.9036), ("Sydney", "Australia", "AU", -33.8688, 151.2093)]
+WORDS = ["soldiers", "border", "protest", "crowd", "flag", "village", "smoke", "bridge", "river", "market", "police",
+         "children", "ceremony", "delegation", "night", "rain", "checkpoint", "harbour", "train", "rally"]
+
+
+def synthetic_fields(i, rng):
+    """Caption, place, date and GPS for one fake news photo."""
+    city, country, code, lat, lon = rng.choice(CITIES)
+    year, month, day = rng.randint(2005, 2024), rng.randint(1, 12), rng.randint(1, 28)
+    hour, minute, second = rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)
+    words = " ".join(rng.choices(WORDS, k=8))
+    return {
+        "caption": f"{city.upper()}, {country} - {words} (photo {i})",
+        "headline": f"{words.split()[0].title()} in {city}",
+        "description": f"{words} near {city}",
+        "city": city, "country": country, "country_code": code,
+        "date": (year, month, day), "time": (hour, minute, second),
+        "lat": round(lat + rng.uniform(-0.05, 0.05), 6), "lon": round(lon + rng.uniform(-0.05, 0.05), 6),
+        "keywords": rng.sample(WORDS, 3),
+    }
+
+
+def related_fields(fields, i, rng):
+    """Fields for another photo of the same story: same place and date, a reworded caption."""
+    words = fields["caption"].split(" - ", 1)[1].rsplit(" (", 1)[0].split()
+    for _ in range(2):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    related = dict(fields)
+    related["caption"] = f"{fields['city'].upper()}, {fields['country']} - {' '.join(words)} (photo {i})"
+    related["time"] = (rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+    return related
+
+
+def _rational(value):
+    return TiffImagePlugin.IFDRational(int(round(value * 10000)), 10000)
+
+
+def _dms(value):
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = (value - degrees - minutes / 60) * 3600
+    return (TiffImagePlugin.IFDRational(degrees, 1), TiffImagePlugin.IFDRational(minutes, 1), _rational(seconds))
+
+
+def exif_for(fields):
+    exif = Image.Exif()
+    year, month, day = fields["date"]
+    hour, minute, second = fields["time"]
+    stamp = f"{year:04d}:{month:02d}:{day:02d} {hour:02d}:{minute:02d}:{second:02d}"
+    exif[0x010E] = fields["description"]
+    exif[0x010F] = "Canon"
+    exif[0x0132] = stamp
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = stamp
+    exif_ifd[0x9004] = stamp
+    gps = exif.get_ifd(0x8825)
+    gps[1] = "N" if fields["lat"] >= 0 else "S"
+    gps[2] = _dms(fields["lat"])
+    gps[3] = "E" if fields["lon"] >= 0 else "W"
+    gps[4] = _dms(fields["lon"])
+    return exif
+
+
+def iptc_block(fields):
+    """IPTC IIM record 2 datasets, UTF-8 declared in record 1."""
+    def dataset(record, number, value):
+        data = value.encode("utf-8") if isinstance(value, str) else value
+        return struct.pack(">BBBH", 0x1C, record, number, len(data)) + data
+
+    year, month, day = fields["date"]
+    hour, minute, second = fields["time"]
+    parts = [dataset(1, 90, b"\x1b%G"), dataset(2, 0, b"\x00\x04"),
+             dataset(2, 120, fields["caption"]), dataset(2, 105, fields["headline"]),
+             dataset(2, 90, fields["city"]), dataset(2, 100, fields["country_code"]),
+             dataset(2, 101, fields["country"]),
+             dataset(2, 55, f"{year:04d}{month:02d}{day:02d}"),
+             dataset(2, 60, f"{hour:02d}{minute:02d}{second:02d}+0000")]
+    parts += [dataset(2, 25, keyword) for keyword in fields["keywords"]]
+    return b"".join(parts)
+
+
+def photoshop_block(iptc):
+    """Photoshop image resource block wrapping IPTC (resource 0x0404)."""
+    return b"8BIM" + struct.pack(">H", 0x0404) + b"\x00\x00" + struct.pack(">I", len(iptc)) + iptc + \
+        (b"\x00" if len(iptc) % 2 else b"")
+
+
+def xmp_packet(fields):
+    year, month, day = fields["date"]
+    hour, minute, second = fields["time"]
+    return (
+        '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/" '
+        f'photoshop:City="{fields["city"]}" photoshop:Country="{fields["country"]}" '
+        f'photoshop:DateCreated="{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{second:02d}Z">'
+        f'<dc:description><rdf:Alt><rdf:li xml:lang="x-default">{fields["description"]}</rdf:li></rdf:Alt>'
+        '</dc:description>'
+        f'<dc:subject><rdf:Bag>{"".join(f"<rdf:li>{k}</rdf:li>" for k in fields["keywords"])}</rdf:Bag></dc:subject>'
+        f'<photoshop:Headline>{fields["headline"]}</photoshop:Headline>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+        '<?xpacket end="w"?>'
+    ).encode("utf-8")
+
+
+def _segment(marker, payload):
+    return b"\xff" + bytes([marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def scene(seed, size=(640, 480)):
+    """A smooth random picture; unlike pure noise it keeps its perceptual hash when resized."""
+    coarse = np.random.default_rng(seed).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    return Image.fromarray(coarse).resize(size, Image.Resampling.BICUBIC)
+
+
+def write_jpeg(path, fields, size=(640, 480), image=None):
+    """A JPEG with EXIF (incl. GPS), IPTC in APP13 and an XMP packet, like wire photos carry."""
+    image = image if image is not None else Image.effect_noise(size, 32).convert("RGB")
+    image.save(path, "JPEG", quality=85, exif=exif_for(fields))
+    with open(path, "rb") as f:
+        data = f.read()
+    extra = _segment(0xED, b"Photoshop 3.0\x00" + photoshop_block(iptc_block(fields))) + \
+        _segment(0xE1, b"http://ns.adobe.com/xap/1.0/\x00" + xmp_packet(fields))
+    # After SOI and the APP0/APP1 segments Pillow wrote, before the quantization tables
+    pos = 2
+    while data[pos + 1] in (0xE0, 0xE1):
+        pos += 2 + struct.unpack(">H", data[pos + 2:pos + 4])[0]
+    with open(path, "wb") as f:
+        f.write(data[:pos] + extra + data[pos:])
+
+
+def jpeg_bytes(fields, image, tmp_path):
+    """The bytes write_jpeg would produce for `image` (written through `tmp_path`)."""
+    write_jpeg(tmp_path, fields, image=image)
+    with open(tmp_path, "rb") as f:
+        data = f.read()
+    os.remove(tmp_path)
+    return data
+
+
+def write_png(path, fields, size=(320, 240)):
+    """A PNG with an eXIf chunk and an iTXt XMP packet."""
+    image = Image.effect_noise(size, 32).convert("RGB")
+    info = PngImagePlugin.PngInfo()
+    info.add_itxt("XML:com.adobe.xmp", xmp_packet(fields).decode("utf-8"))
+    info.add_text("Title", fields["headline"])
+    image.save(path, "PNG", pnginfo=info, exif=exif_for(fields))
+
+
+def write_tiff(path, fields, size=(320, 240)):
+    """A TIFF with IPTC/XMP in their IFD0 tags (Pillow's TIFF writer drops the Exif and GPS sub-IFDs)."""
+    image = Image.effect_noise(size, 32).convert("RGB")
+    exif = exif_for(fields)
+    iptc = iptc_block(fields)
+    exif[0x83BB] = iptc + b"\x00" * (-len(iptc) % 4)
+    exif[0x02BC] = xmp_packet(fields)
+    image.save(path, "TIFF", exif=exif)
+
+
+def make_corpus(root, n, seed=0, formats=("jpg",)):
+    """Write n images cycling through `formats`; returns [(path, fields)]."""
+    os.makedirs(root, exist_ok=True)
+    rng = random.Random(seed)
+    writers = {"jpg": write_jpeg, "png": write_png, "tif": write_tiff}
+    corpus = []
+    for i in range(n):
+        ext = formats[i % len(formats)]
+        fields = synthetic_fields(i, rng)
+        path = os.path.join(root, f"photo_{i:06d}.{ext}")
+        if not os.path.exists(path):
+            writers[ext](path, fields)
+        corpus.append((path, fields))
+    return corpus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic news photos with EXIF, IPTC and XMP metadata")
+    parser.add_argument("root")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--formats", default="jpg", help="comma-separated: jpg, png, tif")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    corpus = make_corpus(args.root, args.count, args.seed, tuple(args.formats.split(",")))
+    print(f"[✓] Wrote {len(corpus)} images to {args.root}")
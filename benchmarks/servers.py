@@ -0,0 +1,334 @@
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Smallest valid baseline JPEG header; the body is padded out to the requested size
+JPEG_HEADER = bytes.fromhex("ffd8ffe000104a46494600010100000100010000")
+JPEG_END = bytes.fromhex("ffd9")
+# Junk a real image host serves in place of photos: /junk/<kind>/<name>
+JUNK_KINDS = ("html", "svg", "thumb", "huge")
+PACED_CHUNK_SIZE = 16 * 1024
+
+
+def sof0(width, height):
+    """Baseline SOF0 segment declaring a 3-component width x height image."""
+    return b"\xff\xc0\x00\x11\x08" + height.to_bytes(2, "big") + width.to_bytes(2, "big") + \
+        bytes.fromhex("03012200021101031101")
+
+
+def fake_jpeg(size, seed=0, width=1280, height=960):
+    rng = random.Random(seed)
+    header = JPEG_HEADER + sof0(width, height)
+    padding = max(0, size - len(header) - len(JPEG_END))
+    return header + rng.randbytes(padding) + JPEG_END
+
+
+def fake_tiff(size, seed=0):
+    """Little-endian TIFF whose only IFD follows the pixel data, as large scans often have it."""
+    rng = random.Random(seed)
+    return b"II*\x00" + (size - 8).to_bytes(4, "little") + rng.randbytes(max(0, size - 8))
+
+
+def junk_body(kind, image_size, seed=0):
+    """(body, content type) for one kind of junk response."""
+    if kind == "html":
+        page = b"<!DOCTYPE html><html><head><title>404 Not Found</title></head><body>" + b"x" * 20000 + b"</body></html>"
+        return page, "text/html"
+    if kind == "svg":
+        # Mislabeled as a JPEG, so only the file signature gives it away
+        return b'<svg xmlns="http://www.w3.org/2000/svg" width="600" height="400"><rect/></svg>', "image/jpeg"
+    if kind == "thumb":
+        return fake_jpeg(4000, seed, width=80, height=80), "image/jpeg"
+    return fake_tiff(40 * 1024 * 1024, seed), "image/tiff"
+
+
+class StandInServer:
+    """Run a ThreadingHTTPServer on a background thread (use as a context manager).
+
+    Subclasses provide `handler_class`; the server instance is reachable from
+    handlers as `self.server.owner`.
+    """
+
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # Clients drop connections mid-body on purpose (rejected downloads)
+            pass
+
+    def send_body(self, status, body, content_type, extra_headers=None, bandwidth=None):
+        """Send a complete response; `bandwidth` (bytes/s) paces the body like a slow link."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), PACED_CHUNK_SIZE):
+            piece = body[start:start + PACED_CHUNK_SIZE]
+            self.wfile.write(piece)
+            time.sleep(len(piece) / bandwidth)
+
+
+class ImageHostHandler(QuietHandler):
+    """Honors If-None-Match and single `bytes=N-` Range requests like a CDN would."""
+
+    def do_GET(self):
+        owner = self.server.owner
+        owner.requests += 1
+        time.sleep(owner.latency)
+        if owner.failure_rate and owner.rng.random() < owner.failure_rate:
+            self.send_body(503, b"unavailable", "text/plain")
+            return
+        body, content_type = owner.body_for(self.path)
+        etag = f'"{len(body):x}-{abs(hash(self.path)) & 0xffffffff:x}"'
+        validators = {"ETag": etag, "Last-Modified": "Sat, 23 May 2015 08:21:12 GMT", "Accept-Ranges": "bytes"}
+
+        if self.headers.get("If-None-Match") == etag:
+            owner.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        byte_range = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        if byte_range.startswith("bytes=") and byte_range.endswith("-") and if_range in (None, etag):
+            start = int(byte_range[len("bytes="):-1])
+            if start >= len(body):
+                self.send_body(416, b"", "text/plain", {"Content-Range": f"bytes */{len(body)}"})
+                return
+            owner.ranged += 1
+            validators["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            self.send_body(206, body[start:], content_type, validators, owner.bandwidth)
+            return
+        self.send_body(200, body, content_type, validators, owner.bandwidth)
+
+    do_HEAD = do_GET
+
+
+class ImageHostServer(StandInServer):
+    """Serves a fake JPEG for every GET path after `latency` seconds (junk under /junk/<kind>/).
+
+    Specific bodies can be registered with `serve()`; `bandwidth` (bytes/s per
+    connection) paces bodies like a remote host would.
+    """
+
+    handler_class = ImageHostHandler
+
+    def __init__(self, latency=0.05, image_size=200_000, failure_rate=0.0, seed=0, bandwidth=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.image_size = image_size
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.not_modified = 0
+        self.ranged = 0
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def body_for(self, path):
+        with self._lock:
+            if path not in self._bodies:
+                parts = path.strip("/").split("/")
+                if parts[0] == "junk" and len(parts) > 2 and parts[1] in JUNK_KINDS:
+                    self._bodies[path] = junk_body(parts[1], self.image_size, seed=hash(path))
+                else:
+                    self._bodies[path] = fake_jpeg(self.image_size, seed=hash(path)), "image/jpeg"
+            return self._bodies[path]
+
+    def serve(self, name, body, content_type="image/jpeg"):
+        """Serve `body` at /files/<name>; returns its URL."""
+        with self._lock:
+            self._bodies[f"/files/{name}"] = body, content_type
+        return f"{self.base_url}/files/{name}"
+
+    def url(self, name, junk=None):
+        return f"{self.base_url}/junk/{junk}/{name}" if junk else f"{self.base_url}/images/{name}"
+
+
+def uploaded_image(body):
+    """The image bytes inside a JSON base64 or multipart request body (else the body itself)."""
+    try:
+        return base64.b64decode(json.loads(body)["image_content"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    start, end = body.find(b"\xff\xd8"), body.rfind(b"\xff\xd9")
+    return body[start:end + 2] if 0 <= start < end else body
+
+
+class SearchEngineHandler(QuietHandler):
+    """Answers SerpAPI-style (`/serpapi`) and Bing Visual Search-style (`/bing`) requests."""
+
+    def _respond(self, body):
+        owner = self.server.owner
+        engine = self.path.split("?", 1)[0].strip("/")
+        with owner._lock:
+            owner.requests[engine] = owner.requests.get(engine, 0) + 1
+            owner.bytes_received += len(body)
+        time.sleep(owner.latency.get(engine, owner.default_latency))
+        if owner.failure_rate and owner.rng.random() < owner.failure_rate:
+            self.send_body(503, b"unavailable", "text/plain")
+            return
+        links = owner.links_for(uploaded_image(body))
+        if engine == "serpapi":
+            results = [{"title": f"Result {i}", "link": link, "source": "example.com", "original": link,
+                        "thumbnail": link} for i, link in enumerate(links)]
+            payload = {"image_results": results, "images_results": results}
+        elif engine == "bing":
+            # Bing's result list overlaps Google's second half, as real engines' results do
+            data = [{"name": f"Result {i}", "contentUrl": link, "hostPageDisplayUrl": "example.com"}
+                    for i, link in enumerate(links[len(links) // 2:] + owner.links_for(uploaded_image(body)[::-1]))]
+            payload = {"tags": [{"actions": [{"actionType": "VisualSearch", "data": data}]}]}
+        else:
+            self.send_body(404, b"unknown engine", "text/plain")
+            return
+        self.send_body(200, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._respond(self.rfile.read(length))
+
+    def do_GET(self):
+        self._respond(self.path.encode("utf-8"))
+
+
+class SearchEngineServer(StandInServer):
+    """Stand-in reverse image search APIs with per-engine latency.
+
+    Results are derived from a hash of the request body, so the same image
+    always gets the same links.
+    """
+
+    handler_class = SearchEngineHandler
+
+    def __init__(self, latency=None, default_latency=0.2, results=10, failure_rate=0.0, seed=0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.results = results
+        self.requests = {}
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def links_for(self, body):
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        return [f"https://example.com/photos/{digest}-{i}.jpg" for i in range(self.results)]
+
+    def url(self, engine):
+        return f"{self.base_url}/{engine}"
+
+
+def fake_captures(url, n, seed=0, changes=0.2, start=2010):
+    """`n` capture rows [timestamp, original, mimetype, statuscode, digest] of `url`, oldest first.
+
+    The page content changes on a `changes` share of captures; the rest
+    repeat the previous digest, as most captures of a stable article do.
+    """
+    rng = random.Random(f"{seed}:{url}")
+    rows, digest, t = [], None, time.mktime((start, 1, 1, 0, 0, 0, 0, 0, 0))
+    for i in range(n):
+        t += rng.randint(600, 6 * 3600)
+        if digest is None or rng.random() < changes:
+            digest = hashlib.sha1(f"{url}:{i}".encode()).hexdigest()[:32].upper()
+        status = "200" if rng.random() > 0.05 else rng.choice(["301", "404"])
+        rows.append([time.strftime("%Y%m%d%H%M%S", time.gmtime(t)), url, "text/html", status, digest])
+    return rows
+
+
+class CdxHandler(QuietHandler):
+    """Wayback CDX API subset: url, from, to, filter=statuscode:N, collapse=digest, limit, showResumeKey, resumeKey."""
+
+    def do_GET(self):
+        owner = self.server.owner
+        query = {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        rows = owner.captures.get(query.get("url"), [])
+        if "from" in query:
+            rows = [r for r in rows if r[0] >= query["from"].ljust(14, "0")]
+        if "to" in query:
+            rows = [r for r in rows if r[0] <= query["to"].ljust(14, "9")]
+        if query.get("filter", "").startswith("statuscode:"):
+            rows = [r for r in rows if r[3] == query["filter"].split(":", 1)[1]]
+        if query.get("collapse") == "digest":
+            rows = [r for i, r in enumerate(rows) if i == 0 or rows[i - 1][4] != r[4]]
+        offset = int(query.get("resumeKey") or 0)
+        limit = int(query.get("limit") or len(rows))
+        page = rows[offset:offset + limit]
+        # The real service spends time per row it scans and sends
+        time.sleep(owner.latency + owner.row_cost * len(page))
+        with owner._lock:
+            owner.requests += 1
+            owner.rows_sent += len(page)
+        body = [["timestamp", "original", "mimetype", "statuscode", "digest"]] + page if page else []
+        if page and query.get("showResumeKey") == "true" and offset + limit < len(rows):
+            body += [[], [str(offset + limit)]]
+        self.send_body(200, json.dumps(body).encode("utf-8"), "application/json")
+
+
+class CdxServer(StandInServer):
+    """Stand-in Wayback CDX server over captures registered in `captures` ({url: rows from fake_captures})."""
+
+    handler_class = CdxHandler
+
+    def __init__(self, latency=0.3, row_cost=0.00002, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.row_cost = row_cost
+        self.captures = {}
+        self.requests = 0
+        self.rows_sent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"{self.base_url}/cdx/search/cdx"
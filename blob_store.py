@@ -0,0 +1,97 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+BLOB_DIR = os.getenv("BLOB_DIR", "./downloaded_images/.blobs")
+HASH_CHUNK_SIZE = 1 << 20
+
+# Query parameters that never change the bytes a URL points at
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref_src"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url):
+    """Normalize a URL so trivially different spellings of one resource compare equal."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Point `dst` at the bytes of `src` with a hardlink, copying only if linking is impossible."""
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return dst
+    folder = os.path.dirname(os.path.abspath(dst))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".link-")
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return dst
+
+
+class BlobStore:
+    """SHA-256 content-addressed file store.
+
+    Each distinct body is kept once as `<root>/<aa>/<sha256>`; the
+    human-readable names in downloaded_images (which carry the extension)
+    are hardlinks to it.
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def find(self, sha256):
+        blob_path = self.path_for(sha256)
+        return blob_path if os.path.exists(blob_path) else None
+
+    def ingest(self, path):
+        """Move `path` into the store; returns (sha256, blob_path, was_new)."""
+        sha256 = file_sha256(path)
+        blob_path = self.path_for(sha256)
+        if os.path.exists(blob_path):
+            os.remove(path)
+            return sha256, blob_path, False
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(path, blob_path)
+        return sha256, blob_path, True
+
+    def link(self, sha256, dst):
+        blob_path = self.find(sha256)
+        if blob_path is None:
+            raise FileNotFoundError(f"No blob {sha256} in {self.root}")
+        return link_or_copy(blob_path, dst)
+
+    def disk_usage(self):
+        blobs, total = 0, 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for fname in filenames:
+                blobs += 1
+                total += os.path.getsize(os.path.join(dirpath, fname))
+        return blobs, total
@@ -0,0 +1,344 @@
+import os
+import json
+import argparse
+import threading
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+INDEX_DIR = os.getenv("CAPTION_INDEX_DIR", "./caption_index")
+N_FEATURES = 2 ** 20
+# Buffered documents written per shard by flush(); add() flushes on its own past this
+MAX_PENDING = 5000
+# Flushes whose document-frequency deltas are kept as small files before being folded into one dense df file
+MAX_DF_DELTAS = 32
+
+
+class CaptionIndex:
+    """Append-only on-disk text index over candidate captions.
+
+    Each flush writes the new documents' hashed term counts as one sparse
+    shard and the change it makes to document frequency, so adding N
+    documents costs O(N) regardless of corpus size. Queries weight terms
+    with the current smoothed IDF and return cosine similarities.
+
+    Layout of `index_dir`:
+        manifest.json        {"rows", "shards", "df", "df_deltas"}: what is committed
+        docs.jsonl           one {"path", "sha256"} line per row
+        df_NNNNNN.npy        int32 document frequency per hashed feature
+        dfdelta_NNNNNN.npz   sparse change to it made by one flush, applied on top
+        shard_NNNNNN.npz     term counts for consecutive rows
+
+    A flush writes its shard and df delta under names no manifest mentions
+    yet, appends to docs.jsonl, then replaces manifest.json atomically;
+    every MAX_DF_DELTAS flushes the deltas are folded into a new df file. A
+    crash at any point leaves the previous manifest, and loading drops doc
+    lines and files it doesn't list, so rows and paths always line up.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, n_features=N_FEATURES):
+        self.index_dir = index_dir
+        self.n_features = n_features
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, alternate_sign=False, norm=None, dtype=np.float32
+        )
+        self._lock = threading.RLock()
+        self._pending = {}
+        os.makedirs(index_dir, exist_ok=True)
+
+        docs = []
+        docs_path = self._path("docs.jsonl")
+        if os.path.exists(docs_path):
+            with open(docs_path, "r") as f:
+                docs = [json.loads(line) for line in f if line.strip()]
+
+        # CSR shards as loaded, for row lookups; CSC blocks of consecutive shards, for posting lists
+        self._shard_matrices = []
+        self._shard_starts = [0]
+        self._blocks = []
+        # Per-row sums over terms of count^2 times 1, log1p(df) and log1p(df)^2 as of _synced_log_df,
+        # from which the norms under any IDF follow without touching the matrix
+        self._synced_rows = 0
+        self._synced_log_df = np.zeros(n_features)
+        self._norm_terms = np.zeros((3, 0))
+        self._live = np.zeros(0, dtype=bool)
+        self._superseded = []
+        self._docs = []
+        self._rows_by_path = {}
+
+        manifest_path = self._path("manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            self._shards = manifest["shards"]
+            self._df_name = manifest["df"]
+            self._df_deltas = manifest.get("df_deltas", [])
+            for doc in docs[:manifest["rows"]]:
+                self._append_doc(doc)
+            self._df = np.load(self._path(self._df_name))
+            for name in self._df_deltas:
+                delta = sp.load_npz(self._path(name)).tocoo()
+                self._df[delta.col] += delta.data.astype(np.int32)
+            if len(docs) > manifest["rows"]:
+                print(f"[WARN] {index_dir}: dropping {len(docs) - manifest['rows']} uncommitted documents")
+                self._rewrite_docs()
+        else:
+            self._recover(docs)
+        if self._df.shape[0] != n_features:
+            raise ValueError(f"{index_dir} was built with {self._df.shape[0]} features, not {n_features}")
+        self._remove_unlisted()
+
+    def _recover(self, docs):
+        """Build a manifest for an index without one (new, or written before manifests).
+
+        Keeps the longest run of shards that docs.jsonl has rows for and
+        recounts document frequency from them.
+        """
+        names = sorted(f for f in os.listdir(self.index_dir) if f.startswith("shard_") and f.endswith(".npz"))
+        self._shards, rows = [], 0
+        for name in names:
+            shard_rows = sp.load_npz(self._path(name)).shape[0]
+            if rows + shard_rows > len(docs):
+                print(f"[WARN] {self.index_dir}: dropping {name} and later shards, which have no documents")
+                break
+            self._shards.append(name)
+            rows += shard_rows
+        for doc in docs[:rows]:
+            self._append_doc(doc)
+        df = np.zeros(self.n_features, dtype=np.int32)
+        if rows:
+            live = np.flatnonzero([not doc.get("superseded") for doc in self._docs])
+            matrix = sp.vstack(self._load_shards(), format="csr")[live]
+            matrix.sum_duplicates()
+            df += np.bincount(matrix.indices, minlength=self.n_features).astype(np.int32)
+        self._df_name = f"df_{len(self._shards):06d}.npy"
+        np.save(self._path(self._df_name), df)
+        self._df = df
+        self._df_deltas = []
+        if len(docs) > rows:
+            self._rewrite_docs()
+        self._write_manifest()
+
+    def _rewrite_docs(self):
+        tmp = self._path("docs.jsonl.tmp")
+        with open(tmp, "w") as f:
+            for doc in self._docs:
+                f.write(json.dumps({"path": doc["path"], "sha256": doc.get("sha256")}) + "\n")
+        os.replace(tmp, self._path("docs.jsonl"))
+
+    def _write_manifest(self):
+        tmp = self._path("manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"rows": len(self._docs), "shards": self._shards, "df": self._df_name,
+                       "df_deltas": self._df_deltas}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path("manifest.json"))
+
+    def _remove_unlisted(self):
+        """Delete shard and df files left behind by an interrupted flush or an older layout."""
+        keep = set(self._shards) | {self._df_name} | set(self._df_deltas)
+        for name in os.listdir(self.index_dir):
+            if name not in keep and (name.startswith(("shard_", "df_", "dfdelta_")) or name == "df.npy"):
+                os.remove(self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _append_doc(self, doc):
+        row = len(self._docs)
+        self._docs.append(doc)
+        previous = self._rows_by_path.get(doc["path"])
+        if previous is not None:
+            self._docs[previous]["superseded"] = True
+            self._superseded.append(previous)
+        self._rows_by_path[doc["path"]] = row
+
+    def __len__(self):
+        return len(self._rows_by_path) + len(self._pending)
+
+    def contains(self, path, sha256=None):
+        with self._lock:
+            key = os.path.abspath(path)
+            if key in self._pending:
+                return sha256 is None or self._pending[key][1] == sha256
+            row = self._rows_by_path.get(key)
+            return row is not None and (sha256 is None or self._docs[row].get("sha256") == sha256)
+
+    def add(self, path, text, sha256=None):
+        """Queue one document; it becomes searchable after flush()."""
+        if not text:
+            return
+        with self._lock:
+            if self.contains(path, sha256):
+                return
+            self._pending[os.path.abspath(path)] = (text, sha256)
+            if len(self._pending) >= MAX_PENDING:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending = [(path, text, sha256) for path, (text, sha256) in self._pending.items()]
+            self._pending = {}
+
+            counts = self.vectorizer.transform([text for _, text, _ in pending]).tocsr()
+            counts.sum_duplicates()
+            touched, per_term = np.unique(counts.indices, return_counts=True)
+
+            # Rows replaced by this flush stop counting towards document frequency
+            stale_rows = [self._rows_by_path[p] for p, _, _ in pending if p in self._rows_by_path]
+            if stale_rows:
+                stale = self._load_rows(stale_rows)
+                gone, gone_counts = np.unique(stale.indices, return_counts=True)
+
+            delta = sp.csr_matrix((per_term.astype(np.int32), (np.zeros(len(touched), dtype=np.int32), touched)),
+                                  shape=(1, self.n_features))
+            if stale_rows:
+                delta = delta - sp.csr_matrix((gone_counts.astype(np.int32), (np.zeros(len(gone), dtype=np.int32), gone)),
+                                              shape=(1, self.n_features))
+            delta.sum_duplicates()
+            df = self._df.copy()
+            df[delta.indices] += delta.data
+            shard_name = f"shard_{len(self._shards):06d}.npz"
+            sp.save_npz(self._path(shard_name), counts)
+            # A few kilobytes per flush instead of the whole dense array, until there are enough to fold
+            if len(self._df_deltas) < MAX_DF_DELTAS:
+                df_name, df_deltas = self._df_name, self._df_deltas + [f"dfdelta_{len(self._shards):06d}.npz"]
+                sp.save_npz(self._path(df_deltas[-1]), delta)
+            else:
+                df_name, df_deltas = f"df_{len(self._shards) + 1:06d}.npy", []
+                np.save(self._path(df_name), df)
+
+            with open(self._path("docs.jsonl"), "a") as f:
+                for path, _, sha256 in pending:
+                    f.write(json.dumps({"path": path, "sha256": sha256}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # Replacing the manifest is what commits the flush
+            replaced = [self._df_name] + self._df_deltas if df_name != self._df_name else []
+            for path, _, sha256 in pending:
+                self._append_doc({"path": path, "sha256": sha256})
+            self._shards.append(shard_name)
+            self._df, self._df_name, self._df_deltas = df, df_name, df_deltas
+            self._write_manifest()
+            for name in replaced:
+                os.remove(self._path(name))
+            return len(pending)
+
+    def _load_shards(self):
+        """CSR term counts per shard, reading only shards added since the last call."""
+        for name in self._shards[len(self._shard_matrices):]:
+            shard = sp.load_npz(self._path(name)).tocsr()
+            self._shard_matrices.append(shard)
+            self._shard_starts.append(self._shard_starts[-1] + shard.shape[0])
+        return self._shard_matrices
+
+    def _load_rows(self, rows):
+        shards = self._load_shards()
+        rows = np.asarray(sorted(rows))
+        which = np.searchsorted(self._shard_starts, rows, side="right") - 1
+        return sp.vstack([shards[w][rows[which == w] - self._shard_starts[w]] for w in np.unique(which)],
+                         format="csr")
+
+    def _searchable(self):
+        """CSC blocks covering the corpus in row order, current IDF and per-row norms under that IDF.
+
+        Only what changed since the last call is touched: shards added since
+        get their norm terms computed and a CSC block of their own, and terms
+        whose document frequency moved get the norm terms of the rows they
+        occur in corrected. Blocks of similar size are merged, so there are
+        O(log shards) of them.
+        """
+        shards = self._load_shards()
+        log_df = np.log1p(np.asarray(self._df, dtype=np.float64))
+        changed = np.flatnonzero(log_df != self._synced_log_df)
+        if len(changed) and self._synced_rows:
+            old, new = self._synced_log_df[changed], log_df[changed]
+            weights = np.stack([np.zeros(len(changed)), new - old, new ** 2 - old ** 2], axis=1)
+            start = 0
+            for block in self._blocks:
+                postings = block[:, changed]
+                rows = block.shape[0]
+                self._norm_terms[:, start:start + rows] += (postings.multiply(postings) @ weights).T
+                start += rows
+        self._synced_log_df = log_df
+
+        if self._synced_rows < self._shard_starts[-1]:
+            first = np.searchsorted(self._shard_starts, self._synced_rows)
+            added = []
+            for shard in shards[first:]:
+                squared = shard.multiply(shard).tocsr()
+                added.append(np.stack([np.asarray(squared.sum(axis=1)).ravel(), squared @ log_df,
+                                       squared @ log_df ** 2]))
+                self._blocks.append(shard.tocsc())
+                while len(self._blocks) > 1 and self._blocks[-2].shape[0] <= 2 * self._blocks[-1].shape[0]:
+                    last = self._blocks.pop()
+                    self._blocks[-1] = sp.vstack([self._blocks[-1], last], format="csc")
+            self._norm_terms = np.concatenate([self._norm_terms, *added], axis=1)
+            self._live = np.concatenate([self._live, np.ones(self._shard_starts[-1] - self._synced_rows, dtype=bool)])
+            self._synced_rows = self._shard_starts[-1]
+        self._live[[row for row in self._superseded if row < self._synced_rows]] = False
+        self._superseded = [row for row in self._superseded if row >= self._synced_rows]
+
+        # idf = base - log1p(df), so sum(count^2 * idf^2) = base^2 * S0 - 2 * base * S1 + S2
+        base = np.log(1.0 + len(self._rows_by_path)) + 1.0
+        idf = base - log_df
+        s0, s1, s2 = self._norm_terms
+        norms = np.sqrt(np.maximum(base * base * s0 - 2.0 * base * s1 + s2, 0.0))
+        norms[s0 == 0] = 1.0
+        self._norms = norms
+        return self._blocks, idf
+
+    def query(self, texts, top_k=10, threshold=0.0, exclude=()):
+        """Return one best-first [(path, score)] list per query text."""
+        with self._lock:
+            self.flush()
+            blocks, idf = self._searchable()
+            excluded = {self._rows_by_path[os.path.abspath(p)] for p in exclude
+                        if os.path.abspath(p) in self._rows_by_path}
+
+            results = []
+            queries = self.vectorizer.transform(list(texts)).tocsr()
+            for i in range(queries.shape[0]):
+                lo, hi = queries.indptr[i], queries.indptr[i + 1]
+                terms, tf = queries.indices[lo:hi], queries.data[lo:hi]
+                if len(terms) == 0 or not blocks:
+                    results.append([])
+                    continue
+                weights = tf * idf[terms]
+                weights = weights / np.linalg.norm(weights)
+                # Only the posting lists of the query's own terms are touched
+                scores = np.concatenate([block[:, terms] @ (weights * idf[terms]) for block in blocks])
+                scores = scores / self._norms
+                scores[~self._live] = 0.0
+                if excluded:
+                    scores[list(excluded)] = 0.0
+
+                candidates = np.flatnonzero(scores >= max(threshold, 1e-12))
+                if top_k is not None and len(candidates) > top_k:
+                    part = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+                    candidates = candidates[part]
+                order = candidates[np.argsort(-scores[candidates], kind="stable")]
+                results.append([(self._docs[j]["path"], float(scores[j])) for j in order])
+            return results
+
+
+if __name__ == "__main__":
+    from metadata_catalog import get_catalog, list_images
+    from similarity_search import description_text, CANDIDATE_IMAGES_DIR
+
+    parser = argparse.ArgumentParser(description="Add new candidate captions to the on-disk caption index")
+    parser.add_argument("folders", nargs="*", default=[CANDIDATE_IMAGES_DIR])
+    args = parser.parse_args()
+
+    index = CaptionIndex()
+    catalog = get_catalog()
+    for folder in args.folders:
+        paths = list_images(folder)
+        records = catalog.records(paths, with_metadata=True)
+        for path, record in records.items():
+            index.add(path, description_text(record["metadata"]), record["sha256"])
+        added = index.flush()
+        print(f"[✓] {folder}: {added} new documents, {len(index)} indexed")
@@ -0,0 +1,199 @@
+import os
+import json
+import heapq
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Candidates vectorized and scored per task; peak memory scales with this, not the corpus
+CHUNK_SIZE = int(os.getenv("SCORING_CHUNK_SIZE", "20000"))
+# Terms are hashed into a 31-bit space (collisions are negligible) and then
+# renumbered densely over the vocabulary actually seen
+N_FEATURES = 2 ** 31 - 1
+WORKERS = os.cpu_count() or 1
+
+_vectorizer = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None, dtype=np.float32)
+# Per-worker cache of the target matrix, loaded once per process
+_targets = {}
+
+
+def _chunk_path(work_dir, chunk_id, part):
+    return os.path.join(work_dir, f"chunk_{chunk_id:06d}.{part}")
+
+
+def _spill_chunk(work_dir, chunk_id, paths, texts):
+    """Vectorize one chunk, spill its term counts to .npy files; returns (rows, terms, doc counts)."""
+    counts = _vectorizer.transform(texts).tocsr()
+    counts.sum_duplicates()
+    for part in ("data", "indices", "indptr"):
+        np.save(_chunk_path(work_dir, chunk_id, f"{part}.npy"), getattr(counts, part))
+    with open(_chunk_path(work_dir, chunk_id, "paths.json"), "w") as f:
+        json.dump(paths, f)
+    terms, docs = np.unique(counts.indices, return_counts=True)
+    return counts.shape[0], terms, docs
+
+
+def _load_chunk(work_dir, chunk_id, vocabulary):
+    data, indices, indptr = (np.load(_chunk_path(work_dir, chunk_id, f"{p}.npy"), mmap_mode="r")
+                             for p in ("data", "indices", "indptr"))
+    return _renumber(data, indices, indptr, vocabulary)
+
+
+def _renumber(data, indices, indptr, vocabulary):
+    """CSR matrix over vocabulary columns from hashed term columns (all terms must be in `vocabulary`)."""
+    columns = np.searchsorted(vocabulary, indices).astype(np.int32)
+    return sp.csr_matrix((np.asarray(data), columns, np.asarray(indptr)), shape=(len(indptr) - 1, len(vocabulary)))
+
+
+def _tfidf(counts, idf):
+    """Smoothed TF-IDF with L2-normalized rows, as TfidfVectorizer computes it."""
+    weighted = counts.astype(np.float32, copy=True)
+    weighted.data *= idf[weighted.indices]
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.diags(1.0 / norms) @ weighted
+
+
+def _score_chunk(work_dir, chunk_id, offset, threshold, top_k):
+    """Score one spilled chunk against every target; returns one [(score, row)] list per target."""
+    if work_dir not in _targets:
+        _targets.clear()
+        _targets[work_dir] = (
+            sp.load_npz(os.path.join(work_dir, "targets.npz")).tocsr(),
+            np.load(os.path.join(work_dir, "vocabulary.npy"), mmap_mode="r"),
+            np.load(os.path.join(work_dir, "idf.npy")),
+        )
+    targets, vocabulary, idf = _targets[work_dir]
+
+    candidates = _tfidf(_load_chunk(work_dir, chunk_id, vocabulary), idf)
+    block = (targets @ candidates.T).tocsr()
+    picked = []
+    for i in range(block.shape[0]):
+        lo, hi = block.indptr[i], block.indptr[i + 1]
+        rows, scores = block.indices[lo:hi], block.data[lo:hi]
+        keep = scores >= threshold
+        rows, scores = rows[keep], scores[keep]
+        if top_k is not None and len(scores) > top_k:
+            part = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows, scores = rows[part], scores[part]
+        picked.append([(float(s), offset + int(r)) for s, r in zip(scores, rows)])
+    return picked
+
+
+def _chunks(candidates, chunk_size):
+    paths, texts = [], []
+    for path, text in candidates:
+        paths.append(path)
+        texts.append(text)
+        if len(paths) == chunk_size:
+            yield paths, texts
+            paths, texts = [], []
+    if paths:
+        yield paths, texts
+
+
+class ChunkedScorer:
+    """TF-IDF cosine scoring over a candidate stream too large to hold in memory.
+
+    Pass 1 hashes each chunk of candidates (tokenized like TfidfVectorizer,
+    so scores match score_all), spills its term counts to .npy files in
+    `work_dir` and accumulates document frequencies per hashed term. Pass 2 memory-maps
+    the chunks back, weights them with the corpus IDF and keeps a bounded
+    top-k heap per target. Both passes are sharded over a process pool,
+    with at most two chunks per worker in flight, so peak memory depends on
+    `chunk_size` and `workers` only.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, workers=WORKERS, work_dir=None):
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        self.work_dir = work_dir
+        self.candidates = 0
+
+    def _map_bounded(self, pool, fn, jobs, on_result):
+        """Submit jobs lazily, keeping at most 2 per worker queued, calling on_result in submission order."""
+        pending = []
+        for job in jobs:
+            pending.append(pool.submit(fn, *job))
+            if len(pending) >= 2 * self.workers:
+                on_result(pending.pop(0).result())
+        for future in pending:
+            on_result(future.result())
+
+    def score(self, target_texts, candidates, threshold=0.0, top_k=100):
+        """Return one best-first [(path, score)] list per target text.
+
+        `candidates` is any iterable of (path, text) pairs and is consumed once.
+        """
+        target_texts = list(target_texts)
+        work_dir = self.work_dir or tempfile.mkdtemp(prefix="chunked_scoring_")
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                target_counts = _vectorizer.transform(target_texts).tocsr()
+                target_counts.sum_duplicates()
+                vocabulary, df = np.unique(target_counts.indices, return_counts=True)
+                df = df.astype(np.int64)
+                chunk_rows = []
+
+                def add_chunk(result):
+                    nonlocal vocabulary, df
+                    rows, terms, docs = result
+                    chunk_rows.append(rows)
+                    # Memory here grows with the vocabulary, which levels off, not with the corpus
+                    vocabulary, inverse = np.unique(np.concatenate([vocabulary, terms]), return_inverse=True)
+                    df = np.bincount(inverse, weights=np.concatenate([df, docs]), minlength=len(vocabulary))
+
+                jobs = ((work_dir, i, paths, texts) for i, (paths, texts) in
+                        enumerate(_chunks(candidates, self.chunk_size)))
+                self._map_bounded(pool, _spill_chunk, jobs, add_chunk)
+                self.candidates = sum(chunk_rows)
+                if not target_texts or not self.candidates:
+                    return [[] for _ in target_texts]
+
+                n_docs = len(target_texts) + self.candidates
+                idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+                np.save(os.path.join(work_dir, "vocabulary.npy"), vocabulary)
+                np.save(os.path.join(work_dir, "idf.npy"), idf)
+                targets = _renumber(target_counts.data, target_counts.indices, target_counts.indptr, vocabulary)
+                sp.save_npz(os.path.join(work_dir, "targets.npz"), _tfidf(targets, idf).tocsr())
+
+                heaps = [[] for _ in target_texts]
+
+                def merge(picked):
+                    for heap, entries in zip(heaps, picked):
+                        for entry in entries:
+                            if top_k is None or len(heap) < top_k:
+                                heapq.heappush(heap, entry)
+                            elif entry > heap[0]:
+                                heapq.heapreplace(heap, entry)
+
+                offsets = np.concatenate([[0], np.cumsum(chunk_rows)[:-1]]).astype(int)
+                jobs = ((work_dir, i, int(offsets[i]), threshold, top_k) for i in range(len(chunk_rows)))
+                self._map_bounded(pool, _score_chunk, jobs, merge)
+
+            return self._resolve(work_dir, heaps, chunk_rows, offsets)
+        finally:
+            if self.work_dir is None:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _resolve(self, work_dir, heaps, chunk_rows, offsets):
+        """Turn (score, row) heaps into best-first (path, score) lists, reading only the chunks that won."""
+        wanted = {}
+        for heap in heaps:
+            for _, row in heap:
+                chunk_id = int(np.searchsorted(offsets, row, side="right")) - 1
+                wanted.setdefault(chunk_id, set()).add(row)
+        paths = {}
+        for chunk_id, rows in wanted.items():
+            with open(_chunk_path(work_dir, chunk_id, "paths.json"), "r") as f:
+                chunk_paths = json.load(f)
+            for row in rows:
+                paths[row] = chunk_paths[row - offsets[chunk_id]]
+        return [
+            [(paths[row], score) for score, row in sorted(heap, key=lambda e: (-e[0], e[1]))]
+            for heap in heaps
+        ]
@@ -0,0 +1,108 @@
+import os
+import time
+import sqlite3
+import threading
+
+MANIFEST_PATH = os.getenv("DOWNLOAD_MANIFEST", "./download_manifest.sqlite")
+
+PARTIAL = "partial"
+COMPLETE = "complete"
+REJECTED = "rejected"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    path TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    length INTEGER,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_downloads_url ON downloads (url);
+CREATE TABLE IF NOT EXISTS urls (
+    canonical_url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    length INTEGER,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_urls_sha256 ON urls (sha256);
+CREATE TABLE IF NOT EXISTS rejections (
+    canonical_url TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    policy TEXT NOT NULL,
+    received INTEGER NOT NULL,
+    rejected_at REAL NOT NULL
+);
+"""
+
+
+class DownloadManifest:
+    """Records what each download target came from and how far it got.
+
+    `length` is the full body size once known; for a partial entry the bytes
+    already on disk live in `<path>.part`.
+    """
+
+    def __init__(self, db_path=MANIFEST_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def get(self, path):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM downloads WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, path, url, state, etag=None, last_modified=None, length=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads (path, url, etag, last_modified, length, state, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(path), url, etag, last_modified, length, state, time.time())
+            )
+
+    def lookup_url(self, canonical_url):
+        """Content hash already fetched for a canonical URL, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT sha256 FROM urls WHERE canonical_url = ?", (canonical_url,)).fetchone()
+        return row["sha256"] if row else None
+
+    def register_url(self, canonical_url, sha256, length):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (canonical_url, sha256, length, fetched_at) VALUES (?, ?, ?, ?)",
+                (canonical_url, sha256, length, time.time())
+            )
+
+    def lookup_rejection(self, canonical_url, policy):
+        """(kind, reason) if the URL was rejected under the same download policy, else None."""
+        with self._lock:
+            row = self._db.execute("SELECT kind, reason FROM rejections WHERE canonical_url = ? AND policy = ?",
+                                   (canonical_url, policy)).fetchone()
+        return (row["kind"], row["reason"]) if row else None
+
+    def record_rejection(self, canonical_url, kind, reason, policy, received):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO rejections (canonical_url, kind, reason, policy, received, rejected_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (canonical_url, kind, reason, policy, received, time.time())
+            )
+
+    def forget(self, path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM downloads WHERE path = ?", (os.path.abspath(path),))
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM downloads GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,30 +1,27 @@
 import os
 import json
-import requests
-import shutil
-import subprocess
+import argparse
 from urllib.parse import urlparse
 from PIL import Image
 from io import BytesIO
 from datetime import datetime
+from metadata_reader import strip_groups
+from metadata_catalog import get_catalog
+from caption_index import CaptionIndex
+from similarity_search import description_text
+from downloader import Downloader, MAX_CONCURRENCY, PER_HOST_CONCURRENCY
+from download_policy import DownloadPolicy, MIN_WIDTH, MIN_HEIGHT, MAX_BYTES
+from tiered_fetch import TieredFetcher, PREFILTER_THRESHOLD
+from instrumentation import get_metrics, timed
 
 # Helper: Extract EXIF date and location from image
 
+@timed("extract.exif_info")
 def extract_exif_info(image_path):
     try:
-        result = subprocess.run(
-            [
-                "exiftool",
-                "-DateTimeOriginal",
-                "-CreateDate",
-                "-City",
-                "-Country",
-                "-json",
-                image_path
-            ],
-            capture_output=True, text=True, check=True
-        )
-        metadata = json.loads(result.stdout)[0]
+        metadata = strip_groups(get_catalog().metadata([image_path])[image_path])
+        if not metadata:
+            raise ValueError("no metadata returned")
 
         date = metadata.get("DateTimeOriginal") or metadata.get("CreateDate")
         location_parts = [metadata.get("City"), metadata.get("Country")]
@@ -50,35 +47,40 @@ def build_filename(base_name, index, ext, date=None, location=None):
 
 # Download image from URL
 
-def download_image(url, save_path):
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}  # Some sites block Python requests
-        r = requests.get(url, headers=headers, stream=True, timeout=15)
-        if r.status_code == 200:
-            with open(save_path, 'wb') as f:
-                shutil.copyfileobj(r.raw, f)
-            print(f"[✓] Saved {save_path}")
-        else:
-            print(f"[WARN] Failed to fetch {url} (status {r.status_code})")
-    except Exception as e:
-        print(f"[ERROR] Could not download {url}: {e}")
+def download_image(url, save_path, downloader=None):
+    if downloader is None:
+        downloader = Downloader(max_concurrency=1)
+    return downloader.fetch(url, save_path) is not None
+
+# Append newly downloaded candidates to the caption index used by similarity_search
+
+def index_download(path, index):
+    """Queue one downloaded candidate's caption; it is searchable after the index's next flush."""
+    record = get_catalog().records([path], with_metadata=True).get(path)
+    if record:
+        index.add(path, description_text(record["metadata"]), record["sha256"])
 
 # Main logic
 
-def download_from_results_file(results_file):
+def plan_downloads(results_file, output_dir="./downloaded_images"):
+    """Turn one results JSON into (url, save_path) jobs named by build_filename."""
     with open(results_file, "r") as f:
         results = json.load(f)
 
     base_name = os.path.splitext(os.path.basename(results_file))[0].replace("_results", "")
+    return plan_jobs(results, base_name, output_dir)
+
+def input_image_for(base_name):
     input_image_path = os.path.join("./input_images", base_name + ".jpg")
     if not os.path.exists(input_image_path):
         input_image_path = os.path.join("./input_images", base_name + ".jpeg")
+    return input_image_path
 
-    date_str, location_str = extract_exif_info(input_image_path)
-
-    output_dir = "./downloaded_images"
-    os.makedirs(output_dir, exist_ok=True)
+def plan_items(results, base_name, output_dir="./downloaded_images"):
+    """(result item, url, save_path) for the search hits of input image `base_name`."""
+    date_str, location_str = extract_exif_info(input_image_for(base_name))
 
+    planned = []
     for i, item in enumerate(results):
         if item.get("type") != "image":
             continue
@@ -89,12 +91,97 @@ def download_from_results_file(results_file):
         parsed_url = urlparse(url)
         ext = os.path.splitext(parsed_url.path)[1] or ".jpg"
         filename = build_filename(base_name, i+1, ext, date=date_str, location=location_str)
-        save_path = os.path.join(output_dir, filename)
-        download_image(url, save_path)
+        planned.append((item, url, os.path.join(output_dir, filename)))
+    return planned
+
+def plan_jobs(results, base_name, output_dir="./downloaded_images"):
+    """(url, save_path) jobs for the search hits of input image `base_name`."""
+    return [(url, save_path) for _, url, save_path in plan_items(results, base_name, output_dir)]
+
+def download_tiered(results_files, downloader, output_dir="./downloaded_images", threshold=PREFILTER_THRESHOLD,
+                    on_done=None):
+    """Thumbnails first, then only the originals that pass the prefilter (see tiered_fetch.py)."""
+    plans = []
+    for results_file in results_files:
+        with open(results_file, "r") as f:
+            results = json.load(f)
+        base_name = os.path.splitext(os.path.basename(results_file))[0].replace("_results", "")
+        plans.append((input_image_for(base_name), plan_items(results, base_name, output_dir)))
+
+    fetcher = TieredFetcher(downloader, threshold)
+    try:
+        done = fetcher.fetch_all(plans, on_done)
+    finally:
+        fetcher.close()
+    print(f"[✓] Thumbnails: {fetcher.thumbnails.stats.summary()}")
+    print(f"[✓] Prefilter: {fetcher.stats.summary()}")
+    return done
+
+def download_from_results_files(results_files, index=None, downloader=None, output_dir="./downloaded_images",
+                                tiered=False, threshold=PREFILTER_THRESHOLD):
+    """Download every hit of every results file through one concurrent downloader."""
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for results_file in results_files:
+        jobs.extend(plan_downloads(results_file, output_dir))
+
+    if index is None:
+        index = CaptionIndex()
+
+    def on_done(outcome):
+        # Indexed as each file lands, while the rest are still downloading
+        _, path, nbytes = outcome
+        if nbytes is not None:
+            index_download(path, index)
+
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = Downloader()
+    try:
+        print(f"[INFO] Downloading {'up to ' if tiered else ''}{len(jobs)} images "
+              f"({downloader.max_concurrency} concurrent, {downloader.per_host} per host)")
+        if tiered:
+            done = download_tiered(results_files, downloader, output_dir, threshold, on_done)
+        else:
+            done = downloader.fetch_all(jobs, on_done)
+    finally:
+        if own_downloader:
+            downloader.close()
+    print(f"[✓] Downloads: {downloader.stats.summary()}")
+    blobs, blob_bytes = downloader.blobs.disk_usage()
+    print(f"[✓] Store: {len(jobs)} hits backed by {blobs} unique images ({blob_bytes / 1e6:.1f} MB)")
+
+    saved = [path for _, path, nbytes in done if nbytes is not None]
+    print(f"[✓] Indexed {index.flush()} new candidate captions")
+    return saved
+
+def download_from_results_file(results_file, index=None, downloader=None):
+    return download_from_results_files([results_file], index, downloader)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the image hits listed in exif_search_results")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=PER_HOST_CONCURRENCY)
+    parser.add_argument("--no-revalidate", action="store_true",
+                        help="skip finished downloads without a conditional request to the server")
+    parser.add_argument("--min-width", type=int, default=MIN_WIDTH, help="reject smaller images (0 disables)")
+    parser.add_argument("--min-height", type=int, default=MIN_HEIGHT, help="reject smaller images (0 disables)")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES, help="reject larger bodies (0 disables)")
+    parser.add_argument("--tiered", action="store_true",
+                        help="fetch thumbnails first and originals only for hits that pass the prefilter")
+    parser.add_argument("--prefilter-threshold", type=float, default=PREFILTER_THRESHOLD,
+                        help="min thumbnail pHash or title similarity to the input image for --tiered")
+    args = parser.parse_args()
+
     results_dir = "./exif_search_results"
     results_files = [os.path.join(results_dir, f) for f in os.listdir(results_dir) if f.endswith(".json")]
 
-    for results_file in results_files:
-        download_from_results_file(results_file)
+    downloader = Downloader(max_concurrency=args.concurrency, per_host=args.per_host,
+                            revalidate=not args.no_revalidate,
+                            policy=DownloadPolicy(args.min_width, args.min_height, args.max_bytes))
+    try:
+        with get_metrics().stage("download"):
+            download_from_results_files(results_files, CaptionIndex(), downloader, tiered=args.tiered,
+                                        threshold=args.prefilter_threshold)
+    finally:
+        downloader.close()
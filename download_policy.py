@@ -0,0 +1,180 @@
+import os
+import struct
+
+# Responses are rejected below this size (px; 0 disables), above MAX_BYTES, or when not an allowed image format
+MIN_WIDTH = int(os.getenv("DOWNLOAD_MIN_WIDTH", "150"))
+MIN_HEIGHT = int(os.getenv("DOWNLOAD_MIN_HEIGHT", "150"))
+MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", "30000000"))
+ALLOWED_FORMATS = tuple(os.getenv("DOWNLOAD_FORMATS", "jpeg,png,gif,webp,bmp,tiff,heif").split(","))
+# Bytes buffered while looking for the dimensions; a JPEG's SOF can sit behind a large EXIF/ICC block
+SNIFF_BYTES = 256 * 1024
+
+# Content types that may still carry an image, as some hosts label everything as a download
+GENERIC_CONTENT_TYPES = ("application/octet-stream", "binary/octet-stream", "application/binary")
+HTML_PREFIXES = (b"<!doctype html", b"<html", b"<head", b"<body")
+# JPEG SOFn markers, i.e. every 0xC0-0xCF except DHT, JPG and DAC
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class Rejected(Exception):
+    """A response failed the download policy; `kind` groups reasons for the stats."""
+
+    def __init__(self, kind, reason, received=0, expected=None, known=False):
+        super().__init__(reason)
+        self.kind = kind
+        self.reason = reason
+        self.received = received
+        self.expected = expected
+        self.known = known
+
+
+def sniff_format(head):
+    """Image format from the leading bytes: 'jpeg', 'png', ..., 'svg', 'html', or None if unrecognized."""
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:2] == b"BM":
+        return "bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"avif", b"hevc"):
+        return "heif"
+    text = head[:512].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith(HTML_PREFIXES):
+        return "html"
+    if text.startswith(b"<svg") or (text.startswith(b"<?xml") and b"<svg" in text):
+        return "svg"
+    if text[:1] in (b"<", b"{", b"["):
+        return "text"
+    return None
+
+
+def _jpeg_size(head):
+    pos = 2
+    while pos + 9 <= len(head):
+        if head[pos] != 0xFF:
+            return None
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in JPEG_SOF:
+            height, width = struct.unpack_from(">HH", head, pos + 5)
+            return width, height
+        if marker == 0xDA:
+            return None
+        pos += 2 + struct.unpack_from(">H", head, pos + 2)[0]
+    return None
+
+
+def _webp_size(head):
+    chunk = head[12:16]
+    if chunk == b"VP8 " and len(head) >= 30:
+        width, height = struct.unpack_from("<HH", head, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(head) >= 30:
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+def _tiff_size(head):
+    endian = "<" if head[:2] == b"II" else ">"
+    offset = struct.unpack_from(endian + "I", head, 4)[0]
+    if offset + 2 > len(head):
+        return None
+    size = {}
+    for i in range(struct.unpack_from(endian + "H", head, offset)[0]):
+        entry = offset + 2 + 12 * i
+        if entry + 12 > len(head):
+            return None
+        tag, typ = struct.unpack_from(endian + "HH", head, entry)
+        if tag in (256, 257):
+            size[tag] = struct.unpack_from(endian + ("H" if typ == 3 else "I"), head, entry + 8)[0]
+    return (size[256], size[257]) if len(size) == 2 else None
+
+
+def image_size(head, fmt):
+    """(width, height) parsed from the header bytes, or None if they aren't in `head` (or not parsed for `fmt`)."""
+    try:
+        if fmt == "jpeg":
+            return _jpeg_size(head)
+        if fmt == "png" and len(head) >= 24:
+            return struct.unpack_from(">II", head, 16)
+        if fmt == "gif" and len(head) >= 10:
+            return struct.unpack_from("<HH", head, 6)
+        if fmt == "webp":
+            return _webp_size(head)
+        if fmt == "bmp" and len(head) >= 26:
+            width, height = struct.unpack_from("<ii", head, 18)
+            return width, abs(height)
+        if fmt == "tiff" and len(head) >= 8:
+            return _tiff_size(head)
+    except struct.error:
+        pass
+    return None
+
+
+class DownloadPolicy:
+    """Decides from headers and the first bytes of a body whether a download is worth finishing.
+
+    Dimensions that can't be found in the first SNIFF_BYTES (or formats
+    whose headers aren't parsed, like HEIF) don't cause a rejection.
+    """
+
+    def __init__(self, min_width=MIN_WIDTH, min_height=MIN_HEIGHT, max_bytes=MAX_BYTES,
+                 allowed_formats=ALLOWED_FORMATS, sniff_bytes=SNIFF_BYTES):
+        self.min_width = min_width
+        self.min_height = min_height
+        self.max_bytes = max_bytes
+        self.allowed_formats = tuple(allowed_formats)
+        self.sniff_bytes = sniff_bytes
+
+    @property
+    def key(self):
+        """Identifies the policy, so stored rejections are only trusted under the same settings."""
+        return f"{self.min_width}x{self.min_height}/{self.max_bytes}/{','.join(sorted(self.allowed_formats))}"
+
+    def check_size(self, nbytes):
+        if self.max_bytes and nbytes is not None and nbytes > self.max_bytes:
+            raise Rejected("too-large", f"{nbytes / 1e6:.1f} MB exceeds the {self.max_bytes / 1e6:.1f} MB limit")
+
+    def check_headers(self, content_type, length):
+        """Reject on the response headers alone, before any of the body is read."""
+        mime = (content_type or "").split(";", 1)[0].strip().lower()
+        if mime and not mime.startswith("image/") and mime not in GENERIC_CONTENT_TYPES:
+            raise Rejected("not-image", f"content type {mime}")
+        if mime == "image/svg+xml" and "svg" not in self.allowed_formats:
+            raise Rejected("format", "format svg not allowed")
+        self.check_size(length)
+
+    def check_head(self, head, complete=False):
+        """Return True once `head` shows the body is acceptable, False if more bytes are needed.
+
+        Raises Rejected when it isn't. `complete` means `head` is the whole body.
+        """
+        fmt = sniff_format(head)
+        if fmt is None:
+            if len(head) < 16 and not complete:
+                return False
+            raise Rejected("not-image", "unrecognized file signature")
+        if fmt in ("html", "text"):
+            raise Rejected("not-image", f"body is {fmt}, not an image")
+        if fmt not in self.allowed_formats:
+            raise Rejected("format", f"format {fmt} not allowed")
+        if not (self.min_width or self.min_height):
+            return True
+        size = image_size(head, fmt)
+        if size is None:
+            return complete or len(head) >= self.sniff_bytes or fmt == "heif"
+        width, height = size
+        if width < self.min_width or height < self.min_height:
+            raise Rejected("too-small", f"{width}x{height} is below {self.min_width}x{self.min_height}")
+        return True
@@ -0,0 +1,377 @@
+import os
+import time
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from download_manifest import DownloadManifest, PARTIAL, COMPLETE, REJECTED
+from download_policy import DownloadPolicy, Rejected
+from blob_store import BlobStore, canonical_url, link_or_copy
+from instrumentation import get_metrics
+
+MAX_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "16"))
+PER_HOST_CONCURRENCY = int(os.getenv("DOWNLOAD_PER_HOST_CONCURRENCY", "4"))
+TIMEOUT = 15
+CHUNK_SIZE = 64 * 1024
+HEADERS = {"User-Agent": "Mozilla/5.0"}  # Some sites block Python requests
+PART_SUFFIX = ".part"
+
+
+class DownloadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.ok = 0
+        self.failed = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.not_modified = 0
+        self.resumed = 0
+        self.deduped_urls = 0
+        self.deduped_content = 0
+        self.rejected = defaultdict(int)
+        self.known_rejections = 0
+        self.wasted_bytes = 0
+        self.avoided_bytes = 0
+
+    def record(self, nbytes):
+        with self._lock:
+            if nbytes is None:
+                self.failed += 1
+            else:
+                self.ok += 1
+                self.bytes += nbytes
+
+    def reject(self, rejection):
+        with self._lock:
+            self.rejected[rejection.kind] += 1
+            if rejection.known:
+                self.known_rejections += 1
+            self.wasted_bytes += rejection.received
+            if rejection.expected is not None:
+                self.avoided_bytes += max(0, rejection.expected - rejection.received)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.bytes / elapsed / 1e6 if elapsed else 0.0
+        files_rate = self.ok / elapsed if elapsed else 0.0
+        return (f"{self.ok} available ({self.skipped} already complete, {self.not_modified} not modified, "
+                f"{self.resumed} resumed, {self.deduped_urls} known URLs, {self.deduped_content} duplicate bodies), "
+                f"{self.failed} failed, {self.bytes / 1e6:.1f} MB in {elapsed:.1f} s "
+                f"({files_rate:.1f} files/s, {rate:.2f} MB/s){self.rejection_summary()}")
+
+    def rejection_summary(self):
+        rejected = sum(self.rejected.values())
+        if not rejected:
+            return ""
+        kinds = ", ".join(f"{n} {kind}" for kind, n in sorted(self.rejected.items()))
+        return (f"; {rejected} rejected ({kinds}; {self.known_rejections} known from earlier runs), "
+                f"{self.wasted_bytes / 1e6:.1f} MB read before aborting, {self.avoided_bytes / 1e6:.1f} MB not "
+                f"downloaded, {rejected} files kept out of metadata reads and scoring")
+
+
+class Downloader:
+    """Concurrent image fetcher over one keep-alive connection pool.
+
+    At most `max_concurrency` transfers run at once, and at most `per_host`
+    of those against any single host. Jobs wait in a queue per host and only
+    reach the worker pool once their host has a free slot, so jobs for a busy
+    host never hold workers that other hosts could use.
+
+    Bodies are streamed to `<path>.part` and renamed into place only when
+    complete, and every transfer is recorded in a DownloadManifest: finished
+    files are skipped (or revalidated with If-None-Match/If-Modified-Since)
+    and partial ones are resumed with a Range request.
+
+    Completed bodies go into a content-addressed BlobStore and the target
+    name becomes a hardlink to the blob. A URL whose canonical form was
+    already fetched is linked from the store without touching the network,
+    and a job for a canonical URL that is already being fetched is only
+    scheduled once that transfer finishes, so it links the result instead of
+    holding a worker while it waits.
+
+    Each response is checked against a DownloadPolicy: Content-Type and
+    Content-Length first, then the file signature and the dimensions in the
+    image header as the first bytes arrive. Failing transfers are aborted,
+    and the reason is stored so later runs skip the URL under the same policy.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, per_host=PER_HOST_CONCURRENCY, timeout=TIMEOUT,
+                 manifest=None, revalidate=True, blobs=None, policy=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        # A manifest passed in is shared with its owner, who closes it
+        self._owns_manifest = manifest is None
+        self.manifest = manifest if manifest is not None else DownloadManifest()
+        self.revalidate = revalidate
+        self.blobs = blobs if blobs is not None else BlobStore()
+        self.policy = policy if policy is not None else DownloadPolicy()
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=self.max_concurrency, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = DownloadStats()
+        self._hosts_lock = threading.Lock()
+        self._host_queues = defaultdict(deque)
+        self._host_active = defaultdict(int)
+        self._pool = None
+
+    def submit(self, url, save_path):
+        """Queue a download; returns a Future of its (url, save_path, nbytes or None) outcome."""
+        future = Future()
+        self._schedule(url, save_path, future)
+        return future
+
+    def _schedule(self, url, save_path, future):
+        canon = canonical_url(url)
+        with self._inflight_lock:
+            leader = self._inflight.get(canon)
+            if leader is None:
+                self._inflight[canon] = future
+        if leader is not None:
+            # Someone else is fetching the same resource; retry once they're done, when it can be linked
+            leader.add_done_callback(lambda _: self._schedule(url, save_path, future))
+            return
+        host = urlparse(url).netloc.lower()
+        with self._hosts_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="download")
+            if self._host_active[host] >= self.per_host:
+                self._host_queues[host].append((url, save_path, future))
+                return
+            self._host_active[host] += 1
+            self._pool.submit(self._run, host, url, save_path, future)
+
+    def _run(self, host, url, save_path, future):
+        try:
+            outcome = (url, save_path, self._transfer(url, save_path))
+        except BaseException as e:
+            outcome = e
+        # Hand the host's slot to its next queued job before reporting, so callbacks can't delay it
+        with self._hosts_lock:
+            if self._host_queues[host]:
+                self._pool.submit(self._run, host, *self._host_queues[host].popleft())
+            else:
+                self._host_active[host] -= 1
+        # Before the result is set, so duplicates chained on this future find the URL free when they reschedule
+        with self._inflight_lock:
+            del self._inflight[canonical_url(url)]
+        if isinstance(outcome, BaseException):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+
+    def fetch(self, url, save_path):
+        """Make `save_path` hold the body of `url`.
+
+        Returns the number of bytes transferred (0 when the file was already
+        complete), or None on failure or rejection.
+        """
+        return self.submit(url, save_path).result()[2]
+
+    def _transfer(self, url, save_path):
+        nbytes = None
+        metrics = get_metrics()
+        with metrics.span("download.fetch", url=url) as span:
+            try:
+                nbytes = self._fetch(url, save_path)
+            except Rejected as e:
+                self._reject(url, save_path, e)
+                metrics.count(f"download.rejected.{e.kind}")
+                span["rejected"] = e.kind
+                return None
+            except Exception as e:
+                print(f"[ERROR] Could not download {url}: {e}")
+                metrics.count("download.errors")
+                nbytes = None
+            span["bytes"] = nbytes
+        if nbytes is not None:
+            metrics.count("download.bytes", nbytes)
+        self.stats.record(nbytes)
+        return nbytes
+
+    def _fetch(self, url, save_path):
+        canon = canonical_url(url)
+        entry = self.manifest.get(save_path)
+        finished = entry and entry["state"] == COMPLETE and entry["url"] == url and os.path.exists(save_path)
+        if finished:
+            return self._download(url, canon, save_path, entry)
+
+        known = self.manifest.lookup_rejection(canon, self.policy.key)
+        if known:
+            raise Rejected(*known, known=True)
+        if self._link_known(url, canon, save_path):
+            return 0
+        return self._download(url, canon, save_path, entry)
+
+    def _reject(self, url, save_path, rejection):
+        self.stats.reject(rejection)
+        self.manifest.record(save_path, url, REJECTED)
+        if not rejection.known:
+            self.manifest.record_rejection(canonical_url(url), rejection.kind, rejection.reason, self.policy.key,
+                                           rejection.received)
+        print(f"[SKIP] Rejected {url}: {rejection.reason}")
+
+    def _link_known(self, url, canon, save_path):
+        sha256 = self.manifest.lookup_url(canon)
+        if not sha256 or not self.blobs.find(sha256):
+            return False
+        self.blobs.link(sha256, save_path)
+        self.manifest.record(save_path, url, COMPLETE, length=os.path.getsize(save_path))
+        self.stats.count("deduped_urls")
+        print(f"[✓] Linked {save_path} (already fetched)")
+        return True
+
+    def _download(self, url, canon, save_path, entry):
+        if entry and entry["url"] != url:
+            entry = None
+        part_path = save_path + PART_SUFFIX
+        headers = {}
+
+        if entry and entry["state"] == COMPLETE and os.path.exists(save_path) \
+                and (entry["length"] is None or os.path.getsize(save_path) == entry["length"]):
+            if not self.revalidate or not (entry["etag"] or entry["last_modified"]):
+                self.stats.count("skipped")
+                return 0
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        offset = 0
+        if entry and entry["state"] == PARTIAL and os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                # Only resume if the resource is still the one we started on
+                validator = entry["etag"] or entry["last_modified"]
+                if validator:
+                    headers["If-Range"] = validator
+
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as r:
+            if r.status_code == 304:
+                self.stats.count("not_modified")
+                return 0
+            if r.status_code == 416 and offset and entry["length"] == offset:
+                return self._finish(url, canon, part_path, save_path, entry["etag"], entry["last_modified"], offset, 0)
+            if r.status_code == 206 and offset:
+                self.stats.count("resumed")
+                mode = "ab"
+            elif r.status_code == 200:
+                offset, mode = 0, "wb"
+            else:
+                print(f"[WARN] Failed to fetch {url} (status {r.status_code})")
+                return None
+
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+            length = self._full_length(r, offset)
+            try:
+                # The partial entry is only recorded once there are accepted bytes to resume from
+                written = self._stream(r, part_path, mode, offset, length, lambda: self.manifest.record(
+                    save_path, url, PARTIAL, etag, last_modified, length))
+            except Rejected as e:
+                e.expected = None if length is None else length - offset
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+        if length is not None and offset + written != length:
+            print(f"[WARN] Short read for {url}: {offset + written} of {length} bytes, will resume next run")
+            return None
+        return self._finish(url, canon, part_path, save_path, etag, last_modified, offset + written, written)
+
+    def _stream(self, response, part_path, mode, offset, length, on_start):
+        """Write the body to `part_path`, holding back the first bytes until the policy accepts them.
+
+        `on_start()` runs just before the first byte is written. A resumed
+        body's head was checked when the transfer started, so only the size
+        limit applies to it. Returns the number of bytes received.
+        """
+        if offset == 0:
+            self.policy.check_headers(response.headers.get("Content-Type"), length)
+        else:
+            self.policy.check_size(length)
+        head = bytearray()
+        accepted = offset > 0
+        received = 0
+        f = None
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                received += len(chunk)
+                self.policy.check_size(offset + received)
+                if not accepted:
+                    head += chunk
+                    if not self.policy.check_head(bytes(head)):
+                        continue
+                    accepted, chunk = True, bytes(head)
+                if f is None:
+                    on_start()
+                    f = open(part_path, mode)
+                f.write(chunk)
+            if not accepted:
+                self.policy.check_head(bytes(head), complete=True)
+                on_start()
+                f = open(part_path, mode)
+                f.write(head)
+        except Rejected as e:
+            e.received = received
+            raise
+        finally:
+            if f is not None:
+                f.close()
+        return received
+
+    def _finish(self, url, canon, part_path, save_path, etag, last_modified, length, written):
+        sha256, blob_path, is_new = self.blobs.ingest(part_path)
+        link_or_copy(blob_path, save_path)
+        self.manifest.record(save_path, url, COMPLETE, etag, last_modified, length)
+        self.manifest.register_url(canon, sha256, length)
+        if is_new:
+            print(f"[✓] Saved {save_path}")
+        else:
+            self.stats.count("deduped_content")
+            print(f"[✓] Linked {save_path} (same bytes as an earlier download)")
+        return written
+
+    @staticmethod
+    def _full_length(response, offset):
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and "Content-Encoding" not in response.headers:
+            return int(content_length)
+        return None
+
+    def fetch_all(self, jobs, on_done=None):
+        """Download (url, save_path) jobs concurrently.
+
+        Returns [(url, save_path, nbytes_or_None)] in completion order;
+        `on_done` is called with the same tuple as each transfer finishes.
+        """
+        done = []
+        for future in as_completed([self.submit(url, path) for url, path in jobs]):
+            outcome = future.result()
+            done.append(outcome)
+            if on_done:
+                on_done(outcome)
+        return done
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self.session.close()
+        if self._owns_manifest:
+            self.manifest.close()
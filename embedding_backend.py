@@ -0,0 +1,242 @@
+import os
+import json
+import threading
+import numpy as np
+from blob_store import file_sha256
+from image_prefetch import prefetch_batches
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "./embeddings")
+BATCH_SIZE = 32
+GROW_ROWS = 4096
+
+
+class HistogramEncoder:
+    """Deterministic, dependency-free encoder for tests and benchmarks.
+
+    Embeds an image as its L2-normalized joint RGB color histogram plus a
+    coarse grayscale thumbnail. No weights are downloaded.
+    """
+
+    image_size = (32, 32)
+
+    def __init__(self, bins=4):
+        self.bins = bins
+        self.dim = bins ** 3 + 64
+        # Other bin counts give other vectors, so they get a store of their own
+        self.name = "histogram-v1" if bins == 4 else f"histogram-v1-{bins}bins"
+
+    def encode(self, images):
+        vectors = np.zeros((len(images), self.dim), dtype=np.float32)
+        for i, img in enumerate(images):
+            rgb = np.asarray(img.convert("RGB").resize(self.image_size), dtype=np.int32) * self.bins // 256
+            codes = (rgb[..., 0] * self.bins + rgb[..., 1]) * self.bins + rgb[..., 2]
+            vectors[i, :self.bins ** 3] = np.bincount(codes.ravel(), minlength=self.bins ** 3)
+            thumb = np.asarray(img.convert("L").resize((8, 8)), dtype=np.float32)
+            vectors[i, self.bins ** 3:] = (thumb - thumb.mean()).ravel()
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class ClipEncoder:
+    """CLIP image encoder; the model is loaded on first use."""
+
+    image_size = (224, 224)
+
+    def __init__(self, model_name="openai/clip-vit-base-patch32"):
+        self.name = model_name
+        self._model = None
+        self._processor = None
+        self.dim = None
+
+    def _load(self):
+        if self._model is None:
+            import torch
+            from transformers import CLIPModel, CLIPProcessor
+            self._torch = torch
+            self._processor = CLIPProcessor.from_pretrained(self.name)
+            self._model = CLIPModel.from_pretrained(self.name).eval()
+            self.dim = self._model.config.projection_dim
+
+    def encode(self, images):
+        self._load()
+        inputs = self._processor(images=[img.convert("RGB") for img in images], return_tensors="pt")
+        with self._torch.inference_mode():
+            features = self._model.get_image_features(**inputs)
+        features = features / features.norm(dim=-1, keepdim=True)
+        return features.cpu().numpy().astype(np.float32)
+
+
+ENCODERS = {
+    "histogram": HistogramEncoder,
+    "clip": ClipEncoder,
+}
+
+
+def get_encoder(name):
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{name}' (choose from {', '.join(ENCODERS)})")
+    return ENCODERS[name]()
+
+
+class VectorStore:
+    """Memory-mapped float16 embedding matrix keyed by content hash.
+
+    `<dir>/<encoder>/vectors.f16` holds one row per key in `keys.jsonl`
+    order; the file grows in GROW_ROWS steps, so appending never rewrites
+    existing rows. `meta.json` records the row width, so a store can be
+    reopened before the encoder knows its own dimension; opening it with a
+    different width raises ValueError rather than misreading the rows.
+    """
+
+    def __init__(self, encoder_name, dim, root=VECTOR_STORE_DIR):
+        self.dim = dim
+        self.folder = self.folder_for(encoder_name, root)
+        os.makedirs(self.folder, exist_ok=True)
+        self._vectors_path = os.path.join(self.folder, "vectors.f16")
+        self._keys_path = os.path.join(self.folder, "keys.jsonl")
+        self._lock = threading.Lock()
+        stored = self.stored_dim(encoder_name, root)
+        if stored is None:
+            with open(os.path.join(self.folder, "meta.json"), "w") as f:
+                json.dump({"dim": dim}, f)
+        elif stored != dim:
+            raise ValueError(f"Vector store {self.folder} holds {stored}-dim embeddings, not {dim}; "
+                             f"give the encoder a different name or move the store aside")
+
+        self.keys = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "r") as f:
+                self.keys = [json.loads(line) for line in f if line.strip()]
+        self.rows = {key: i for i, key in enumerate(self.keys)}
+        self._capacity = 0
+        self._matrix = None
+        self._open(max(len(self.keys), 1))
+
+    @staticmethod
+    def folder_for(encoder_name, root=VECTOR_STORE_DIR):
+        return os.path.join(root, encoder_name.replace("/", "_"))
+
+    @staticmethod
+    def stored_dim(encoder_name, root=VECTOR_STORE_DIR):
+        """Row width of an existing store for `encoder_name`, or None if there is none yet."""
+        try:
+            with open(os.path.join(VectorStore.folder_for(encoder_name, root), "meta.json")) as f:
+                return json.load(f)["dim"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _open(self, min_rows):
+        capacity = max(self._capacity, GROW_ROWS)
+        while capacity < min_rows:
+            capacity *= 2
+        if capacity != self._capacity:
+            if self._matrix is not None:
+                self._matrix.flush()
+                del self._matrix
+            nbytes = capacity * self.dim * 2
+            with open(self._vectors_path, "ab") as f:
+                if f.tell() < nbytes:
+                    f.truncate(nbytes)
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+            self._capacity = capacity
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def add(self, keys, vectors):
+        with self._lock:
+            fresh = [(k, v) for k, v in zip(keys, vectors) if k not in self.rows]
+            if not fresh:
+                return
+            start = len(self.keys)
+            self._open(start + len(fresh))
+            self._matrix[start:start + len(fresh)] = np.stack([v for _, v in fresh]).astype(np.float16)
+            self._matrix.flush()
+            with open(self._keys_path, "a") as f:
+                for i, (key, _) in enumerate(fresh):
+                    f.write(json.dumps(key) + "\n")
+                    self.keys.append(key)
+                    self.rows[key] = start + i
+
+    def get(self, keys):
+        """Float32 matrix of the rows for `keys` (all must be present)."""
+        with self._lock:
+            return np.asarray(self._matrix[[self.rows[k] for k in keys]], dtype=np.float32)
+
+
+class EmbeddingIndex:
+    """Embeds images at most once per content hash and ranks them by cosine similarity."""
+
+    def __init__(self, encoder, root=VECTOR_STORE_DIR, batch_size=BATCH_SIZE):
+        self.encoder = encoder
+        self.batch_size = batch_size
+        self.root = root
+        self.store = None
+        self.encoded = 0
+
+    def _store(self, dim):
+        if self.store is None:
+            self.store = VectorStore(self.encoder.name, dim, self.root)
+        elif self.store.dim != dim:
+            # Opened from meta.json before the model loaded, and the model disagrees
+            raise ValueError(f"{self.encoder.name} produced {dim}-dim embeddings but its vector store "
+                             f"{self.store.folder} holds {self.store.dim}-dim ones")
+        return self.store
+
+    def embed(self, paths, hashes=None):
+        """Return {path: vector}, encoding only content not already stored."""
+        hashes = hashes or {}
+        keys = {}
+        for path in paths:
+            try:
+                keys[path] = hashes.get(path) or file_sha256(path)
+            except OSError as e:
+                print(f"[WARN] Couldn't hash {path}: {e}")
+
+        store = self.store
+        if store is None:
+            # CLIP only learns its dimension when the model loads; the store's own record is enough to reuse it
+            dim = getattr(self.encoder, "dim", None) or VectorStore.stored_dim(self.encoder.name, self.root)
+            if dim:
+                store = self._store(dim)
+        seen = set()
+        missing = []
+        for path, key in keys.items():
+            if (store is None or key not in store) and key not in seen:
+                seen.add(key)
+                missing.append(path)
+
+        for batch_paths, images in prefetch_batches(missing, self.encoder.image_size, self.batch_size):
+            vectors = self.encoder.encode(images)
+            self._store(vectors.shape[1]).add([keys[p] for p in batch_paths], vectors)
+            self.encoded += len(batch_paths)
+
+        if self.store is None:
+            return {}
+        present = [p for p in keys if keys[p] in self.store]
+        if not present:
+            return {}
+        matrix = self.store.get([keys[p] for p in present])
+        return dict(zip(present, matrix))
+
+    def rank(self, target_paths, candidate_paths, threshold=0.0, top_k=None):
+        """Return {target: [(candidate, score)]} best first, from one matmul per target block."""
+        targets = self.embed(target_paths)
+        candidates = self.embed(candidate_paths)
+        results = {path: [] for path in target_paths}
+        cand_paths = [p for p in candidate_paths if p in candidates]
+        if not cand_paths:
+            return results
+        cand_matrix = np.stack([candidates[p] for p in cand_paths])
+        target_list = [p for p in target_paths if p in targets]
+        if not target_list:
+            return results
+        scores = np.stack([targets[p] for p in target_list]) @ cand_matrix.T
+        for i, target in enumerate(target_list):
+            row = scores[i]
+            picks = np.flatnonzero(row >= threshold)
+            if top_k is not None and len(picks) > top_k:
+                picks = picks[np.argpartition(-row[picks], top_k - 1)[:top_k]]
+            picks = picks[np.argsort(-row[picks], kind="stable")]
+            results[target] = [(cand_paths[j], float(row[j])) for j in picks]
+        return results
@@ -1,10 +1,13 @@
 import os
 import json
-import subprocess
 import datetime
 import requests
 from urllib.parse import urlparse
 from dotenv import load_dotenv
+from metadata_reader import strip_groups
+from metadata_catalog import get_catalog
+from response_cache import get_cache
+from instrumentation import get_metrics, timed
 
 load_dotenv()
 
@@ -13,24 +16,19 @@ SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 if not SERPAPI_KEY:
     raise ValueError("Missing SerpAPI key. Check your environment variables.")
 
-def extract_query_fields(image_path):
+SERPAPI_ENDPOINT = os.getenv("SERPAPI_ENDPOINT", "https://serpapi.com/search")
+
+QUERY_FIELDS = ["Caption-Abstract", "Headline", "Description"]
+
+@timed("extract.query_fields")
+def extract_query_fields(image_path, metadata=None):
     """Extract description/caption/headline from EXIF metadata for smart search queries"""
     try:
-        result = subprocess.run(
-            [
-                "exiftool",
-                "-Caption-Abstract",
-                "-Headline",
-                "-Description",
-                "-json",
-                image_path
-            ],
-            capture_output=True, text=True, check=True
-        )
-        metadata = json.loads(result.stdout)[0]
+        if metadata is None:
+            metadata = strip_groups(get_catalog().metadata([image_path])[image_path])
 
         # Only search if one of the prioritized fields exists and is non-empty
-        for field in ["Caption-Abstract", "Headline", "Description"]:
+        for field in QUERY_FIELDS:
             value = metadata.get(field)
             if isinstance(value, str) and value.strip():
                 return value.strip()
@@ -42,6 +40,7 @@ def extract_query_fields(image_path):
         print(f"[ERROR] Failed to extract query fields from {image_path}: {e}")
         return None
 
+@timed("search.google_images")
 def search_google_images(query):
     print(f"[INFO] Running image search for: {query}")
     params = {
@@ -49,11 +48,15 @@ def search_google_images(query):
         "q": query,
         "api_key": SERPAPI_KEY
     }
-    try:
-        response = requests.get("https://serpapi.com/search", params=params)
+
+    def fetch():
+        response = requests.get(SERPAPI_ENDPOINT, params=params)
         if response.status_code != 200:
             raise Exception(f"SerpAPI error: {response.text}")
-        data = response.json()
+        return response.json()
+
+    try:
+        data = get_cache().fetch("serpapi", params, fetch)
 
         results = []
         for img in data.get("images_results", []):
@@ -65,8 +68,10 @@ def search_google_images(query):
                 "thumbnail": img.get("thumbnail")
             })
 
+        get_metrics().count("search.hits", len(results))
         return results
     except Exception as e:
+        get_metrics().count("search.errors")
         print(f"[EXCEPTION] Image search failed for query '{query}': {e}")
         return []
 
@@ -83,10 +88,14 @@ if __name__ == "__main__":
     os.makedirs(output_dir, exist_ok=True)
 
     image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    image_paths = [os.path.join(image_dir, f) for f in image_files]
+    metadata = get_catalog().metadata(image_paths)
+
+    with get_metrics().stage("exifsearch"):
+        for image_file, image_path in zip(image_files, image_paths):
+            query = extract_query_fields(image_path, strip_groups(metadata[image_path]))
+            if query:
+                results = search_google_images(query)
+                save_results(os.path.splitext(image_file)[0], results, output_dir)
 
-    for image_file in image_files:
-        image_path = os.path.join(image_dir, image_file)
-        query = extract_query_fields(image_path)
-        if query:
-            results = search_google_images(query)
-            save_results(os.path.splitext(image_file)[0], results, output_dir)
+    print(f"[✓] SerpAPI cache: {get_cache().summary()}")
@@ -0,0 +1,512 @@
+import os
+import re
+import mmap
+import zlib
+import struct
+import argparse
+import xml.etree.ElementTree as ET
+from metadata_reader import read_metadata as exiftool_read_metadata
+from instrumentation import get_metrics
+
+JPEG_SOI = b"\xff\xd8"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*")
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+PHOTOSHOP_HEADER = b"Photoshop 3.0\x00"
+# Casio QV cameras keep the capture date in an APP1 segment of their own
+QVCI_HEADER = b"QVCI\x00"
+# Metadata some tools append after the JPEG image (AFCP, FotoStation, Photo Mechanic), matched against the
+# last bytes of the file as exiftool does
+JPEG_TRAILERS = re.compile(rb"(AXS[!*].{8}|\xa1\xb2\xc3\xd4|cbipcbbl)\Z", re.S)
+IPTC_RESOURCE_ID = 0x0404
+PNG_XMP_KEYWORD = "XML:com.adobe.xmp"
+
+# Tags read from each IFD, named as `exiftool -G` reports them (all in group EXIF)
+IFD0_TAGS = {
+    0x010E: "ImageDescription", 0x010F: "Make", 0x0110: "Model", 0x0132: "ModifyDate",
+    0x013B: "Artist", 0x8298: "Copyright",
+    0x9C9B: "XPTitle", 0x9C9C: "XPComment", 0x9C9D: "XPAuthor", 0x9C9E: "XPKeywords", 0x9C9F: "XPSubject",
+}
+EXIF_IFD_TAGS = {0x9003: "DateTimeOriginal", 0x9004: "CreateDate"}
+GPS_TAGS = {1: "GPSLatitudeRef", 2: "GPSLatitude", 3: "GPSLongitudeRef", 4: "GPSLongitude"}
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+TIFF_XMP_TAG = 0x02BC
+TIFF_IPTC_TAG = 0x83BB
+TIFF_PHOTOSHOP_TAG = 0x8649
+XP_TAGS = {"XPTitle", "XPComment", "XPAuthor", "XPKeywords", "XPSubject"}
+# exiftool trims trailing blanks from these (cameras pad them to a fixed width)
+TRIMMED_TAGS = {"Make", "Model", "Artist"}
+# Bytes per value of each TIFF field type
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+IPTC_DATASETS = {
+    5: "ObjectName", 20: "SupplementalCategories", 25: "Keywords", 55: "DateCreated", 60: "TimeCreated",
+    80: "By-line", 85: "By-lineTitle", 90: "City", 92: "Sub-location", 95: "Province-State",
+    100: "Country-PrimaryLocationCode", 101: "Country-PrimaryLocationName", 105: "Headline",
+    110: "Credit", 115: "Source", 116: "CopyrightNotice", 120: "Caption-Abstract", 122: "Writer-Editor",
+}
+IPTC_LISTS = {"SupplementalCategories", "Keywords", "By-line", "By-lineTitle", "Writer-Editor"}
+IPTC_UTF8 = b"\x1b%G"
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+XMP_PROPERTIES = {
+    "http://purl.org/dc/elements/1.1/": {"description": "Description", "title": "Title", "subject": "Subject",
+                                         "creator": "Creator", "rights": "Rights"},
+    "http://ns.adobe.com/photoshop/1.0/": {"Headline": "Headline", "City": "City", "State": "State",
+                                           "Country": "Country", "DateCreated": "DateCreated",
+                                           "Credit": "Credit", "Source": "Source"},
+    "http://ns.adobe.com/xap/1.0/": {"CreateDate": "CreateDate", "ModifyDate": "ModifyDate"},
+    "http://ns.adobe.com/exif/1.0/": {"DateTimeOriginal": "DateTimeOriginal"},
+    "http://iptc.org/std/Iptc4xmpCore/1.0/xmlns/": {"Location": "Location", "CountryCode": "CountryCode"},
+}
+XMP_DATES = {"DateCreated", "CreateDate", "ModifyDate", "DateTimeOriginal"}
+XMP_DATE_RE = re.compile(r"^(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?(?:T(\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)(Z|[+-]\d{2}:\d{2})?)?$")
+
+# Strings `exiftool -j` prints as JSON numbers
+JSON_NUMBER_RE = re.compile(r"^-?(\d|[1-9]\d{1,14})(\.\d{1,16})?([eE][-+]?\d{1,3})?$")
+
+
+def _jsonish(value):
+    """Mirror exiftool's JSON output, where number-like strings become numbers."""
+    if isinstance(value, list):
+        return [_jsonish(v) for v in value]
+    if isinstance(value, str) and JSON_NUMBER_RE.match(value):
+        number = float(value)
+        return int(number) if number.is_integer() and "." not in value and "e" not in value.lower() else number
+    return value
+
+
+def _exif_text(raw):
+    # exiftool stops EXIF strings at the first NUL
+    return bytes(raw).split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+
+
+def _copyright(raw):
+    """Copyright as exiftool reads it: NUL-separated photographer and editor, joined by a newline, blanks trimmed."""
+    text = bytes(raw).decode("utf-8", errors="replace")
+    text = re.sub(r" *\x00", "\n", text, count=1)
+    text = re.sub(r" *\x00.*", "", text, count=1, flags=re.S)
+    return text[:-1] if text.endswith("\n") else text
+
+
+def _iptc_text(raw, utf8):
+    if utf8:
+        return bytes(raw).decode("utf-8", errors="replace")
+    # Without CodedCharacterSet exiftool assumes Windows Latin-1
+    try:
+        return bytes(raw).decode("cp1252")
+    except UnicodeDecodeError:
+        return bytes(raw).decode("latin-1")
+
+
+def _gps_degrees(parts):
+    if len(parts) != 3:
+        return None
+    if None in parts:
+        # exiftool prints a 0/0 rational as "undef", which -n turns into an empty string
+        return ""
+    degrees = parts[0] + parts[1] / 60.0 + parts[2] / 3600.0
+    # exiftool prints floats with 15 significant digits
+    return float(f"{degrees:.15g}")
+
+
+class TiffReader:
+    """Walks the IFDs of a TIFF structure starting at `base` in `buf`."""
+
+    def __init__(self, buf, base, end):
+        self.buf = buf
+        self.base = base
+        self.end = end
+        self.endian = "<" if buf[base:base + 2] == b"II" else ">"
+
+    def _unpack(self, fmt, pos):
+        return struct.unpack_from(self.endian + fmt, self.buf, pos)
+
+    def first_ifd(self):
+        return self._unpack("I", self.base + 4)[0]
+
+    def entries(self, offset):
+        """Return {tag: (type, count, absolute value position)} for the IFD at `offset`."""
+        pos = self.base + offset
+        if offset <= 0 or pos + 2 > self.end:
+            return {}
+        count = self._unpack("H", pos)[0]
+        found = {}
+        for i in range(count):
+            entry = pos + 2 + 12 * i
+            if entry + 12 > self.end:
+                break
+            tag, typ, n = self._unpack("HHI", entry)
+            size = TYPE_SIZES.get(typ)
+            if size is None:
+                continue
+            value_pos = entry + 8 if size * n <= 4 else self.base + self._unpack("I", entry + 8)[0]
+            if value_pos + size * n > self.end:
+                continue
+            found[tag] = (typ, n, value_pos)
+        return found
+
+    def raw(self, entry):
+        typ, n, pos = entry
+        return self.buf[pos:pos + TYPE_SIZES[typ] * n]
+
+    def value(self, entry):
+        typ, n, pos = entry
+        if typ == 2:
+            return _exif_text(self.raw(entry))
+        if typ in (1, 6, 7):
+            return bytes(self.raw(entry))
+        if typ in (5, 10):
+            pairs = self._unpack(("I" if typ == 5 else "i") * (2 * n), pos)
+            return [num / den if den else None for num, den in zip(pairs[::2], pairs[1::2])]
+        fmt = {3: "H", 4: "I", 8: "h", 9: "i", 11: "f", 12: "d"}[typ]
+        return list(self._unpack(fmt * n, pos))
+
+
+def parse_tiff(buf, base, end, tags):
+    """Add EXIF (and any embedded IPTC/XMP) tags from the TIFF structure at `base`."""
+    if end - base < 8 or buf[base:base + 4] not in TIFF_MAGIC:
+        return
+    reader = TiffReader(buf, base, end)
+    ifd0 = reader.entries(reader.first_ifd())
+    for tag in sorted(ifd0):
+        entry = ifd0[tag]
+        if tag in IFD0_TAGS:
+            name = IFD0_TAGS[tag]
+            if name in XP_TAGS:
+                text = bytes(reader.raw(entry)).decode("utf-16-le", errors="replace").rstrip("\x00")
+            elif name == "Copyright":
+                text = _copyright(reader.raw(entry))
+            else:
+                text = reader.value(entry) if entry[0] == 2 else None
+                if text is not None and name in TRIMMED_TAGS:
+                    text = text.rstrip()
+            if text is not None:
+                tags[f"EXIF:{name}"] = text
+        elif tag == TIFF_XMP_TAG:
+            parse_xmp(bytes(reader.raw(entry)), tags)
+        elif tag == TIFF_IPTC_TAG:
+            raw = reader.raw(entry)
+            parse_iptc(raw, 0, len(raw), tags)
+        elif tag == TIFF_PHOTOSHOP_TAG:
+            raw = reader.raw(entry)
+            parse_photoshop(raw, 0, len(raw), tags)
+        elif tag == EXIF_IFD_POINTER:
+            exif_ifd = reader.entries(reader.value(entry)[0])
+            for sub, name in EXIF_IFD_TAGS.items():
+                if sub in exif_ifd and exif_ifd[sub][0] == 2:
+                    tags[f"EXIF:{name}"] = reader.value(exif_ifd[sub])
+        elif tag == GPS_IFD_POINTER:
+            gps = reader.entries(reader.value(entry)[0])
+            for sub, name in GPS_TAGS.items():
+                if sub not in gps:
+                    continue
+                value = reader.value(gps[sub])
+                tags[f"EXIF:{name}"] = value if isinstance(value, str) else _gps_degrees(value)
+
+
+def parse_iptc(buf, start, end, tags):
+    """Add IPTC IIM record 2 datasets from buf[start:end]."""
+    utf8 = False
+    values = {}
+    pos = start
+    while pos + 5 <= end and buf[pos] == 0x1C:
+        record, dataset = buf[pos + 1], buf[pos + 2]
+        size = struct.unpack_from(">H", buf, pos + 3)[0]
+        pos += 5
+        if size & 0x8000:
+            # Extended dataset: the low bits give the length of the length field
+            nbytes = size & 0x7FFF
+            size = int.from_bytes(buf[pos:pos + nbytes], "big")
+            pos += nbytes
+        data = buf[pos:pos + size]
+        pos += size
+        if record == 1 and dataset == 90:
+            utf8 = bytes(data) == IPTC_UTF8
+        elif record == 2 and dataset in IPTC_DATASETS:
+            name = IPTC_DATASETS[dataset]
+            values.setdefault(name, []).append(data)
+
+    for name, raws in values.items():
+        texts = [_iptc_text(raw, utf8) for raw in raws]
+        if name == "DateCreated":
+            texts = [f"{t[:4]}:{t[4:6]}:{t[6:8]}" if re.fullmatch(r"\d{8}", t) else t for t in texts]
+        elif name == "TimeCreated":
+            texts = [f"{t[:2]}:{t[2:4]}:{t[4:6]}{t[6:9]}:{t[9:11]}" if re.fullmatch(r"\d{6}[+-]\d{4}", t) else t
+                     for t in texts]
+        if name in IPTC_LISTS and len(texts) > 1:
+            tags[f"IPTC:{name}"] = texts
+        else:
+            tags[f"IPTC:{name}"] = texts[0]
+
+
+def parse_photoshop(buf, start, end, tags):
+    """Find the IPTC block among Photoshop image resources (8BIM blocks)."""
+    pos = start
+    while pos + 12 <= end and buf[pos:pos + 4] == b"8BIM":
+        resource_id = struct.unpack_from(">H", buf, pos + 4)[0]
+        name_len = buf[pos + 6]
+        # Pascal string name, padded so length byte + name is even
+        pos += 6 + name_len + 1 + ((name_len + 1) % 2)
+        size = struct.unpack_from(">I", buf, pos)[0]
+        pos += 4
+        if resource_id == IPTC_RESOURCE_ID:
+            parse_iptc(buf, pos, min(pos + size, end), tags)
+        pos += size + (size % 2)
+
+
+def _xmp_value(element):
+    """Text of a simple, lang-alt, bag or seq XMP property."""
+    for container in ("Alt", "Bag", "Seq"):
+        node = element.find(f"{{{RDF}}}{container}")
+        if node is None:
+            continue
+        items = node.findall(f"{{{RDF}}}li")
+        if container == "Alt":
+            for li in items:
+                if li.get(XML_LANG) == "x-default":
+                    return li.text or ""
+            return items[0].text or "" if items else None
+        texts = [li.text or "" for li in items]
+        if not texts:
+            return None
+        return texts if len(texts) > 1 else texts[0]
+    return element.text if element.text and element.text.strip() else None
+
+
+def _xmp_date(value):
+    match = XMP_DATE_RE.match(value)
+    if not match:
+        return value
+    year, month, day, time, zone = match.groups()
+    date = ":".join(p for p in (year, month, day) if p)
+    if time:
+        date += f" {time}{zone or ''}"
+    return date
+
+
+def _utf16_encoding(packet):
+    """"utf-16" variant of a UTF-16 XMP packet (some Windows tools write them), or None for UTF-8."""
+    if packet[:2] in (b"\xfe\xff", b"\xff\xfe"):
+        return "utf-16"
+    if packet[:1] == b"\x00" and packet[1:2] != b"\x00":
+        return "utf-16-be"
+    if packet[1:2] == b"\x00" and packet[:1] != b"\x00":
+        return "utf-16-le"
+    return None
+
+
+def parse_xmp(packet, tags):
+    """Add the XMP properties in XMP_PROPERTIES from one XMP packet."""
+    encoding = _utf16_encoding(packet)
+    if encoding:
+        packet = packet.decode(encoding, errors="replace").encode("utf-8")
+    packet = packet.rstrip(b"\x00 \t\r\n")
+    start = packet.find(b"<x:xmpmeta")
+    if start < 0:
+        start = packet.find(b"<rdf:RDF")
+    end_tag = b"</x:xmpmeta>" if packet[start:start + 10] == b"<x:xmpmeta" else b"</rdf:RDF>"
+    end = packet.rfind(end_tag)
+    if start < 0 or end < 0:
+        return
+    try:
+        root = ET.fromstring(packet[start:end + len(end_tag)])
+    except ET.ParseError:
+        return
+    for description in root.iter(f"{{{RDF}}}Description"):
+        for key, value in description.attrib.items():
+            _add_xmp(key, value, tags)
+        for child in description:
+            value = _xmp_value(child)
+            if value is not None:
+                _add_xmp(child.tag, value, tags)
+
+
+def _add_xmp(qualified, value, tags):
+    if not qualified.startswith("{"):
+        return
+    namespace, local = qualified[1:].split("}", 1)
+    name = XMP_PROPERTIES.get(namespace, {}).get(local)
+    if name is None:
+        return
+    if name in XMP_DATES:
+        value = [_xmp_date(v) for v in value] if isinstance(value, list) else _xmp_date(value)
+    tags[f"XMP:{name}"] = value
+
+
+def parse_jpeg(buf, tags):
+    """Walk JPEG marker segments up to the start of scan; image data is never touched.
+
+    Returns False if the file keeps metadata somewhere only exiftool reads.
+    """
+    if JPEG_TRAILERS.search(buf[-16:]):
+        return False
+    pos = 2
+    size = len(buf)
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
+            break
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            break
+        length = struct.unpack_from(">H", buf, pos + 2)[0]
+        start, end = pos + 4, min(pos + 2 + length, size)
+        if marker == 0xE1 and buf[start:start + 6] == EXIF_HEADER:
+            parse_tiff(buf, start + 6, end, tags)
+        elif marker == 0xE1 and buf[start:start + len(XMP_HEADER)] == XMP_HEADER:
+            parse_xmp(bytes(buf[start + len(XMP_HEADER):end]), tags)
+        elif marker == 0xED and buf[start:start + len(PHOTOSHOP_HEADER)] == PHOTOSHOP_HEADER:
+            parse_photoshop(buf, start + len(PHOTOSHOP_HEADER), end, tags)
+        elif marker == 0xE1 and buf[start:start + len(QVCI_HEADER)] == QVCI_HEADER:
+            return False
+        pos += 2 + length
+    return True
+
+
+def _raw_profile(text):
+    """Decode an ImageMagick "Raw profile type ..." PNG text chunk (name, length, hex lines)."""
+    parts = text.split(None, 2)
+    if len(parts) < 3:
+        return b""
+    try:
+        return bytes.fromhex("".join(parts[2].split()))
+    except ValueError:
+        return b""
+
+
+def parse_png(buf, tags):
+    """Read metadata chunks; IDAT chunks are skipped by length, not read."""
+    pos = len(PNG_SIGNATURE)
+    size = len(buf)
+    while pos + 8 <= size:
+        length, kind = struct.unpack_from(">I4s", buf, pos)
+        data_start = pos + 8
+        data_end = min(data_start + length, size)
+        pos = data_end + 4
+        if kind == b"IEND":
+            break
+        if kind == b"eXIf":
+            parse_tiff(buf, data_start, data_end, tags)
+            continue
+        if kind not in (b"tEXt", b"zTXt", b"iTXt"):
+            continue
+        data = bytes(buf[data_start:data_end])
+        keyword, _, rest = data.partition(b"\x00")
+        keyword = keyword.decode("latin-1")
+        try:
+            if kind == b"tEXt":
+                text = rest.decode("latin-1")
+            elif kind == b"zTXt":
+                text = zlib.decompress(rest[1:]).decode("latin-1")
+            else:
+                compressed = rest[0] == 1
+                _, _, rest = rest[2:].partition(b"\x00")
+                _, _, body = rest.partition(b"\x00")
+                text = (zlib.decompress(body) if compressed else body).decode("utf-8", errors="replace")
+        except (zlib.error, IndexError):
+            continue
+
+        if keyword == PNG_XMP_KEYWORD:
+            parse_xmp(text.encode("utf-8"), tags)
+        elif keyword.startswith("Raw profile type "):
+            profile = _raw_profile(text)
+            kind_name = keyword[len("Raw profile type "):].lower()
+            if kind_name in ("exif", "app1") and profile.startswith(EXIF_HEADER):
+                parse_tiff(profile, len(EXIF_HEADER), len(profile), tags)
+            elif kind_name == "iptc":
+                if profile.startswith(b"8BIM"):
+                    parse_photoshop(profile, 0, len(profile), tags)
+                else:
+                    parse_iptc(profile, 0, len(profile), tags)
+            elif kind_name == "xmp":
+                parse_xmp(profile, tags)
+        else:
+            # exiftool names unknown keywords like its own tags: word characters only, first letter upper case
+            name = re.sub(r"[^-\w]", "", keyword)
+            tags[f"PNG:{name[:1].upper()}{name[1:]}"] = text
+
+
+def add_composites(tags):
+    """The Composite tags the pipeline reads, derived as exiftool derives them."""
+    for axis, negative in (("Latitude", "S"), ("Longitude", "W")):
+        value, ref = tags.get(f"EXIF:GPS{axis}"), tags.get(f"EXIF:GPS{axis}Ref")
+        if isinstance(value, float) and ref:
+            tags[f"Composite:GPS{axis}"] = -value if ref.upper().startswith(negative) else value
+    if "Composite:GPSLatitude" in tags and "Composite:GPSLongitude" in tags:
+        tags["Composite:GPSPosition"] = f"{tags['Composite:GPSLatitude']} {tags['Composite:GPSLongitude']}"
+    if "IPTC:DateCreated" in tags and "IPTC:TimeCreated" in tags:
+        tags["Composite:DateTimeCreated"] = f"{tags['IPTC:DateCreated']} {tags['IPTC:TimeCreated']}"
+    # Without a DateTimeOriginal tag exiftool makes one from the IPTC date and time
+    if ("Composite:DateTimeCreated" in tags and "EXIF:DateTimeOriginal" not in tags
+            and "XMP:DateTimeOriginal" not in tags):
+        tags["Composite:DateTimeOriginal"] = tags["Composite:DateTimeCreated"]
+
+
+def read_fast(path):
+    """Return an `exiftool -j -G -n`-style dict for the fields above, or None if the format isn't handled.
+
+    The file is memory-mapped, so only the pages holding headers and
+    metadata segments are actually read.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < 8:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            tags = {}
+            if buf[:2] == JPEG_SOI:
+                if not parse_jpeg(buf, tags):
+                    return None
+            elif buf[:8] == PNG_SIGNATURE:
+                parse_png(buf, tags)
+            elif buf[:4] in TIFF_MAGIC and buf[8:10] != b"CR":
+                # CR2 is TIFF-shaped but keeps its metadata in maker-specific IFDs: leave it to exiftool
+                parse_tiff(buf, 0, len(buf), tags)
+            else:
+                return None
+    add_composites(tags)
+    result = {"SourceFile": path}
+    result.update((key, _jsonish(value)) for key, value in tags.items())
+    return result
+
+
+def read_metadata(paths):
+    """Like metadata_reader.read_metadata(paths, numeric=True), reading JPEG/PNG/TIFF in-process.
+
+    Files in other formats, or that fail to parse, go to the exiftool pool
+    in one batch. Only the fields listed in this module are returned for
+    files read in-process.
+    """
+    found = {}
+    fallback = []
+    for path in paths:
+        try:
+            tags = read_fast(path)
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            print(f"[WARN] Fast metadata read failed for {path}, using exiftool: {e}")
+            tags = None
+        if tags is None:
+            fallback.append(path)
+        else:
+            found[path] = tags
+    if fallback:
+        get_metrics().count("metadata.exiftool_fallback", len(fallback))
+        found.update(exiftool_read_metadata(fallback, numeric=True))
+    return {path: found.get(path, {}) for path in paths}
+
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description="Print the metadata fields the pipeline uses, read without exiftool")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    print(json.dumps(read_metadata(args.paths), indent=2, ensure_ascii=False))
@@ -0,0 +1,227 @@
+import os
+import csv
+import time
+import argparse
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from response_cache import get_cache
+from instrumentation import get_metrics
+
+# GeoNames dump (cities500.txt, cities15000.txt, ...: tab-separated, no header) or a CSV with a header
+# naming at least name, latitude/lat and longitude/lon/lng columns
+GAZETTEER_PATH = os.getenv("GAZETTEER", "./gazetteer/cities15000.txt")
+# Places farther than this from every gazetteer entry go to Nominatim
+MAX_DISTANCE_KM = float(os.getenv("GEOCODER_MAX_KM", "25"))
+NOMINATIM_USER_AGENT = os.getenv("NOMINATIM_USER_AGENT", "ee292j-capture")
+# Nominatim's usage policy: at most one request per second
+NOMINATIM_INTERVAL = 1.0
+NOMINATIM_TTL = float(os.getenv("NOMINATIM_TTL", str(30 * 24 * 3600)))
+# Fallback answers are cached per ~100 m cell
+NOMINATIM_PRECISION = 3
+EARTH_RADIUS_KM = 6371.0088
+
+# Column positions in GeoNames' geoname table dump
+GEONAMES_COLUMNS = {"name": 1, "latitude": 4, "longitude": 5, "country_code": 8, "admin1": 10, "population": 14}
+CSV_ALIASES = {"latitude": ("latitude", "lat"), "longitude": ("longitude", "lon", "lng"),
+               "country_code": ("country_code", "countrycode", "country"), "admin1": ("admin1", "admin1_code", "region"),
+               "population": ("population",)}
+
+
+def to_unit_vectors(lat, lon):
+    """Points on the unit sphere, so straight-line (chord) distance orders like great-circle distance."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(min(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def read_gazetteer(path):
+    """(lat, lon, names, admin1, country codes) arrays from a GeoNames dump or a headed CSV."""
+    lats, lons, names, admin1, countries = [], [], [], [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        first = f.readline()
+        f.seek(0)
+        if "\t" in first and not first.lower().startswith(("name", "geonameid\tname")):
+            rows = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+            columns = GEONAMES_COLUMNS
+        else:
+            rows = csv.reader(f, delimiter="\t" if "\t" in first else ",")
+            header = [h.strip().lower() for h in next(rows)]
+            columns = {"name": header.index("name")}
+            for field, aliases in CSV_ALIASES.items():
+                found = [header.index(a) for a in aliases if a in header]
+                if found:
+                    columns[field] = found[0]
+            if "latitude" not in columns or "longitude" not in columns:
+                raise ValueError(f"{path} has no latitude/longitude columns")
+        for row in rows:
+            try:
+                lat, lon = float(row[columns["latitude"]]), float(row[columns["longitude"]])
+            except (ValueError, IndexError):
+                continue
+            lats.append(lat)
+            lons.append(lon)
+            names.append(row[columns["name"]])
+            admin1.append(row[columns["admin1"]] if "admin1" in columns else "")
+            countries.append(row[columns["country_code"]] if "country_code" in columns else "")
+    return (np.array(lats, dtype=np.float32), np.array(lons, dtype=np.float32), np.array(names),
+            np.array(admin1), np.array(countries))
+
+
+class Gazetteer:
+    """Places from a gazetteer file in a KD-tree over unit-sphere coordinates.
+
+    The parsed arrays are saved next to the file (<file>.npz) and reused
+    until the file changes, so later loads skip the text parsing.
+    """
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        cache_path = path + ".npz"
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with np.load(cache_path) as data:
+                arrays = tuple(data[k] for k in ("lat", "lon", "name", "admin1", "country_code"))
+        else:
+            arrays = read_gazetteer(path)
+            try:
+                np.savez(cache_path, **dict(zip(("lat", "lon", "name", "admin1", "country_code"), arrays)))
+            except OSError as e:
+                print(f"[WARN] Couldn't save parsed gazetteer to {cache_path}: {e}")
+        self.lat, self.lon, self.names, self.admin1, self.country_codes = arrays
+        self.tree = cKDTree(to_unit_vectors(self.lat, self.lon))
+
+    def __len__(self):
+        return len(self.names)
+
+    def place(self, i, distance_km):
+        parts = [str(self.names[i]), str(self.admin1[i]), str(self.country_codes[i])]
+        return {
+            "name": parts[0],
+            "admin1": parts[1],
+            "country_code": parts[2],
+            "address": ", ".join(p for p in parts if p),
+            "lat": float(self.lat[i]),
+            "lon": float(self.lon[i]),
+            "distance_km": round(float(distance_km), 3),
+            "source": "gazetteer",
+        }
+
+    def nearest(self, lats, lons, max_km=MAX_DISTANCE_KM):
+        """(indices, distances in km) of the nearest place to each point; index -1 when none is within max_km."""
+        chords, indices = self.tree.query(to_unit_vectors(lats, lons), k=1, distance_upper_bound=km_to_chord(max_km))
+        missing = ~np.isfinite(chords)
+        indices = np.where(missing, -1, indices)
+        return indices, np.where(missing, np.inf, chord_to_km(np.where(missing, 0, chords)))
+
+
+class ReverseGeocoder:
+    """(lat, lon) -> place, from the local gazetteer and, past `max_km`, Nominatim.
+
+    Nominatim is one shared client, called at most once per second, with
+    answers cached per ~100 m cell in the response cache.
+    """
+
+    def __init__(self, gazetteer_path=GAZETTEER_PATH, max_km=MAX_DISTANCE_KM, fallback=True):
+        self.max_km = max_km
+        self.fallback = fallback
+        self.gazetteer = None
+        if gazetteer_path and os.path.exists(gazetteer_path):
+            with get_metrics().span("geocode.load_gazetteer"):
+                self.gazetteer = Gazetteer(gazetteer_path)
+        else:
+            print(f"[WARN] No gazetteer at {gazetteer_path}; every lookup goes to Nominatim "
+                  f"(download cities15000.zip from https://download.geonames.org/export/dump/)")
+        self._nominatim = None
+        self._rate_lock = threading.Lock()
+        self._last_request = 0.0
+
+    def reverse_many(self, coords):
+        """One place dict (or None) per (lat, lon) in `coords`."""
+        coords = list(coords)
+        if not coords:
+            return []
+        places = [None] * len(coords)
+        if self.gazetteer is not None and len(self.gazetteer):
+            lats, lons = zip(*coords)
+            with get_metrics().span("geocode.local", points=len(coords)):
+                indices, distances = self.gazetteer.nearest(lats, lons, self.max_km)
+            for n, (i, km) in enumerate(zip(indices, distances)):
+                if i >= 0:
+                    places[n] = self.gazetteer.place(i, km)
+        misses = [n for n, place in enumerate(places) if place is None]
+        get_metrics().count("geocode.local_hits", len(coords) - len(misses))
+        if self.fallback:
+            for n in misses:
+                places[n] = self.remote(*coords[n])
+        return places
+
+    def reverse(self, lat, lon):
+        return self.reverse_many([(lat, lon)])[0]
+
+    def remote(self, lat, lon):
+        """Nominatim's answer for (lat, lon), cached and rate-limited; None if it has none or fails."""
+        params = {"lat": round(lat, NOMINATIM_PRECISION), "lon": round(lon, NOMINATIM_PRECISION)}
+        try:
+            place = get_cache().fetch("nominatim", params, lambda: self._query_nominatim(*params.values()),
+                                      NOMINATIM_TTL)
+        except Exception as e:
+            print(f"[WARN] Nominatim lookup failed for {lat}, {lon}: {e}")
+            get_metrics().count("geocode.errors")
+            return None
+        return place if place.get("address") else None
+
+    def _query_nominatim(self, lat, lon):
+        with self._rate_lock:
+            if self._nominatim is None:
+                from geopy.geocoders import Nominatim
+                self._nominatim = Nominatim(user_agent=NOMINATIM_USER_AGENT)
+            wait = self._last_request + NOMINATIM_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                with get_metrics().span("geocode.nominatim"):
+                    location = self._nominatim.reverse((lat, lon), timeout=10)
+            finally:
+                self._last_request = time.monotonic()
+        # Cached even when empty, so open sea isn't asked about again
+        if location is None:
+            return {"address": None, "source": "nominatim"}
+        return {"address": location.address, "lat": location.latitude, "lon": location.longitude,
+                "source": "nominatim"}
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = ReverseGeocoder()
+        return _geocoder
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reverse geocode lat,lon pairs with the local gazetteer")
+    parser.add_argument("points", nargs="+", help="lat,lon")
+    parser.add_argument("--max-km", type=float, default=MAX_DISTANCE_KM)
+    parser.add_argument("--offline", action="store_true", help="never fall back to Nominatim")
+    args = parser.parse_args()
+
+    geocoder = ReverseGeocoder(max_km=args.max_km, fallback=not args.offline)
+    points = [tuple(float(v) for v in p.split(",")) for p in args.points]
+    for (lat, lon), place in zip(points, geocoder.reverse_many(points)):
+        if place:
+            print(f"[✓] {lat}, {lon}: {place['address']} ({place['source']}"
+                  + (f", {place['distance_km']} km" if "distance_km" in place else "") + ")")
+        else:
+            print(f"[✗] {lat}, {lon}: no place found")
@@ -0,0 +1,44 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+BATCH_SIZE = 32
+# Decoded batches kept ready ahead of the consumer
+PREFETCH_BATCHES = 2
+DECODE_WORKERS = os.cpu_count() or 1
+
+
+def prefetch_batches(paths, image_size, batch_size=BATCH_SIZE, workers=DECODE_WORKERS):
+    """Yield (paths, images) batches, decoding ahead on a thread pool.
+
+    Undecodable files are reported and dropped from their batch.
+    """
+    ready = queue.Queue(maxsize=PREFETCH_BATCHES)
+    done = object()
+
+    def decode(path):
+        try:
+            with Image.open(path) as img:
+                # Draft mode lets JPEGs decode at a reduced scale close to the model input
+                img.draft("RGB", image_size)
+                return path, img.convert("RGB")
+        except Exception as e:
+            print(f"[WARN] Couldn't decode {path}: {e}")
+            return path, None
+
+    def produce():
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for start in range(0, len(paths), batch_size):
+                decoded = [item for item in pool.map(decode, paths[start:start + batch_size]) if item[1] is not None]
+                ready.put(decoded)
+        ready.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = ready.get()
+        if batch is done:
+            return
+        if batch:
+            yield [p for p, _ in batch], [img for _, img in batch]
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+from metadata_reader import strip_groups
+from metadata_catalog import get_catalog, list_images
+from blob_store import file_sha256
+from similarity_search import (
+    INPUT_IMAGES_DIR, CANDIDATE_IMAGES_DIR, SIMILAR_IMAGES_DIR, SIMILARITY_THRESHOLD, TOP_K, DESCRIPTION_FIELDS,
+    description_text, list_candidates, score_all, select_matches, save_similar_images
+)
+
+STATE_PATH = os.getenv("PIPELINE_STATE", "./pipeline_state.sqlite")
+RESULTS_DIR = "./exif_search_results"
+# Everything about the SerpAPI request except the query itself
+SEARCH_PARAMS = {"engine": "google_images"}
+# Bump when a stage's logic changes so its stored outputs are recomputed
+STAGE_VERSIONS = {"query": 1, "search": 1, "download": 2, "score": 1, "select": 1}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    output TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (stage, key)
+);
+"""
+
+
+def fingerprint(stage, *inputs):
+    """Hash of a stage's version and everything it reads."""
+    blob = json.dumps([stage, STAGE_VERSIONS[stage], inputs], sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class StateStore:
+    """Fingerprint and output of the last run of each (stage, key)."""
+
+    def __init__(self, db_path=STATE_PATH):
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript(SCHEMA)
+
+    def get(self, stage, key):
+        row = self._db.execute("SELECT fingerprint, output FROM artifacts WHERE stage = ? AND key = ?",
+                               (stage, key)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, None)
+
+    def put(self, stage, key, fp, output):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                             (stage, key, fp, json.dumps(output), time.time()))
+
+    def close(self):
+        self._db.close()
+
+
+class IncrementalRun:
+    """Re-run only the stages whose inputs changed since the last run.
+
+    Per input image: query (image hash) -> search (query + SEARCH_PARAMS)
+    -> download (hash of the results JSON on disk; reruns while any
+    transfer failed last time). Then, over all images:
+    score (target captions + candidate paths and content hashes), which
+    stores every nonzero score, and select (stored scores + threshold/top-k),
+    which only re-thresholds. With `dry_run`, stages are listed, not run;
+    only local, side-effect-free work (hashing, metadata reads, query
+    extraction) is done to decide what is stale.
+    """
+
+    def __init__(self, input_paths, state, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K, dry_run=False,
+                 downloader=None, candidate_dir=CANDIDATE_IMAGES_DIR, results_dir=RESULTS_DIR):
+        self.input_paths = list(input_paths)
+        self.state = state
+        self.threshold = threshold
+        self.top_k = top_k
+        self.dry_run = dry_run
+        self.downloader = downloader
+        self.candidate_dir = candidate_dir
+        self.results_dir = results_dir
+        self.ran = []
+        self.skipped = []
+
+    def _stage(self, stage, key, fp, changed_reason, compute, verify=None, upstream_pending=False, local=False):
+        """Return (output, pending): the stored output if still valid, else the result of `compute()`.
+
+        `verify(output)` may return a reason to rerun even though the inputs
+        are unchanged (e.g. the artifact was deleted). `pending` is True when
+        a dry run skipped the stage, so downstream inputs aren't known yet.
+        `local` stages are cheap and side-effect free, so a dry run still
+        computes them (without saving) to plan the stages after them exactly.
+        """
+        stored_fp, output = self.state.get(stage, key)
+        if upstream_pending:
+            reason = "upstream stage pending"
+        elif stored_fp is None:
+            reason = "never run"
+        elif stored_fp != fp:
+            reason = changed_reason
+        else:
+            reason = verify(output) if verify else None
+        if reason is None:
+            self.skipped.append((stage, key))
+            return output, False
+
+        label = stage if key == "*" else f"{stage} {os.path.basename(key)}"
+        self.ran.append((stage, key, reason))
+        if self.dry_run:
+            print(f"[DRY-RUN] would run {label} ({reason})")
+            return (compute(), False) if local else (None, True)
+        print(f"[RUN] {label} ({reason})")
+        output = compute()
+        self.state.put(stage, key, fp, output)
+        return output, False
+
+    def query_for(self, image_path):
+        from exifsearch import extract_query_fields
+        metadata = get_catalog().metadata([image_path])[image_path]
+        return {"query": extract_query_fields(image_path, strip_groups(metadata)), "text": description_text(metadata)}
+
+    def run_search(self, image_path, query):
+        from exifsearch import search_google_images, save_results
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        results = search_google_images(query)
+        save_results(base_name, results, self.results_dir)
+        return {"results": self.results_path(image_path)}
+
+    def run_download(self, image_path, results_path):
+        """Fetch the hits in `results_path`; failed jobs are kept in the output so the next run retries them.
+
+        Rejected URLs are not failures: the manifest already remembers why they were skipped.
+        """
+        from download_newimages import plan_jobs, index_download
+        from caption_index import CaptionIndex
+        from downloader import Downloader
+        from download_manifest import REJECTED
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        with open(results_path, "r") as f:
+            jobs = plan_jobs(json.load(f), base_name, self.candidate_dir)
+        if self.downloader is None:
+            self.downloader = Downloader()
+        index = CaptionIndex()
+
+        def on_done(outcome):
+            _, path, nbytes = outcome
+            if nbytes is not None:
+                index_download(path, index)
+
+        done = self.downloader.fetch_all(jobs, on_done)
+        saved = [path for _, path, nbytes in done if nbytes is not None]
+        failed = [[url, path] for url, path, nbytes in done
+                  if nbytes is None and (self.downloader.manifest.get(path) or {}).get("state") != REJECTED]
+        print(f"[✓] Indexed {index.flush()} new candidate captions")
+        return {"files": [[path, file_sha256(path)] for path in saved], "failed": failed}
+
+    @staticmethod
+    def verify_download(out):
+        if out["failed"]:
+            return f"{len(out['failed'])} downloads failed last run"
+        if not all(os.path.exists(p) for p, _ in out["files"]):
+            return "downloaded files missing"
+        return None
+
+    def results_path(self, image_path):
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.results_dir, f"{base_name}_results.json")
+
+    def update_image(self, image_path, sha256):
+        """Bring query -> search -> download up to date for one input; returns True if a dry run left any pending."""
+        key = os.path.abspath(image_path)
+        query_out, _ = self._stage(
+            "query", key, fingerprint("query", sha256, DESCRIPTION_FIELDS), "input image changed",
+            lambda: self.query_for(image_path), local=True)
+        if not query_out["query"]:
+            return False
+
+        results_path = self.results_path(image_path)
+        _, pending = self._stage(
+            "search", key, fingerprint("search", SEARCH_PARAMS, query_out["query"]), "query or search params changed",
+            lambda: self.run_search(image_path, query_out["query"]),
+            verify=lambda out: None if os.path.exists(results_path) else "results file missing")
+        if not pending and not os.path.exists(results_path):
+            return False
+
+        results_fp = None if pending else fingerprint("download", file_sha256(results_path))
+        _, pending = self._stage(
+            "download", key, results_fp, "search results changed",
+            lambda: self.run_download(image_path, results_path),
+            # Deleted candidates and failed transfers are fetched again; the manifest and blob store make that cheap
+            verify=lambda out: self.verify_download(out),
+            upstream_pending=pending)
+        return pending
+
+    def run(self):
+        catalog = get_catalog()
+        input_records = catalog.records(self.input_paths)
+        pending = False
+        for path in self.input_paths:
+            if path not in input_records:
+                print(f"[WARN] Skipping unreadable input {path}")
+                continue
+            pending |= self.update_image(path, input_records[path]["sha256"])
+
+        targets = []
+        target_meta = catalog.metadata(self.input_paths)
+        for path in self.input_paths:
+            text = description_text(target_meta[path])
+            if text:
+                targets.append((path, text))
+        described = []
+        score_fp = None
+        if not pending:
+            candidates = list_candidates(self.candidate_dir, exclude=self.input_paths)
+            records = catalog.records([p for _, p in candidates])
+            candidate_meta = catalog.metadata([p for _, p in candidates])
+            described = [(fname, path, description_text(candidate_meta[path])) for fname, path in candidates
+                         if path in records]
+            described = [c for c in described if c[2]]
+            score_fp = fingerprint("score", targets, [(path, records[path]["sha256"]) for _, path, _ in described])
+        score_out, score_pending = self._stage(
+            "score", "*", score_fp, "targets or candidates changed",
+            lambda: self.run_score(targets, described), upstream_pending=pending)
+
+        select_fp = None if score_pending else fingerprint("select", score_fp, self.threshold, self.top_k)
+        select_out, _ = self._stage(
+            "select", "*", select_fp, "threshold, top-k or scores changed",
+            lambda: self.run_select(score_out), upstream_pending=score_pending)
+        return select_out
+
+    def run_score(self, targets, described):
+        """Score every target against every candidate once; all nonzero scores are kept for re-thresholding."""
+        matches = score_all([t for _, t in targets], [c[2] for c in described], threshold=0.0, top_k=None)
+        scores = {}
+        for (path, _), target_matches in zip(targets, matches):
+            # Candidate order, so select_matches sees them exactly as score_all would
+            scores[path] = sorted(target_matches)
+        return {"candidates": described, "scores": scores}
+
+    def run_select(self, score_out):
+        described = score_out["candidates"]
+        results = {}
+        for target, pairs in score_out["scores"].items():
+            indices = np.array([j for j, _ in pairs], dtype=np.int64)
+            scores = np.array([s for _, s in pairs], dtype=np.float32)
+            picks = select_matches(indices, scores, self.threshold, self.top_k)
+            results[target] = [
+                {"file": described[j][0], "similarity": score, "path": described[j][1],
+                 "candidate_fields": described[j][2]}
+                for j, score in picks
+            ]
+            target_name = os.path.splitext(os.path.basename(target))[0]
+            output_dir = os.path.join(SIMILAR_IMAGES_DIR, target_name)
+            # The folder is a view of the current selection, so drop links from earlier thresholds
+            if os.path.isdir(output_dir):
+                for fname in os.listdir(output_dir):
+                    if fname.startswith("sim_"):
+                        os.remove(os.path.join(output_dir, fname))
+            if results[target]:
+                print(f"\n[✓] Similar images found for {target_name}:")
+                save_similar_images(results[target], output_dir)
+            else:
+                print(f"\n[✗] No similar images found for {target_name}.")
+        return {target: [(r["path"], r["similarity"]) for r in matches] for target, matches in results.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bring search results, downloads and similarity groups up to date, "
+                                                 "re-running only stages whose inputs changed")
+    parser.add_argument("inputs", nargs="*", help=f"input images (default: every image in {INPUT_IMAGES_DIR})")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--dry-run", action="store_true", help="list the stages that would run and exit")
+    args = parser.parse_args()
+
+    state = StateStore()
+    run = IncrementalRun(args.inputs or list_images(INPUT_IMAGES_DIR), state, args.threshold, args.top_k,
+                         dry_run=args.dry_run)
+    try:
+        run.run()
+    finally:
+        if run.downloader is not None:
+            run.downloader.close()
+        state.close()
+    verb = "would run" if args.dry_run else "ran"
+    print(f"[✓] {len(run.ran)} stages {verb}, {len(run.skipped)} up to date")
@@ -0,0 +1,220 @@
+import os
+import io
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import functools
+import threading
+import contextlib
+import tracemalloc
+from collections import Counter, defaultdict
+
+# METRICS=1 prints a table of span timings and counters when the process exits
+METRICS = os.getenv("METRICS", "0") == "1"
+# JSON-lines event log: one line per span, plus a summary line at exit (appended; several processes may share it)
+METRICS_LOG = os.getenv("METRICS_LOG")
+# Profile one stage (see Metrics.stage): PROFILE_STAGE=download PROFILE_MODE=cprofile|tracemalloc
+PROFILE_STAGE = os.getenv("PROFILE_STAGE")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_TOP = 25
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+class StageProfiler:
+    """cProfile or tracemalloc over one stage; the report goes to stdout and PROFILE_DIR.
+
+    cProfile only sees the thread that entered the stage, so for stages that
+    fan out to worker threads (downloads) tracemalloc or the span table is
+    the better view. tracemalloc covers every thread.
+    """
+
+    def __init__(self, name, mode=PROFILE_MODE, out_dir=PROFILE_DIR):
+        if mode not in ("cprofile", "tracemalloc"):
+            raise ValueError(f"PROFILE_MODE must be cprofile or tracemalloc, not {mode!r}")
+        self.name = name
+        self.mode = mode
+        self.out_dir = out_dir
+        self._profile = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            tracemalloc.start(10)
+
+    def stop(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, f"{self.name}-{os.getpid()}")
+        if self.mode == "cprofile":
+            self._profile.disable()
+            self._profile.dump_stats(base + ".prof")
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            report = out.getvalue()
+            path = base + ".prof"
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [f"traced memory: {current / 1e6:.1f} MB at the end, {peak / 1e6:.1f} MB peak"]
+            lines += [str(stat) for stat in snapshot.statistics("lineno")[:PROFILE_TOP]]
+            report = "\n".join(lines)
+            path = base + ".tracemalloc.txt"
+            with open(path, "w") as f:
+                f.write(report + "\n")
+        print(f"[INFO] {self.mode} profile of stage {self.name} saved to {path}\n{report}")
+
+
+class Metrics:
+    """Span timings, counters and an optional JSON-lines event log, shared by every module.
+
+    Spans aggregate in memory whatever the settings; output only happens
+    with METRICS=1 (summary table at exit) or METRICS_LOG (event log).
+    """
+
+    def __init__(self, log_path=METRICS_LOG):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.errors = Counter()
+        self.counters = Counter()
+        self._log = open(log_path, "a", buffering=1) if log_path else None
+
+    def event(self, kind, name, **fields):
+        if self._log is None:
+            return
+        record = {"ts": round(time.time(), 6), "event": kind, "name": name, "pid": os.getpid(),
+                  "thread": threading.current_thread().name, **fields}
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._log.write(line + "\n")
+
+    @contextlib.contextmanager
+    def span(self, name, **fields):
+        """Time the block as `name`. Yields `fields`, so the block can add to what's logged (e.g. bytes)."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield fields
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, error, **fields)
+
+    def observe(self, name, seconds, error=None, **fields):
+        """Record a span timed elsewhere, e.g. in a worker process."""
+        with self._lock:
+            self.durations[name].append(seconds)
+            if error:
+                self.errors[name] += 1
+        self.event("span", name, seconds=round(seconds, 6), error=error, **fields)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """A top-level span ("stage.<name>"), profiled when PROFILE_STAGE names it."""
+        profiler = StageProfiler(name) if PROFILE_STAGE == name else None
+        with self.span(f"stage.{name}"):
+            if profiler:
+                profiler.start()
+            try:
+                yield
+            finally:
+                if profiler:
+                    profiler.stop()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        """{span: {calls, errors, total_s, mean_ms, p50_ms, p95_ms, max_ms}} and the counters."""
+        with self._lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+            errors = dict(self.errors)
+            counters = dict(self.counters)
+        spans = {}
+        for name, values in durations.items():
+            spans[name] = {
+                "calls": len(values),
+                "errors": errors.get(name, 0),
+                "total_s": round(sum(values), 6),
+                "mean_ms": round(1000 * sum(values) / len(values), 3),
+                "p50_ms": round(1000 * percentile(values, 0.5), 3),
+                "p95_ms": round(1000 * percentile(values, 0.95), 3),
+                "max_ms": round(1000 * max(values), 3),
+            }
+        return spans, counters
+
+    def summary(self):
+        spans, counters = self.snapshot()
+        lines = [f"{'span':<32} {'calls':>6} {'errors':>6} {'total s':>8} {'mean ms':>8} {'p50 ms':>8} "
+                 f"{'p95 ms':>8} {'max ms':>8}"]
+        for name, s in sorted(spans.items(), key=lambda item: -item[1]["total_s"]):
+            lines.append(f"{name:<32} {s['calls']:>6} {s['errors']:>6} {s['total_s']:8.2f} {s['mean_ms']:8.1f} "
+                         f"{s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['max_ms']:8.1f}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<32} {value:>6}")
+        return "\n".join(lines)
+
+    def close(self):
+        spans, counters = self.snapshot()
+        if not (spans or counters):
+            return
+        self.event("summary", "process", spans=spans, counters=counters)
+        if METRICS:
+            print(f"[✓] Metrics:\n{self.summary()}")
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            atexit.register(_metrics.close)
+        return _metrics
+
+
+def timed(name):
+    """Decorator: run every call of the function inside span `name`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_metrics().span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a METRICS_LOG event log")
+    parser.add_argument("log")
+    args = parser.parse_args()
+
+    metrics = Metrics(log_path=None)
+    with open(args.log) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["event"] == "span":
+                metrics.durations[record["name"]].append(record["seconds"])
+                if record.get("error"):
+                    metrics.errors[record["name"]] += 1
+            elif record["event"] == "summary":
+                metrics.counters.update(record.get("counters", {}))
+    print(metrics.summary())
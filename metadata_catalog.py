@@ -0,0 +1,517 @@
+import os
+import re
+import math
+import json
+import sqlite3
+import hashlib
+import argparse
+import threading
+import numpy as np
+from metadata_reader import read_metadata, strip_groups
+import fast_metadata
+from instrumentation import get_metrics
+from spatial_index import place_rows, cell_ranges, haversine_km, TIME_BUCKET_SECONDS, MAX_BUCKETS
+
+CATALOG_PATH = os.getenv("METADATA_CATALOG", "./metadata_catalog.sqlite")
+HASH_CHUNK_SIZE = 1 << 20
+# SQLite's default host parameter limit is 999
+QUERY_CHUNK_SIZE = 900
+# Parse JPEG/PNG/TIFF headers in-process (fast_metadata.py) and send only other
+# formats, and JPEGs with maker or trailer metadata, to exiftool. The stored
+# metadata is then the subset of tags the pipeline reads, not exiftool's full
+# dump. `python -m benchmarks.check_fast_metadata <folder>` compares it with
+# exiftool file by file; on the 43 camera, phone and editor sample images that
+# ship with exiftool 13.10 every in-process read matches (4 are left to
+# exiftool). FAST_METADATA=0 reads everything with exiftool.
+FAST_METADATA = os.getenv("FAST_METADATA", "1") == "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    caption TEXT,
+    headline TEXT,
+    description TEXT,
+    image_description TEXT,
+    date TEXT,
+    year INTEGER,
+    city TEXT COLLATE NOCASE,
+    country TEXT COLLATE NOCASE,
+    gps_lat REAL,
+    gps_lon REAL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256);
+CREATE INDEX IF NOT EXISTS idx_images_place ON images (city, country, year);
+CREATE INDEX IF NOT EXISTS idx_images_country ON images (country, year);
+CREATE INDEX IF NOT EXISTS idx_images_year ON images (year);
+CREATE INDEX IF NOT EXISTS idx_images_gps ON images (gps_lat, gps_lon);
+CREATE TABLE IF NOT EXISTS captions (
+    sha256 TEXT NOT NULL,
+    model TEXT NOT NULL,
+    caption TEXT NOT NULL,
+    PRIMARY KEY (sha256, model)
+);
+-- Spatiotemporal index over images with GPS and/or a capture time (see spatial_index.py): cell is a 30-bit
+-- geohash integer, ts the capture time in seconds and bucket ts // TIME_BUCKET_SECONDS. Both indexes
+-- cover every column, so a query is answered from index pages alone.
+CREATE TABLE IF NOT EXISTS places (
+    path TEXT PRIMARY KEY,
+    cell INTEGER,
+    bucket INTEGER,
+    ts INTEGER,
+    lat REAL,
+    lon REAL
+);
+"""
+PLACE_INDEXES = {
+    "idx_places_bucket_cell": "CREATE INDEX IF NOT EXISTS idx_places_bucket_cell ON places (bucket, cell, ts, lat, lon, path)",
+    "idx_places_cell": "CREATE INDEX IF NOT EXISTS idx_places_cell ON places (cell, ts, lat, lon, path)",
+}
+SCHEMA += "".join(f"{sql};\n" for sql in PLACE_INDEXES.values())
+
+INSERT_PLACE = "INSERT OR REPLACE INTO places (path, cell, bucket, ts, lat, lon) VALUES (?, ?, ?, ?, ?, ?)"
+# Lowest/highest capture time, for open-ended windows
+TS_MIN, TS_MAX = -(1 << 62), 1 << 62
+
+FIELD_COLUMNS = [
+    "caption", "headline", "description", "image_description",
+    "date", "year", "city", "country", "gps_lat", "gps_lon"
+]
+
+EXIF_DATE_RE = re.compile(r"(\d{4})[:-](\d{2})[:-](\d{2})(?:[ T](\d{2}):(\d{2}):(\d{2}))?")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _first(metadata, *keys):
+    for key in keys:
+        value = metadata.get(key)
+        if isinstance(value, list):
+            value = " ".join(map(str, value))
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _as_text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def normalize_date(value):
+    """"2015:05:23 17:21:12+09:00" -> ("2015-05-23T17:21:12", 2015)"""
+    match = EXIF_DATE_RE.match(str(value or ""))
+    if not match:
+        return None, None
+    y, mo, d, h, mi, s = match.groups()
+    date = f"{y}-{mo}-{d}"
+    if h is not None:
+        date += f"T{h}:{mi}:{s}"
+    return date, int(y)
+
+
+def normalize_fields(metadata):
+    """Reduce a group-qualified (-G -n) exiftool dict to the catalog columns."""
+    plain = strip_groups(metadata)
+    date, year = normalize_date(_first(metadata, "EXIF:DateTimeOriginal", "EXIF:CreateDate")
+                                or _first(plain, "DateTimeOriginal", "CreateDate", "DateCreated"))
+    lat = _first(metadata, "Composite:GPSLatitude")
+    lon = _first(metadata, "Composite:GPSLongitude")
+    return {
+        "caption": _as_text(_first(metadata, "IPTC:Caption-Abstract") or _first(plain, "Caption-Abstract")),
+        "headline": _as_text(_first(metadata, "IPTC:Headline") or _first(plain, "Headline")),
+        "description": _as_text(_first(metadata, "XMP:Description")),
+        "image_description": _as_text(_first(metadata, "EXIF:ImageDescription")),
+        "date": date,
+        "year": year,
+        "city": _as_text(_first(plain, "City")),
+        "country": _as_text(_first(plain, "Country", "Country-PrimaryLocationName")),
+        "gps_lat": float(lat) if isinstance(lat, (int, float)) else None,
+        "gps_lon": float(lon) if isinstance(lon, (int, float)) else None,
+    }
+
+
+class MetadataCatalog:
+    """On-disk catalog of image metadata, keyed by absolute path.
+
+    A file is re-read only when its size or mtime changed, and files whose
+    content hash is already catalogued reuse the stored metadata instead of
+    going back to exiftool.
+    """
+
+    def __init__(self, db_path=CATALOG_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        indexed = self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'places'").fetchone()
+        self._db.executescript(SCHEMA)
+        if not indexed:
+            # Catalogs from before the places index: fill it from the stored fields
+            self.rebuild_places()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _select_in(self, sql, column, values):
+        """Run `sql ... WHERE column IN (...)` over `values` in chunks."""
+        rows = []
+        values = list(values)
+        with self._lock:
+            for i in range(0, len(values), QUERY_CHUNK_SIZE):
+                chunk = values[i:i + QUERY_CHUNK_SIZE]
+                marks = ",".join("?" * len(chunk))
+                rows.extend(self._db.execute(f"{sql} WHERE {column} IN ({marks})", chunk).fetchall())
+        return rows
+
+    def _stored_stats(self, keys):
+        if len(keys) > QUERY_CHUNK_SIZE:
+            with self._lock:
+                rows = self._db.execute("SELECT path, size, mtime_ns FROM images").fetchall()
+        else:
+            rows = self._select_in("SELECT path, size, mtime_ns FROM images", "path", keys)
+        return {row["path"]: (row["size"], row["mtime_ns"]) for row in rows}
+
+    def scan(self, paths):
+        """Bring the catalog up to date for `paths`; returns how many files were (re)read."""
+        keys = [os.path.abspath(p) for p in paths]
+        stored = self._stored_stats(keys)
+
+        stale = []
+        for key in dict.fromkeys(keys):
+            try:
+                st = os.stat(key)
+            except OSError:
+                continue
+            if stored.get(key) != (st.st_size, st.st_mtime_ns):
+                stale.append((key, st))
+        get_metrics().count("catalog.cached", len(keys) - len(stale))
+        if stale:
+            self._refresh(stale)
+        return len(stale)
+
+    def _refresh(self, stale):
+        hashes = {}
+        for key, _ in stale:
+            try:
+                hashes[key] = file_sha256(key)
+            except OSError as e:
+                print(f"[WARN] Couldn't hash {key}: {e}")
+
+        # Identical bytes under another name: reuse the stored metadata
+        known = {}
+        for row in self._select_in("SELECT sha256, metadata FROM images", "sha256", set(hashes.values())):
+            known.setdefault(row["sha256"], json.loads(row["metadata"]))
+
+        to_read = [key for key, digest in hashes.items() if digest not in known]
+        metrics = get_metrics()
+        metrics.count("catalog.same_content", len(hashes) - len(to_read))
+        metrics.count("catalog.read", len(to_read))
+        if not to_read:
+            fresh = {}
+        elif FAST_METADATA:
+            with metrics.span("metadata.fast_read", files=len(to_read)):
+                fresh = fast_metadata.read_metadata(to_read)
+        else:
+            fresh = read_metadata(to_read, numeric=True)
+
+        rows = []
+        places = []
+        failed = []
+        for key, st in stale:
+            digest = hashes.get(key)
+            if digest is None:
+                continue
+            metadata = known.get(digest)
+            if metadata is None:
+                # A successful read always has SourceFile; {} means exiftool failed or timed out. Such files
+                # aren't recorded, so the next lookup reads them again instead of caching "no metadata"
+                if not fresh.get(key):
+                    failed.append(key)
+                    continue
+                metadata = dict(fresh[key])
+                metadata.pop("SourceFile", None)
+                known[digest] = metadata
+            fields = normalize_fields(metadata)
+            rows.append((key, st.st_size, st.st_mtime_ns, digest,
+                         *[fields[c] for c in FIELD_COLUMNS], json.dumps(metadata)))
+            places.append((key, fields["gps_lat"], fields["gps_lon"], fields["date"]))
+        if failed:
+            metrics.count("catalog.read_failed", len(failed))
+            print(f"[WARN] Couldn't read metadata for {len(failed)} files; they'll be retried on the next lookup")
+
+        columns = ["path", "size", "mtime_ns", "sha256", *FIELD_COLUMNS, "metadata"]
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO images ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                rows
+            )
+            # An edited file may have lost its GPS or date, so its old place goes first
+            self._db.executemany("DELETE FROM places WHERE path = ?", [(p[0],) for p in places])
+            self._db.executemany(INSERT_PLACE, place_rows(places))
+
+    def records(self, paths, with_metadata=False):
+        """Return {path: row dict} for `paths`, scanning them first. Unreadable paths are omitted."""
+        paths = list(paths)
+        self.scan(paths)
+        columns = "path, size, mtime_ns, sha256, " + ", ".join(FIELD_COLUMNS)
+        if with_metadata:
+            columns += ", metadata"
+        by_key = {os.path.abspath(p): p for p in paths}
+        found = {}
+        for row in self._select_in(f"SELECT {columns} FROM images", "path", by_key):
+            record = dict(row)
+            if with_metadata:
+                record["metadata"] = json.loads(record["metadata"])
+            found[by_key[row["path"]]] = record
+        return found
+
+    def metadata(self, paths):
+        """Return {path: group-qualified exiftool dict} ({} for unreadable files)."""
+        paths = list(paths)
+        records = self.records(paths, with_metadata=True)
+        return {p: records[p]["metadata"] if p in records else {} for p in paths}
+
+    def query(self, city=None, country=None, year=None, under=None, limit=None):
+        """Look up catalogued images by place and capture year without touching the files."""
+        clauses, params = [], []
+        if city:
+            clauses.append("city = ?")
+            params.append(city)
+        if country:
+            clauses.append("country = ?")
+            params.append(country)
+        if year:
+            clauses.append("year = ?")
+            params.append(int(year))
+        if under:
+            prefix = os.path.join(os.path.abspath(under), "")
+            clauses.append("substr(path, 1, ?) = ?")
+            params.extend([len(prefix), prefix])
+        sql = "SELECT path, sha256, " + ", ".join(FIELD_COLUMNS) + " FROM images"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY date"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def cached_captions(self, hashes, model):
+        """Return {sha256: caption} for generated captions already stored for `model`."""
+        found = {}
+        hashes = list(hashes)
+        with self._lock:
+            for i in range(0, len(hashes), QUERY_CHUNK_SIZE):
+                chunk = hashes[i:i + QUERY_CHUNK_SIZE]
+                sql = f"SELECT sha256, caption FROM captions WHERE model = ? AND sha256 IN ({','.join('?' * len(chunk))})"
+                found.update(self._db.execute(sql, [model, *chunk]).fetchall())
+        return found
+
+    def store_captions(self, captions, model):
+        """Persist {sha256: caption} generated by `model`."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO captions (sha256, model, caption) VALUES (?, ?, ?)",
+                [(sha256, model, caption) for sha256, caption in captions.items()]
+            )
+
+    def forget_missing(self, under=None):
+        """Drop rows whose files no longer exist; returns the number removed."""
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT path FROM images")]
+        if under:
+            prefix = os.path.join(os.path.abspath(under), "")
+            paths = [p for p in paths if p.startswith(prefix)]
+        gone = [(p,) for p in paths if not os.path.exists(p)]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM images WHERE path = ?", gone)
+            self._db.executemany("DELETE FROM places WHERE path = ?", gone)
+        return len(gone)
+
+    def rebuild_places(self):
+        """Re-derive the places index from the catalogued GPS and dates; returns the number of rows indexed."""
+        with self._lock:
+            cursor = self._db.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute("SELECT path, gps_lat, gps_lon, date FROM images").fetchall()
+        places = place_rows(rows)
+        # Sorting into fresh indexes once beats updating them row by row
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM places")
+            for name in PLACE_INDEXES:
+                self._db.execute(f"DROP INDEX IF EXISTS {name}")
+            self._db.executemany(INSERT_PLACE, places)
+            for sql in PLACE_INDEXES.values():
+                self._db.execute(sql)
+        return len(places)
+
+    def near(self, lat=None, lon=None, radius_km=None, start=None, end=None, under=None, limit=None):
+        """Catalogued images within `radius_km` of (lat, lon) and/or shot between `start` and `end`.
+
+        `start` and `end` are epoch seconds and either may be open. Results
+        are nearest first, or earliest first without a radius. The radius becomes a few geohash cell ranges and a short window a few
+        day buckets, so each is an index range scan (see spatial_index.py);
+        candidates are then checked against the exact great-circle distance.
+        Returns [{path, lat, lon, ts, distance_km}] (distance_km None without a
+        radius); records() has the other fields.
+        """
+        use_gps = radius_km is not None and lat is not None and lon is not None
+        if not use_gps and start is None and end is None:
+            raise ValueError("near() needs lat, lon and radius_km, a time window, or both")
+        lo = TS_MIN if start is None else math.ceil(start)
+        hi = TS_MAX if end is None else math.floor(end)
+        timed = start is not None or end is not None
+        buckets = None
+        if start is not None and end is not None and hi // TIME_BUCKET_SECONDS - lo // TIME_BUCKET_SECONDS < MAX_BUCKETS:
+            buckets = range(lo // TIME_BUCKET_SECONDS, hi // TIME_BUCKET_SECONDS + 1)
+
+        scans = []
+        if use_gps:
+            for cell_lo, cell_hi in cell_ranges(lat, lon, radius_km):
+                if buckets:
+                    scans += [("INDEXED BY idx_places_bucket_cell WHERE bucket = ? AND cell BETWEEN ? AND ? "
+                               "AND ts BETWEEN ? AND ?", (b, cell_lo, cell_hi, lo, hi)) for b in buckets]
+                elif timed:
+                    scans.append(("INDEXED BY idx_places_cell WHERE cell BETWEEN ? AND ? AND ts BETWEEN ? AND ?",
+                                  (cell_lo, cell_hi, lo, hi)))
+                else:
+                    scans.append(("INDEXED BY idx_places_cell WHERE cell BETWEEN ? AND ?", (cell_lo, cell_hi)))
+        else:
+            scans.append(("INDEXED BY idx_places_bucket_cell WHERE bucket BETWEEN ? AND ? AND ts BETWEEN ? AND ?",
+                          (lo // TIME_BUCKET_SECONDS, hi // TIME_BUCKET_SECONDS, lo, hi)))
+
+        found = []
+        with self._lock:
+            cursor = self._db.cursor()
+            cursor.row_factory = None
+            for where, params in scans:
+                found += cursor.execute(f"SELECT path, lat, lon, ts FROM places {where}", params).fetchall()
+        if under:
+            prefix = os.path.join(os.path.abspath(under), "")
+            found = [row for row in found if row[0].startswith(prefix)]
+        if not found:
+            return []
+        if use_gps:
+            distances = haversine_km(lat, lon, np.array([row[1] for row in found], dtype=np.float64),
+                                     np.array([row[2] for row in found], dtype=np.float64))
+            order = [i for i in np.argsort(distances, kind="stable").tolist() if distances[i] <= radius_km]
+            distances = distances.round(3).tolist()
+        else:
+            distances = [None] * len(found)
+            order = np.argsort([row[3] for row in found], kind="stable").tolist()
+        if limit:
+            order = order[:int(limit)]
+        return [{"path": found[i][0], "lat": found[i][1], "lon": found[i][2], "ts": found[i][3],
+                 "distance_km": distances[i]} for i in order]
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = MetadataCatalog()
+        return _catalog
+
+
+def list_images(folder, extensions=(".jpg", ".jpeg", ".png")):
+    return [
+        os.path.join(folder, f) for f in sorted(os.listdir(folder))
+        if f.lower().endswith(extensions) and os.path.isfile(os.path.join(folder, f))
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain and query the image metadata catalog")
+    sub = parser.add_subparsers(dest="command", required=True)
+    scan_cmd = sub.add_parser("scan", help="catalog new or changed images in folders")
+    scan_cmd.add_argument("folders", nargs="*", default=["./input_images", "./downloaded_images"])
+    query_cmd = sub.add_parser("query", help="list catalogued images by place and year")
+    query_cmd.add_argument("--city")
+    query_cmd.add_argument("--country")
+    query_cmd.add_argument("--year", type=int)
+    query_cmd.add_argument("--under", help="only images below this folder")
+    query_cmd.add_argument("--limit", type=int)
+    near_cmd = sub.add_parser("near", help="list catalogued images shot near an image, or a point, in space and time")
+    near_cmd.add_argument("image", nargs="?", help="search around this image's GPS position and capture time")
+    near_cmd.add_argument("--lat", type=float)
+    near_cmd.add_argument("--lon", type=float)
+    near_cmd.add_argument("--km", type=float, help="radius")
+    near_cmd.add_argument("--hours", type=float, help="half-width of the time window around the image's capture time")
+    near_cmd.add_argument("--from", dest="start", help="window start, e.g. 2015-05-23T12:00:00")
+    near_cmd.add_argument("--to", dest="end", help="window end")
+    near_cmd.add_argument("--under", help="only images below this folder")
+    near_cmd.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+    if args.command == "near":
+        if args.image:
+            if args.km is None and args.hours is None:
+                near_cmd.error("give --km, --hours or both to search around an image")
+        else:
+            if args.hours is not None:
+                near_cmd.error("--hours needs an image to center the window on; use --from/--to around a point")
+            if (args.lat is None) != (args.lon is None) or (args.km is None) != (args.lat is None):
+                near_cmd.error("--lat, --lon and --km go together")
+            if args.km is None and args.start is None and args.end is None:
+                near_cmd.error("give an image, --lat/--lon/--km, --from/--to, or a point and a window")
+            from spatial_index import capture_timestamp
+            for flag, value in (("--from", args.start), ("--to", args.end)):
+                if value is not None and capture_timestamp(value) is None:
+                    near_cmd.error(f"{flag} {value!r} is not a date like 2015-05-23T12:00:00")
+
+    catalog = get_catalog()
+    if args.command == "scan":
+        for folder in args.folders:
+            if not os.path.isdir(folder):
+                print(f"[WARN] Skipping missing folder {folder}")
+                continue
+            paths = list_images(folder)
+            updated = catalog.scan(paths)
+            removed = catalog.forget_missing(folder)
+            print(f"[✓] {folder}: {len(paths)} images, {updated} (re)read, {removed} removed")
+    elif args.command == "near":
+        from spatial_index import neighbors, capture_timestamp
+
+        if args.image:
+            try:
+                found = neighbors(args.image, args.km, args.hours, catalog)
+            except ValueError as e:
+                print(f"[✗] {e}")
+                raise SystemExit(1)
+            found.pop(os.path.abspath(args.image), None)
+            prefix = os.path.join(os.path.abspath(args.under), "") if args.under else ""
+            paths = [p for p in found if p.startswith(prefix)][:args.limit]
+            records = catalog.records(paths)
+            rows = [dict(records[p], distance_km=found[p]) for p in paths if p in records]
+        else:
+            rows = catalog.near(args.lat, args.lon, args.km, capture_timestamp(args.start),
+                                capture_timestamp(args.end), args.under, args.limit)
+            dates = {p: r["date"] for p, r in catalog.records([row["path"] for row in rows]).items()}
+            rows = [dict(row, date=dates.get(row["path"])) for row in rows]
+        for row in rows:
+            distance = "" if row["distance_km"] is None else f"{row['distance_km']:.2f} km"
+            print(f"{distance:>10}  {row['date'] or '-':<19}  {row['path']}")
+        print(f"[✓] {len(rows)} matching images")
+    else:
+        rows = catalog.query(args.city, args.country, args.year, args.under, args.limit)
+        for row in rows:
+            place = ", ".join(filter(None, [row["city"], row["country"]]))
+            print(f"{row['date'] or '-':<19}  {place or '-':<30}  {row['path']}")
+        print(f"[✓] {len(rows)} matching images")
@@ -0,0 +1,175 @@
+import os
+import json
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import exiftool
+from instrumentation import get_metrics
+
+# Files handed to exiftool per -execute round trip
+BATCH_SIZE = int(os.getenv("EXIFTOOL_BATCH_SIZE", "200"))
+# Persistent exiftool processes kept alive (one per core by default)
+POOL_SIZE = int(os.getenv("EXIFTOOL_POOL_SIZE", str(os.cpu_count() or 1)))
+
+
+def build_args(tags=None, groups=True, numeric=False):
+    args = []
+    if groups:
+        args.append("-G")
+    if numeric:
+        args.append("-n")
+    for tag in tags or []:
+        args.append(f"-{tag}")
+    return args
+
+
+def strip_groups(metadata):
+    """Drop exiftool group prefixes ("IPTC:City" -> "City")."""
+    return {k.split(":")[-1]: v for k, v in metadata.items()}
+
+
+class ExifToolPool:
+    """A small pool of long-lived `exiftool -stay_open` processes.
+
+    Each process is checked out by one batch at a time, so the pool can be
+    shared by every stage (and thread) of the pipeline.
+    """
+
+    def __init__(self, size=POOL_SIZE, batch_size=BATCH_SIZE):
+        self.size = max(1, size)
+        self.batch_size = max(1, batch_size)
+        self._idle = []
+        # Live processes, counting ones still starting; at most `size`
+        self._procs = []
+        self._starting = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        # pyexiftool has the kernel kill exiftool when the thread that started it exits (PR_SET_PDEATHSIG),
+        # so processes are started from one long-lived thread, never from a short-lived batch worker
+        self._spawner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="exiftool-spawn")
+
+    def _checkout(self):
+        with self._available:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if len(self._procs) + self._starting < self.size:
+                    self._starting += 1
+                    break
+                # Woken by a check-in, or by a discard that frees a slot for a replacement
+                self._available.wait()
+        try:
+            et = self._spawner.submit(self._start).result()
+        except Exception:
+            with self._available:
+                self._starting -= 1
+                self._available.notify()
+            raise
+        with self._available:
+            self._starting -= 1
+            self._procs.append(et)
+        return et
+
+    @staticmethod
+    def _start():
+        et = exiftool.ExifTool(common_args=[])
+        et.run()
+        return et
+
+    def _checkin(self, et):
+        with self._available:
+            if et in self._procs:
+                self._idle.append(et)
+                self._available.notify()
+
+    def _discard(self, et):
+        with self._available:
+            if et in self._procs:
+                self._procs.remove(et)
+                self._available.notify()
+        try:
+            et.terminate()
+        except Exception:
+            pass
+
+    def _read_batch(self, paths, args):
+        et = self._checkout()
+        try:
+            raw = et.execute("-j", *args, *paths)
+        except Exception as e:
+            # A wedged process is replaced on the next checkout
+            print(f"[WARN] exiftool batch of {len(paths)} files failed: {e}")
+            self._discard(et)
+            return {}
+        self._checkin(et)
+
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", errors="replace")
+        if not raw or not raw.strip():
+            return {}
+        try:
+            entries = json.loads(raw)
+        except ValueError as e:
+            print(f"[WARN] Unparseable exiftool output for batch of {len(paths)} files: {e}")
+            return {}
+        return {os.path.normpath(entry.get("SourceFile", "")): entry for entry in entries}
+
+    def read(self, paths, tags=None, groups=True, numeric=False):
+        paths = list(paths)
+        if not paths:
+            return {}
+        args = build_args(tags, groups, numeric)
+        batches = [paths[i:i + self.batch_size] for i in range(0, len(paths), self.batch_size)]
+        with get_metrics().span("metadata.exiftool_read", files=len(paths)):
+            return self._read_batches(paths, batches, args)
+
+    def _read_batches(self, paths, batches, args):
+
+        if len(batches) == 1 or self.size == 1:
+            found = {}
+            for batch in batches:
+                found.update(self._read_batch(batch, args))
+        else:
+            found = {}
+            with ThreadPoolExecutor(max_workers=min(self.size, len(batches))) as pool:
+                for part in pool.map(lambda b: self._read_batch(b, args), batches):
+                    found.update(part)
+
+        return {path: found.get(os.path.normpath(path), {}) for path in paths}
+
+    def close(self):
+        with self._available:
+            procs, self._procs, self._idle = self._procs, [], []
+            self._available.notify_all()
+        self._spawner.shutdown(wait=False)
+        for et in procs:
+            try:
+                et.terminate()
+            except Exception:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExifToolPool()
+            atexit.register(_pool.close)
+        return _pool
+
+
+def read_metadata(paths, tags=None, groups=True, numeric=False):
+    """Read metadata for many files through the shared exiftool pool.
+
+    Returns a dict mapping every requested path to its tag dict ({} when the
+    file could not be read).
+    """
+    return get_pool().read(paths, tags=tags, groups=groups, numeric=numeric)
+
+
+def read_one(path, tags=None, groups=True, numeric=False):
+    return read_metadata([path], tags=tags, groups=groups, numeric=numeric)[path]
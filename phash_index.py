@@ -0,0 +1,366 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.fft import dctn
+from PIL import Image
+
+INPUT_IMAGES_DIR = "./input_images"
+CANDIDATE_IMAGES_DIR = "./downloaded_images"
+HASH_DB_PATH = os.getenv("PHASH_DB", "./phash_index.sqlite")
+REPORT_PATH = os.path.join(CANDIDATE_IMAGES_DIR, "near_duplicates.json")
+# Max pHash Hamming distance (of 64 bits) for two files to count as the same photo
+DUPLICATE_DISTANCE = 8
+# Multi-index hashing splits each pHash into this many bit ranges. Two hashes within DUPLICATE_DISTANCE
+# differ in at most that many ranges, so with one range more at least one matches exactly (pigeonhole)
+SUBSTRINGS = DUPLICATE_DISTANCE + 1
+HASH_WORKERS = os.cpu_count() or 1
+# SQLite's default host parameter limit is 999
+QUERY_CHUNK_SIZE = 900
+# Rows of a substring run compared against the whole run at once when clustering
+PAIR_CHUNK_ROWS = 512
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS perceptual_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    phash INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER
+);
+"""
+
+
+def _to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def image_hashes(path):
+    """Return (dhash, phash, width, height) for one image file."""
+    with Image.open(path) as img:
+        width, height = img.size
+        # JPEG draft mode decodes at 1/2..1/8 scale, far cheaper than a full decode
+        img.draft("L", (64, 64))
+        gray = img.convert("L")
+        small = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+        big = np.asarray(gray.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    dhash = _to_int((small[:, 1:] > small[:, :-1]).ravel())
+    low = dctn(big, norm="ortho")[:8, :8].ravel()
+    phash = _to_int(low > np.median(low[1:]))
+    return dhash, phash, width, height
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def substring_ranges(substrings=SUBSTRINGS, bits=64):
+    """(shift, width) of each of `substrings` contiguous bit ranges covering a `bits`-bit hash."""
+    base, extra = divmod(bits, substrings)
+    ranges, shift = [], bits
+    for part in range(substrings):
+        width = base + (part < extra)
+        shift -= width
+        ranges.append((shift, width))
+    return ranges
+
+
+def substrings_of(value, ranges):
+    return [(value >> shift) & ((1 << width) - 1) for shift, width in ranges]
+
+
+def _within(key, width, radius):
+    """Every `width`-bit key within Hamming distance `radius` of `key`."""
+    keys = []
+    for d in range(radius + 1):
+        for flips in combinations(range(width), d):
+            flipped = key
+            for bit in flips:
+                flipped ^= 1 << bit
+            keys.append(flipped)
+    return keys
+
+
+def popcounts(values):
+    """Bit count of each uint64 in `values`."""
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(values)
+    # Sideways addition: bit counts of 2-, 4-, then 8-bit fields, summed by the multiply into the top byte
+    values = values - ((values >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    values = (values & np.uint64(0x3333333333333333)) + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    values = (values + (values >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (values * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+class MultiIndex:
+    """Multi-index hashing over 64-bit hashes under Hamming distance (Norouzi et al.).
+
+    Each bit range keeps the hashes ordered by their substring there, with
+    the offset where each substring's run starts, so a substring's hashes are
+    one slice. A radius-r query looks up
+    every key within r // substrings bits of the query's substrings (the
+    exact key alone for r < substrings) and checks the full Hamming distance
+    of just those candidates.
+    """
+
+    def __init__(self, values, items, substrings=SUBSTRINGS, orders=None):
+        """`orders` are the hash positions sorted by each range's substring, e.g. as saved by save()."""
+        self.values = np.asarray(values, dtype=np.uint64)
+        self.items = list(items)
+        self.ranges = substring_ranges(substrings)
+        if orders is None:
+            orders = [np.argsort(self._keys(shift, width), kind="stable") for shift, width in self.ranges]
+        self.orders = orders
+        # Run starts per possible substring, plus the end: substring k's hashes are order[starts[k]:starts[k + 1]]
+        self.tables = [(np.searchsorted(self._keys(shift, width)[order], np.arange((1 << width) + 1, dtype=np.uint64)), order)
+                       for order, (shift, width) in zip(orders, self.ranges)]
+
+    def _keys(self, shift, width):
+        return (self.values >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, values=self.values, items=np.array(self.items, dtype=str), orders=np.stack(self.orders))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at `path`, or None if there is none."""
+        try:
+            with np.load(path) as saved:
+                orders = saved["orders"]
+                return cls(saved["values"], saved["items"].tolist(), len(orders), list(orders))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def __len__(self):
+        return len(self.items)
+
+    def candidates(self, value, radius):
+        """Positions of the hashes sharing a substring within radius // substrings bits of `value`'s."""
+        sub_radius = radius // len(self.ranges)
+        found = []
+        for (starts, order), key, (_, width) in zip(self.tables, substrings_of(value, self.ranges), self.ranges):
+            for near in _within(key, width, sub_radius) if sub_radius else (key,):
+                lo, hi = starts[near], starts[near + 1]
+                if hi > lo:
+                    found.append(order[lo:hi])
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def pairs(self, radius, chunk=PAIR_CHUNK_ROWS):
+        """Position pairs of hashes within `radius` of each other, each pair once or more in either order."""
+        if radius >= len(self.ranges):
+            # Substrings must be searched within a radius too, so go hash by hash
+            for i, value in enumerate(self.values.tolist()):
+                positions = self.candidates(value, radius)
+                positions = positions[positions > i]
+                yield from ((i, j) for j in positions[popcounts(self.values[positions] ^ np.uint64(value)) <= radius])
+            return
+        # Pigeonhole: every such pair shares some exact substring, so compare within each run only
+        for starts, order in self.tables:
+            for lo, hi in zip(starts[:-1].tolist(), starts[1:].tolist()):
+                run = order[lo:hi]
+                values = self.values[run]
+                for row in range(0, len(run) - 1, chunk):
+                    near = popcounts(values[row:row + chunk, None] ^ values[None, :]) <= radius
+                    a, b = np.nonzero(np.triu(near, row + 1))
+                    yield from zip(run[a + row].tolist(), run[b].tolist())
+
+    def search(self, value, radius):
+        """Return [(distance, item)] for every hash within `radius`."""
+        positions = self.candidates(value, radius)
+        distances = popcounts(self.values[positions] ^ np.uint64(value))
+        keep = distances <= radius
+        # A hash sharing several substrings with the query is a candidate once per substring
+        positions, first = np.unique(positions[keep], return_index=True)
+        return sorted(zip(distances[keep][first].tolist(), (self.items[i] for i in positions)), key=lambda x: x[0])
+
+
+class HashCache:
+    """Perceptual hashes keyed by path, reused while size and mtime are unchanged."""
+
+    def __init__(self, db_path=HASH_DB_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        # The multi-index tables live next to the hash catalog
+        self.index_path = os.path.splitext(db_path)[0] + ".mih.npz"
+
+    def hashes(self, paths, workers=HASH_WORKERS):
+        """Return {path: (dhash, phash, width, height)}; undecodable files are omitted."""
+        keys = {os.path.abspath(p): p for p in paths}
+        stored = {}
+        key_list = list(keys)
+        with self._lock:
+            for i in range(0, len(key_list), QUERY_CHUNK_SIZE):
+                chunk = key_list[i:i + QUERY_CHUNK_SIZE]
+                sql = ("SELECT path, size, mtime_ns, dhash, phash, width, height FROM perceptual_hashes "
+                       f"WHERE path IN ({','.join('?' * len(chunk))})")
+                stored.update((row[0], row[1:]) for row in self._db.execute(sql, chunk))
+
+        found, stale = {}, []
+        for key, path in keys.items():
+            try:
+                st = os.stat(key)
+            except OSError:
+                continue
+            row = stored.get(key)
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                found[path] = (_unsigned(row[2]), _unsigned(row[3]), row[4], row[5])
+            else:
+                stale.append((key, path, st))
+
+        def compute(item):
+            key, path, st = item
+            try:
+                return item, image_hashes(key)
+            except Exception as e:
+                print(f"[WARN] Couldn't hash {path}: {e}")
+                return item, None
+
+        rows = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for (key, path, st), result in pool.map(compute, stale):
+                if result is None:
+                    continue
+                found[path] = result
+                dhash, phash, width, height = result
+                rows.append((key, st.st_size, st.st_mtime_ns, _signed(dhash), _signed(phash), width, height))
+        if rows:
+            with self._lock, self._db:
+                self._db.executemany("INSERT OR REPLACE INTO perceptual_hashes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return found
+
+    def multi_index(self, hashes):
+        """A MultiIndex over the pHashes in `hashes` (a hashes() result).
+
+        The tables saved by the last call are reused while they cover exactly
+        the same files and hashes; otherwise they are rebuilt and saved.
+        """
+        index = MultiIndex.load(self.index_path)
+        if index is not None and len(index) == len(hashes) and index.ranges == substring_ranges() and all(
+                hashes.get(item, (None, None))[1] == value for item, value in zip(index.items, index.values.tolist())):
+            return index
+        index = MultiIndex([h[1] for h in hashes.values()], hashes)
+        index.save(self.index_path)
+        return index
+
+
+def _index_of(hashes, index):
+    if index is None:
+        index = MultiIndex([h[1] for h in hashes.values()], hashes)
+    return index
+
+
+def cluster_near_duplicates(hashes, radius=DUPLICATE_DISTANCE, index=None):
+    """Group paths whose pHashes are within `radius` of each other (transitively).
+
+    `index` is a MultiIndex over `hashes` (HashCache.multi_index reads one
+    from the stored tables); one is built if not given. Returns
+    [{"representative": path, "members": [paths]}], largest image first
+    within each cluster; singletons are included.
+    """
+    index = _index_of(hashes, index)
+
+    parent = {path: path for path in hashes}
+
+    def find(p):
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    for i, j in index.pairs(radius):
+        a, b = find(index.items[i]), find(index.items[j])
+        if a != b:
+            parent[b] = a
+
+    groups = {}
+    for path in hashes:
+        groups.setdefault(find(path), []).append(path)
+
+    clusters = []
+    for members in groups.values():
+        # Prefer the highest-resolution copy, then the shortest name
+        members.sort(key=lambda p: (-(hashes[p][2] or 0) * (hashes[p][3] or 0), len(p), p))
+        clusters.append({"representative": members[0], "members": members})
+    clusters.sort(key=lambda c: -len(c["members"]))
+    return clusters
+
+
+def visual_matches(input_hashes, candidate_hashes, radius=DUPLICATE_DISTANCE, index=None):
+    """Candidates that are the same photo as each input, whatever their captions say."""
+    index = _index_of(candidate_hashes, index)
+    return {
+        path: [{"path": other, "distance": d} for d, other in index.search(phash, radius)]
+        for path, (_, phash, _, _) in input_hashes.items()
+    }
+
+
+def list_images(folder):
+    return [
+        os.path.join(folder, f) for f in sorted(os.listdir(folder))
+        if f.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(folder, f))
+    ]
+
+
+def load_representatives(report_path=REPORT_PATH):
+    """Map every clustered path to its cluster representative (empty if no report yet)."""
+    if not os.path.exists(report_path):
+        return {}
+    with open(report_path, "r") as f:
+        report = json.load(f)
+    return {
+        os.path.abspath(member): os.path.abspath(cluster["representative"])
+        for cluster in report.get("clusters", [])
+        for member in cluster["members"]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collapse near-duplicate candidates with perceptual hashes")
+    parser.add_argument("--radius", type=int, default=DUPLICATE_DISTANCE, help="max pHash Hamming distance")
+    args = parser.parse_args()
+
+    cache = HashCache()
+    inputs = cache.hashes(list_images(INPUT_IMAGES_DIR))
+    candidates = cache.hashes(list_images(CANDIDATE_IMAGES_DIR))
+    print(f"[INFO] Hashed {len(inputs)} inputs and {len(candidates)} candidates")
+
+    index = cache.multi_index(candidates)
+    clusters = cluster_near_duplicates(candidates, args.radius, index)
+    matches = visual_matches(inputs, candidates, args.radius, index)
+
+    duplicated = [c for c in clusters if len(c["members"]) > 1]
+    print(f"[✓] {len(candidates)} candidates collapse to {len(clusters)} distinct photos "
+          f"({len(duplicated)} clusters with near-duplicates)")
+    for path, hits in matches.items():
+        if hits:
+            print(f"[✓] {os.path.basename(path)} appears visually in {len(hits)} candidates:")
+            for hit in hits:
+                print(f"- {os.path.basename(hit['path'])} (distance {hit['distance']})")
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump({"radius": args.radius, "clusters": clusters, "visual_matches": matches}, f, indent=2)
+    print(f"[✓] Saved near-duplicate report to {REPORT_PATH}")
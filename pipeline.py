@@ -0,0 +1,262 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from metadata_reader import strip_groups
+from metadata_catalog import get_catalog, list_images
+from caption_index import CaptionIndex
+from downloader import Downloader, MAX_CONCURRENCY, PER_HOST_CONCURRENCY
+from exifsearch import extract_query_fields, search_google_images, save_results
+from download_newimages import plan_jobs
+from response_cache import get_cache
+from instrumentation import get_metrics
+from similarity_search import (
+    INPUT_IMAGES_DIR, CANDIDATE_IMAGES_DIR, SIMILAR_IMAGES_DIR, SIMILARITY_THRESHOLD, TOP_K,
+    description_text, compute_similarity, find_similar_images_batch, save_similar_images
+)
+
+RESULTS_DIR = "./exif_search_results"
+# Items buffered between two stages; a full queue makes the upstream stage wait
+QUEUE_SIZE = 64
+METADATA_WORKERS = 2
+SEARCH_WORKERS = 4
+# Downloads handed to the downloader but not yet finished; more wait in the download stage's inbox
+DOWNLOADS_IN_FLIGHT = 2 * MAX_CONCURRENCY
+
+DONE = object()
+
+
+class Stage:
+    """A pool of worker threads mapping items from a bounded inbox to the next stage's inbox.
+
+    `fn(item)` returns an iterable of zero or more outputs. An output may be
+    a Future, whose result is passed on when it resolves (None is dropped),
+    so a worker can hand off slow work instead of waiting on it. Errors are
+    reported and the item dropped, like the batch scripts do.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.outbox = None
+        self.processed = 0
+        self.emitted = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._unresolved = 0
+        self._resolved = threading.Condition(self._lock)
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is DONE:
+                return
+            emitted = 0
+            try:
+                for out in self.fn(item) or ():
+                    if isinstance(out, Future):
+                        with self._lock:
+                            self._unresolved += 1
+                        out.add_done_callback(self._resolve)
+                        continue
+                    if self.outbox is not None:
+                        self.outbox.put(out)
+                    emitted += 1
+            except Exception as e:
+                print(f"[ERROR] {self.name} stage failed on {item!r}: {e}")
+            with self._lock:
+                self.processed += 1
+                self.emitted += emitted
+
+    def _resolve(self, future):
+        try:
+            out = future.result()
+        except Exception as e:
+            print(f"[ERROR] {self.name} stage failed: {e}")
+            out = None
+        if out is not None and self.outbox is not None:
+            self.outbox.put(out)
+        with self._lock:
+            if out is not None:
+                self.emitted += 1
+            self._unresolved -= 1
+            self._resolved.notify_all()
+
+    def finish(self):
+        """Wait for the inbox to drain, every worker to exit and every handed-off output to resolve."""
+        for _ in self._threads:
+            self.inbox.put(DONE)
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._resolved.wait_for(lambda: self._unresolved == 0)
+
+
+class Pipeline:
+    """Stages chained by bounded queues; items flow through as soon as each stage emits them."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.outbox = downstream.inbox
+
+    def run(self, items):
+        for stage in self.stages:
+            stage.start()
+        for item in items:
+            self.stages[0].inbox.put(item)
+        # Shut down front to back: once a stage has exited, its outputs are all queued downstream
+        for stage in self.stages:
+            stage.finish()
+
+    def summary(self):
+        return ", ".join(f"{s.name} {s.processed} in / {s.emitted} out" for s in self.stages)
+
+
+class SearchPipeline:
+    """exifsearch -> download_newimages -> similarity_search as one streaming run.
+
+    Each downloaded candidate is scored against every input caption the
+    moment it lands. That pairwise score fits TF-IDF to the two captions
+    alone, so it is only a provisional lead and is reported as one. Once
+    everything has landed, the results come from the same
+    find_similar_images_batch call similarity_search.py makes, so they match
+    the batch flow exactly.
+    """
+
+    def __init__(self, input_paths, downloader, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K,
+                 results_dir=RESULTS_DIR, output_dir=CANDIDATE_IMAGES_DIR,
+                 metadata_workers=METADATA_WORKERS, search_workers=SEARCH_WORKERS,
+                 download_workers=MAX_CONCURRENCY, queue_size=QUEUE_SIZE, downloads_in_flight=DOWNLOADS_IN_FLIGHT):
+        self.input_paths = list(input_paths)
+        self.downloader = downloader
+        self.threshold = threshold
+        self.top_k = top_k
+        self.results_dir = results_dir
+        self.output_dir = output_dir
+        self.target_texts = {}
+        self.downloaded = []
+        self.provisional_matches = []
+        self.first_match_at = None
+        self.index = CaptionIndex()
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max(1, downloads_in_flight))
+        self.pipeline = Pipeline([
+            Stage("metadata", self.extract, metadata_workers, queue_size),
+            Stage("search", self.search, search_workers, queue_size),
+            Stage("download", self.download, download_workers, queue_size),
+            Stage("score", self.score, 1, queue_size),
+        ])
+
+    def extract(self, image_path):
+        metadata = get_catalog().metadata([image_path])[image_path]
+        text = description_text(metadata)
+        if text:
+            with self._lock:
+                self.target_texts[image_path] = text
+        query = extract_query_fields(image_path, strip_groups(metadata))
+        if query:
+            yield image_path, query
+
+    def search(self, item):
+        image_path, query = item
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        results = search_google_images(query)
+        save_results(base_name, results, self.results_dir)
+        yield from plan_jobs(results, base_name, self.output_dir)
+
+    def download(self, job):
+        # Queued with the downloader's per-host scheduler rather than waited on here, but only while fewer than
+        # downloads_in_flight are outstanding, so a slow downloader backs up into the bounded queues upstream
+        self._in_flight.acquire()
+        try:
+            future = self.downloader.submit(*job)
+        except BaseException:
+            self._in_flight.release()
+            raise
+        future.add_done_callback(lambda _: self._in_flight.release())
+        yield future
+
+    def score(self, outcome):
+        _, path, nbytes = outcome
+        if nbytes is None:
+            return
+        with self._lock:
+            self.downloaded.append(path)
+            targets = list(self.target_texts.items())
+        record = get_catalog().records([path], with_metadata=True).get(path)
+        if not record:
+            return
+        text = description_text(record["metadata"])
+        self.index.add(path, text, record["sha256"])
+        if not text:
+            return
+        for target, target_text in targets:
+            similarity = compute_similarity(target_text, text)
+            if similarity < self.threshold:
+                continue
+            with self._lock:
+                if self.first_match_at is None:
+                    self.first_match_at = time.perf_counter() - self.started
+                self.provisional_matches.append((target, path, similarity))
+            print(f"[PROVISIONAL {time.perf_counter() - self.started:6.1f}s] {os.path.basename(path)} may match "
+                  f"{os.path.basename(target)} (pairwise {similarity:.2f}, rescored once all downloads land)")
+
+    def run(self):
+        self.started = time.perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.pipeline.run(self.input_paths)
+        print(f"[INFO] Stages: {self.pipeline.summary()}")
+
+        print(f"[✓] Indexed {self.index.flush()} new candidate captions")
+        results = find_similar_images_batch(self.input_paths, self.output_dir, self.threshold, self.top_k)
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run search, download and similarity scoring as one streaming pipeline")
+    parser.add_argument("inputs", nargs="*", help=f"input images (default: every image in {INPUT_IMAGES_DIR})")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--search-workers", type=int, default=SEARCH_WORKERS)
+    parser.add_argument("--download-workers", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=PER_HOST_CONCURRENCY)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    args = parser.parse_args()
+
+    inputs = args.inputs or list_images(INPUT_IMAGES_DIR)
+    downloader = Downloader(max_concurrency=args.download_workers, per_host=args.per_host)
+    runner = SearchPipeline(inputs, downloader, args.threshold, args.top_k,
+                            search_workers=args.search_workers, download_workers=args.download_workers,
+                            queue_size=args.queue_size)
+    try:
+        with get_metrics().stage("pipeline"):
+            results = runner.run()
+    finally:
+        downloader.close()
+
+    print(f"[✓] Downloads: {downloader.stats.summary()}")
+    print(f"[✓] SerpAPI cache: {get_cache().summary()}")
+    if runner.first_match_at is not None:
+        final = {(target, os.path.abspath(match["path"])) for target, matches in results.items() for match in matches}
+        confirmed = sum((target, os.path.abspath(path)) in final for target, path, _ in runner.provisional_matches)
+        print(f"[INFO] First provisional match after {runner.first_match_at:.1f} s; {confirmed} of "
+              f"{len(runner.provisional_matches)} provisional matches are in the final results")
+
+    for target, similar_images in results.items():
+        target_name = os.path.splitext(os.path.basename(target))[0]
+        if similar_images:
+            print(f"\n[✓] Similar images found for {target_name}:")
+            save_similar_images(similar_images, os.path.join(SIMILAR_IMAGES_DIR, target_name))
+        else:
+            print(f"\n[✗] No similar images found for {target_name}.")
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import Future
+from instrumentation import get_metrics
+
+CACHE_PATH = os.getenv("RESPONSE_CACHE", "./response_cache.sqlite")
+DEFAULT_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "20000"))
+MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Never part of a cache key: they change who pays, not what comes back
+SECRET_PARAMS = {"api_key", "key", "subscription_key", "ocp-apim-subscription-key"}
+# Values longer than this (e.g. base64 image bodies) are keyed by their hash
+MAX_INLINE_VALUE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    request TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+"""
+
+
+def normalize_params(params):
+    """Canonical form of request params: secrets dropped, queries case- and whitespace-folded."""
+    normalized = {}
+    for name, value in params.items():
+        if name.lower() in SECRET_PARAMS or value is None:
+            continue
+        if isinstance(value, bytes):
+            value = "sha256:" + hashlib.sha256(value).hexdigest()
+        elif isinstance(value, str):
+            if name in ("q", "query"):
+                value = re.sub(r"\s+", " ", value).strip().lower()
+            if len(value) > MAX_INLINE_VALUE:
+                value = "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+        normalized[name] = value
+    return normalized
+
+
+def cache_key(namespace, params):
+    request = json.dumps(normalize_params(params), sort_keys=True, default=str)
+    return hashlib.sha256(f"{namespace}\n{request}".encode("utf-8")).hexdigest(), request
+
+
+class ResponseCache:
+    """SQLite cache of JSON API responses with TTL and LRU size bounds.
+
+    fetch() also coalesces concurrent identical requests: while one caller
+    is fetching a key, the others wait for its result instead of issuing
+    their own request.
+    """
+
+    def __init__(self, db_path=CACHE_PATH, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > ttl:
+                return None
+            with self._db:
+                self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, namespace, request, value):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, request, value, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, namespace, request, payload, len(payload), now, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Drop least-recently-used entries until both bounds hold again
+        removed = 0
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            removed += 1
+        self.evictions += removed
+
+    def fetch(self, namespace, params, fetcher, ttl=None):
+        """Return the cached response for (namespace, params), calling `fetcher()` on a miss.
+
+        Exceptions from `fetcher` propagate to every waiting caller and
+        nothing is cached. None and SerpAPI-style {"error": ...} payloads are
+        returned but not cached either, so a transient failure is retried.
+        """
+        key, request = cache_key(namespace, params)
+        value = self.get(key, ttl)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            get_metrics().count(f"cache.{namespace}.hits")
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not owner:
+            get_metrics().count(f"cache.{namespace}.coalesced")
+            return future.result()
+        get_metrics().count(f"cache.{namespace}.misses")
+
+        try:
+            value = fetcher()
+            if value is not None and not (isinstance(value, dict) and "error" in value):
+                self.put(key, namespace, request, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def summary(self):
+        return f"{self.hits} hits, {self.misses} misses, {self.coalesced} coalesced, {self.evictions} evicted"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,181 @@
+import os
+import io
+import uuid
+import argparse
+import subprocess
+import threading
+from PIL import Image, ImageOps
+from blob_store import file_sha256
+
+DERIVATIVE_DIR = os.getenv("DERIVATIVE_DIR", "./search_derivatives")
+# Reverse image engines match fine well below camera resolution
+MAX_EDGE = int(os.getenv("DERIVATIVE_MAX_EDGE", "1024"))
+JPEG_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "85"))
+# Embedded JPEGs exiftool can pull out of raw files, largest first
+PREVIEW_TAGS = ("JpgFromRaw", "PreviewImage", "ThumbnailImage")
+RAW_EXTENSIONS = (".cr2", ".cr3", ".nef", ".arw", ".dng", ".orf", ".raf", ".rw2")
+STREAM_CHUNK_SIZE = 64 * 1024
+# Part of derivative file names; bump when the way derivatives are made changes so stale ones aren't reused
+DERIVATIVE_VERSION = 2
+
+
+def extract_preview(path):
+    """Return the largest embedded JPEG in a raw file (e.g. CR2) via exiftool, or None."""
+    for tag in PREVIEW_TAGS:
+        try:
+            result = subprocess.run(["exiftool", "-b", f"-{tag}", path], capture_output=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"[WARN] exiftool preview extraction failed for {path}: {e}")
+            return None
+        if result.returncode == 0 and result.stdout.startswith(b"\xff\xd8"):
+            return result.stdout
+    return None
+
+
+def _decode(source, max_edge):
+    with Image.open(source) as img:
+        # JPEG draft mode decodes straight to a 1/2..1/8 scale at or above max_edge
+        img.draft("RGB", (max_edge, max_edge))
+        # The Orientation tag isn't copied to the derivative, so rotate the pixels upright instead
+        return ImageOps.exif_transpose(img).convert("RGB")
+
+
+def load_image(path, max_edge):
+    """Decode `path` for downscaling; raw files go through their embedded JPEG preview."""
+    if not path.lower().endswith(RAW_EXTENSIONS):
+        return _decode(path, max_edge)
+    preview = extract_preview(path)
+    if preview is None:
+        raise ValueError(f"No embedded preview in {path}")
+    return _decode(io.BytesIO(preview), max_edge)
+
+
+class DerivativeCache:
+    """Search-optimized JPEG copies of images, cached by source content hash.
+
+    A derivative is rotated upright, has its long edge bounded by
+    `max_edge`, is re-encoded at `quality` and carries no metadata. It is
+    uploaded even when it isn't smaller than the source, since the source
+    may carry GPS and captions.
+    """
+
+    def __init__(self, root=DERIVATIVE_DIR, max_edge=MAX_EDGE, quality=JPEG_QUALITY):
+        self.root = root
+        self.max_edge = max_edge
+        self.quality = quality
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.original_bytes = 0
+        self.upload_bytes = 0
+        self.created = 0
+        self.reused = 0
+
+    def path_for(self, sha256):
+        return os.path.join(self.root, f"{sha256}-{self.max_edge}-q{self.quality}-v{DERIVATIVE_VERSION}.jpg")
+
+    def derivative(self, path):
+        """Return the path of the metadata-free derivative to upload for `path`."""
+        original_size = os.path.getsize(path)
+        target = self.path_for(file_sha256(path))
+        if os.path.exists(target):
+            reused = True
+        else:
+            reused = False
+            img = load_image(path, self.max_edge)
+            img.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+            tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+            # No exif/icc arguments, so nothing but pixels is written
+            img.save(tmp, "JPEG", quality=self.quality, optimize=True)
+            os.replace(tmp, target)
+
+        with self._lock:
+            self.original_bytes += original_size
+            self.upload_bytes += os.path.getsize(target)
+            if reused:
+                self.reused += 1
+            else:
+                self.created += 1
+        return target
+
+    def summary(self):
+        saved = self.original_bytes - self.upload_bytes
+        pct = 100 * saved / self.original_bytes if self.original_bytes else 0
+        return (f"{self.created} derivatives created, {self.reused} reused; uploading "
+                f"{self.upload_bytes / 1e6:.1f} MB instead of {self.original_bytes / 1e6:.1f} MB "
+                f"({saved / 1e6:.1f} MB, {pct:.0f}% saved)")
+
+
+class MultipartFile:
+    """A single-file multipart/form-data body read from disk in chunks.
+
+    Has a length, so requests sends it with Content-Length while streaming it
+    instead of building the whole body in memory.
+    """
+
+    def __init__(self, field, path, filename=None, content_type="image/jpeg"):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        filename = filename or os.path.basename(path)
+        self._head = (f"--{self.boundary}\r\n"
+                      f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                      f"Content-Type: {content_type}\r\n\r\n").encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._size = os.path.getsize(path)
+        self._file = open(path, "rb")
+        self._parts = [io.BytesIO(self._head), self._file, io.BytesIO(self._tail)]
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def read(self, size=STREAM_CHUNK_SIZE):
+        if size is None or size < 0:
+            size = len(self)
+        chunks = []
+        while self._parts and size > 0:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_derivatives():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DerivativeCache()
+        return _cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build search-optimized derivatives for a folder of images")
+    parser.add_argument("folder", nargs="?", default="./input_images")
+    parser.add_argument("--max-edge", type=int, default=MAX_EDGE)
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY)
+    args = parser.parse_args()
+
+    cache = DerivativeCache(max_edge=args.max_edge, quality=args.quality)
+    for fname in sorted(os.listdir(args.folder)):
+        path = os.path.join(args.folder, fname)
+        if not os.path.isfile(path):
+            continue
+        try:
+            print(f"[✓] {fname} -> {cache.derivative(path)}")
+        except Exception as e:
+            print(f"[WARN] Skipping {fname}: {e}")
+    print(f"[✓] {cache.summary()}")
@@ -1,15 +1,31 @@
 import os
-import json
-import exiftool
 import time
-import shutil
+import argparse
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from metadata_catalog import get_catalog
+from caption_index import CaptionIndex
+from blob_store import link_or_copy
+from phash_index import load_representatives
+from embedding_backend import EmbeddingIndex, get_encoder, ENCODERS
+from chunked_scoring import ChunkedScorer, CHUNK_SIZE, WORKERS
+from spatial_index import neighbors
+from instrumentation import get_metrics, timed
 
 TARGET_IMAGE = "./input_images/finalphoto1.jpg"
+INPUT_IMAGES_DIR = "./input_images"
 CANDIDATE_IMAGES_DIR = "./downloaded_images"
 SIMILAR_IMAGES_DIR = os.path.join(CANDIDATE_IMAGES_DIR, "similar")
 SIMILARITY_THRESHOLD = 0.3
+TOP_K = None  # keep every candidate above the threshold
+VISUAL_SIMILARITY_THRESHOLD = 0.8
+VISUAL_ENCODER = "clip"
+# --streaming keeps a bounded heap per target, so it always needs a top-k
+STREAMING_TOP_K = 100
+# Targets scored per sparse product; bounds the size of the score block
+TARGET_BLOCK_SIZE = 256
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
 
 DESCRIPTION_FIELDS = [
     "IPTC:Caption-Abstract",
@@ -18,20 +34,24 @@ DESCRIPTION_FIELDS = [
     "XMP:Description"
 ]
 
-def extract_exif_description_fields(image_path):
-    with exiftool.ExifTool() as et:
-        raw_str = et.execute("-j", *[f"-{f}" for f in DESCRIPTION_FIELDS], image_path)
-        metadata = json.loads(raw_str)[0] if isinstance(raw_str, bytes) else json.loads(raw_str)[0]
-
+def description_text(metadata):
     fields = []
     for key in DESCRIPTION_FIELDS:
         val = metadata.get(key)
         if val:
-            fields.append(val.lower())
-    combined = " ".join(fields)
+            fields.append(str(val).lower())
+    return " ".join(fields)
+
+@timed("extract.description_fields")
+def extract_exif_description_fields(image_path, metadata=None):
+    if metadata is None:
+        metadata = get_catalog().metadata([image_path])[image_path]
+
+    combined = description_text(metadata)
     print(f"[DEBUG] EXIF for {os.path.basename(image_path)}: {combined if combined else 'No valid fields found'}")
     return combined
 
+@timed("similarity.compute")
 def compute_similarity(text1, text2):
     vectorizer = TfidfVectorizer().fit_transform([text1, text2])
     vectors = vectorizer.toarray()
@@ -44,19 +64,14 @@ def find_similar_images(target_image_path, candidate_dir):
         print(f"[SKIP] No valid metadata in target image: {target_image_path}")
         return []
 
-    similar_images = []
-    for fname in os.listdir(candidate_dir):
-        full_path = os.path.join(candidate_dir, fname)
-        if not os.path.isfile(full_path):
-            continue
-
-        if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
-            continue
+    candidates = list_candidates(candidate_dir, exclude=[target_image_path])
 
-        if os.path.abspath(full_path) == os.path.abspath(target_image_path):
-            continue
+    # Unchanged files come straight from the catalog; the rest are read in one batch
+    metadata = get_catalog().metadata([path for _, path in candidates])
 
-        candidate_fields = extract_exif_description_fields(full_path)
+    similar_images = []
+    for fname, full_path in candidates:
+        candidate_fields = extract_exif_description_fields(full_path, metadata[full_path])
         if not candidate_fields:
             continue
 
@@ -72,18 +87,359 @@ def find_similar_images(target_image_path, candidate_dir):
 
     return sorted(similar_images, key=lambda x: -x["similarity"])
 
+def list_candidates(candidate_dir, exclude=()):
+    excluded = {os.path.abspath(p) for p in exclude}
+    candidates = []
+    for fname in sorted(os.listdir(candidate_dir)):
+        full_path = os.path.join(candidate_dir, fname)
+        if not os.path.isfile(full_path):
+            continue
+
+        if not fname.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        if os.path.abspath(full_path) in excluded:
+            continue
+
+        candidates.append((fname, full_path))
+    return candidates
+
+def select_matches(indices, scores, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K):
+    """Pick (index, score) pairs from one sparse score row, best first."""
+    keep = scores >= threshold
+    indices, scores = indices[keep], scores[keep]
+    if top_k is not None and len(scores) > top_k:
+        part = np.argpartition(-scores, top_k - 1)[:top_k]
+        indices, scores = indices[part], scores[part]
+    order = np.argsort(-scores, kind="stable")
+    return [(int(indices[i]), float(scores[i])) for i in order]
+
+@timed("similarity.score_all")
+def score_all(target_texts, candidate_texts, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K):
+    """Score every target text against every candidate text.
+
+    One TF-IDF vocabulary is fitted over targets and candidates together and
+    the matrices stay sparse; rows are L2-normalized, so a sparse product gives
+    cosine similarity directly. Returns one best-first [(candidate_index, score)]
+    list per target.
+    """
+    target_texts, candidate_texts = list(target_texts), list(candidate_texts)
+    if not target_texts or not candidate_texts:
+        return [[] for _ in target_texts]
+
+    matrix = TfidfVectorizer(dtype=np.float32).fit_transform(target_texts + candidate_texts)
+    targets = matrix[:len(target_texts)]
+    candidates_t = matrix[len(target_texts):].T.tocsc()
+
+    matches = []
+    for start in range(0, targets.shape[0], TARGET_BLOCK_SIZE):
+        block = (targets[start:start + TARGET_BLOCK_SIZE] @ candidates_t).tocsr()
+        for i in range(block.shape[0]):
+            lo, hi = block.indptr[i], block.indptr[i + 1]
+            matches.append(select_matches(block.indices[lo:hi], block.data[lo:hi], threshold, top_k))
+    return matches
+
+def collapse_near_duplicates(candidates):
+    """Keep one representative per near-duplicate cluster (see phash_index.py)."""
+    representatives = load_representatives()
+    if not representatives:
+        print("[WARN] No near-duplicate report found; run phash_index.py first")
+        return candidates
+    kept = [(f, p) for f, p in candidates
+            if representatives.get(os.path.abspath(p), os.path.abspath(p)) == os.path.abspath(p)]
+    print(f"[INFO] Near-duplicate collapse: {len(candidates)} candidates -> {len(kept)} representatives")
+    return kept
+
+def nearby_candidates(target_image_paths, within_km=None, within_hours=None):
+    """{target: {abs path: km}} of catalogued images shot within `within_km` and/or `within_hours` of each target.
+
+    A target without the GPS position or capture time a criterion needs
+    gets no candidates: nothing can be shown to be that close to it.
+    """
+    catalog = get_catalog()
+    nearby = {}
+    with get_metrics().span("similarity.nearby", targets=len(target_image_paths)):
+        for path in target_image_paths:
+            try:
+                nearby[path] = neighbors(path, within_km, within_hours, catalog)
+            except ValueError as e:
+                print(f"[SKIP] {e}; no candidates can match it")
+                nearby[path] = {}
+    return nearby
+
+def keep_nearby(results, nearby, top_k=TOP_K):
+    """Cut each target's best-first matches to those in nearby[target], then to `top_k`."""
+    return {
+        target: [m for m in matches if os.path.abspath(m["path"]) in nearby[target]][:top_k]
+        for target, matches in results.items()
+    }
+
+def find_similar_images_batch(target_image_paths, candidate_dir, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K,
+                              collapse=False, within_km=None, within_hours=None):
+    """Vectorized many-to-many version of find_similar_images.
+
+    Returns {target_path: [result dicts]} with the same result fields as
+    find_similar_images. With `collapse`, near-duplicate candidates are
+    scored once through their cluster representative. With `within_km`
+    and/or `within_hours`, a target only matches candidates shot that close
+    to it, looked up in the catalog's places index.
+    """
+    candidates = list_candidates(candidate_dir, exclude=target_image_paths)
+    if collapse:
+        candidates = collapse_near_duplicates(candidates)
+    catalog = get_catalog()
+    target_meta = catalog.metadata(target_image_paths)
+    candidate_meta = catalog.metadata([path for _, path in candidates])
+
+    nearby = {}
+    if within_km is not None or within_hours is not None:
+        nearby = nearby_candidates(target_image_paths, within_km, within_hours)
+        # Candidates near none of the targets needn't be scored
+        allowed = set().union(*nearby.values())
+        candidates = [(f, p) for f, p in candidates if os.path.abspath(p) in allowed]
+
+    targets = []
+    for path in target_image_paths:
+        text = description_text(target_meta[path])
+        if text:
+            targets.append((path, text))
+        else:
+            print(f"[SKIP] No valid metadata in target image: {path}")
+
+    described = []
+    for fname, path in candidates:
+        text = description_text(candidate_meta[path])
+        if text:
+            described.append((fname, path, text))
+    print(f"[INFO] Scoring {len(targets)} targets against {len(described)} described candidates")
+
+    # top_k is applied after the place/time filter, or it could keep only far-away matches
+    matches = score_all([t for _, t in targets], [c[2] for c in described], threshold, None if nearby else top_k)
+
+    results = {path: [] for path in target_image_paths}
+    for (target_path, _), target_matches in zip(targets, matches):
+        if nearby:
+            target_matches = [(j, score) for j, score in target_matches
+                              if os.path.abspath(described[j][1]) in nearby[target_path]]
+        if nearby and top_k is not None:
+            target_matches = target_matches[:top_k]
+        results[target_path] = [
+            {
+                "file": described[j][0],
+                "similarity": score,
+                "path": described[j][1],
+                "candidate_fields": described[j][2]
+            }
+            for j, score in target_matches
+        ]
+    return results
+
+def iter_described_candidates(candidate_dir, exclude=(), chunk_size=CHUNK_SIZE):
+    """Yield (path, description) for captioned candidates without listing the whole folder first."""
+    excluded = {os.path.abspath(p) for p in exclude}
+    catalog = get_catalog()
+    batch = []
+
+    def describe(paths):
+        metadata = catalog.metadata(paths)
+        for path in paths:
+            text = description_text(metadata[path])
+            if text:
+                yield path, text
+
+    with os.scandir(candidate_dir) as entries:
+        for entry in entries:
+            if (not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS)
+                    or os.path.abspath(entry.path) in excluded):
+                continue
+            batch.append(entry.path)
+            if len(batch) == chunk_size:
+                yield from describe(batch)
+                batch = []
+    if batch:
+        yield from describe(batch)
+
+def find_similar_images_streaming(target_image_paths, candidate_dir, threshold=SIMILARITY_THRESHOLD,
+                                  top_k=STREAMING_TOP_K, chunk_size=CHUNK_SIZE, workers=WORKERS):
+    """Out-of-core version of find_similar_images_batch for candidate folders larger than RAM.
+
+    Candidates are read, scored and discarded chunk by chunk (see
+    chunked_scoring.py); only each target's top-k survive. Same return
+    shape as find_similar_images_batch.
+    """
+    target_meta = get_catalog().metadata(target_image_paths)
+    targets = []
+    for path in target_image_paths:
+        text = description_text(target_meta[path])
+        if text:
+            targets.append((path, text))
+        else:
+            print(f"[SKIP] No valid metadata in target image: {path}")
+
+    scorer = ChunkedScorer(chunk_size=chunk_size, workers=workers)
+    candidates = iter_described_candidates(candidate_dir, exclude=target_image_paths, chunk_size=chunk_size)
+    matches = scorer.score([t for _, t in targets], candidates, threshold, top_k)
+    print(f"[INFO] Scored {len(targets)} targets against {scorer.candidates} described candidates "
+          f"in chunks of {chunk_size}")
+
+    # Caption text is looked up again only for the survivors
+    winners = get_catalog().metadata({path for target_matches in matches for path, _ in target_matches})
+    results = {path: [] for path in target_image_paths}
+    for (target_path, _), target_matches in zip(targets, matches):
+        results[target_path] = [
+            {
+                "file": os.path.basename(path),
+                "similarity": score,
+                "path": path,
+                "candidate_fields": description_text(winners[path])
+            }
+            for path, score in target_matches
+        ]
+    return results
+
+def find_similar_images_indexed(target_image_paths, threshold=SIMILARITY_THRESHOLD, top_k=TOP_K, index=None,
+                                within_km=None, within_hours=None):
+    """Query the persistent caption index instead of rescanning candidate files.
+
+    Same return shape and `within_km`/`within_hours` filter as
+    find_similar_images_batch.
+    """
+    filtered = within_km is not None or within_hours is not None
+    if index is None:
+        index = CaptionIndex()
+    target_meta = get_catalog().metadata(target_image_paths)
+    targets = [(path, description_text(target_meta[path])) for path in target_image_paths]
+
+    results = {path: [] for path in target_image_paths}
+    described = [(path, text) for path, text in targets if text]
+    for path, text in targets:
+        if not text:
+            print(f"[SKIP] No valid metadata in target image: {path}")
+
+    # top_k is applied after the place/time filter, as in find_similar_images_batch
+    matches = index.query([text for _, text in described], top_k=None if filtered else top_k, threshold=threshold,
+                          exclude=target_image_paths)
+    for (target_path, _), target_matches in zip(described, matches):
+        results[target_path] = [
+            {"file": os.path.basename(path), "similarity": score, "path": path}
+            for path, score in target_matches
+            if os.path.exists(path)
+        ]
+    if filtered:
+        results = keep_nearby(results, nearby_candidates(target_image_paths, within_km, within_hours), top_k)
+    return results
+
+def find_similar_images_visual(target_image_paths, candidate_dir, threshold=VISUAL_SIMILARITY_THRESHOLD,
+                               top_k=TOP_K, encoder=VISUAL_ENCODER, collapse=False, within_km=None, within_hours=None):
+    """Rank candidates by image-embedding cosine similarity, captions or not.
+
+    Same return shape and `within_km`/`within_hours` filter as
+    find_similar_images_batch; `candidate_fields` is empty because no text
+    is involved.
+    """
+    candidates = list_candidates(candidate_dir, exclude=target_image_paths)
+    if collapse:
+        candidates = collapse_near_duplicates(candidates)
+    nearby = None
+    if within_km is not None or within_hours is not None:
+        nearby = nearby_candidates(target_image_paths, within_km, within_hours)
+        allowed = set().union(*nearby.values())
+        candidates = [(f, p) for f, p in candidates if os.path.abspath(p) in allowed]
+    names = {path: fname for fname, path in candidates}
+
+    index = EmbeddingIndex(get_encoder(encoder))
+    ranked = index.rank(target_image_paths, [path for _, path in candidates], threshold,
+                        None if nearby is not None else top_k)
+    print(f"[INFO] Embedded {index.encoded} new images with {index.encoder.name}")
+    results = {
+        target: [
+            {"file": names[path], "similarity": score, "path": path, "candidate_fields": ""}
+            for path, score in matches
+        ]
+        for target, matches in ranked.items()
+    }
+    return keep_nearby(results, nearby, top_k) if nearby is not None else results
+
+def save_similar_images(similar_images, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for img in similar_images:
+        new_name = f"sim_{img['similarity']:.2f}_{img['file']}"
+        destination = os.path.join(output_dir, new_name)
+        # Hardlink rather than copy: the view costs no extra disk
+        link_or_copy(img["path"], destination)
+        print(f"- {img['file']} → {destination} (similarity: {img['similarity']:.2f})")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Group downloaded candidates by caption similarity to input images")
+    parser.add_argument("targets", nargs="*", help=f"input images to score (default: every image in {INPUT_IMAGES_DIR})")
+    parser.add_argument("--threshold", type=float,
+                        help=f"default {SIMILARITY_THRESHOLD} for captions, {VISUAL_SIMILARITY_THRESHOLD} for --visual")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--visual", action="store_true",
+                        help="rank by image embeddings instead of caption text")
+    parser.add_argument("--encoder", choices=sorted(ENCODERS), default=VISUAL_ENCODER,
+                        help="image encoder for --visual")
+    parser.add_argument("--index", action="store_true",
+                        help="query the persistent caption index (see caption_index.py) instead of rescanning")
+    parser.add_argument("--collapse-duplicates", action="store_true",
+                        help="score one representative per near-duplicate cluster (run phash_index.py first)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="score candidates chunk by chunk in bounded memory (for folders larger than RAM)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="candidates per chunk for --streaming")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="scoring processes for --streaming")
+    parser.add_argument("--within-km", type=float,
+                        help="only match candidates shot within this distance of the target (not with --streaming)")
+    parser.add_argument("--within-hours", type=float,
+                        help="only match candidates shot within this many hours of the target (not with --streaming)")
+    parser.add_argument("--pairwise", action="store_true",
+                        help=f"legacy mode: refit TF-IDF per pair for a single target ({TARGET_IMAGE})")
+    args = parser.parse_args()
+    if args.within_km is not None or args.within_hours is not None:
+        # Both keep only each chunk's or pair's top matches, so a place/time filter applied afterwards could
+        # leave a target none of the nearby matches it has
+        for flag in ("streaming", "pairwise"):
+            if getattr(args, flag):
+                parser.error(f"--within-km/--within-hours can't be combined with --{flag}")
+
     print("[INFO] Running similarity check")
     os.makedirs(SIMILAR_IMAGES_DIR, exist_ok=True)
 
-    similar_images = find_similar_images(TARGET_IMAGE, CANDIDATE_IMAGES_DIR)
-
-    if similar_images:
-        print("\n[✓] Similar images found:")
-        for img in similar_images:
-            new_name = f"sim_{img['similarity']:.2f}_{img['file']}"
-            destination = os.path.join(SIMILAR_IMAGES_DIR, new_name)
-            shutil.copy2(img["path"], destination)
-            print(f"- {img['file']} → {destination} (similarity: {img['similarity']:.2f})")
-    else:
-        print("\n[✗] No similar images found.")
+    if args.threshold is None:
+        args.threshold = VISUAL_SIMILARITY_THRESHOLD if args.visual else SIMILARITY_THRESHOLD
+
+    with get_metrics().stage("similarity"):
+        if args.pairwise:
+            target = args.targets[0] if args.targets else TARGET_IMAGE
+            SIMILARITY_THRESHOLD = args.threshold
+            similar_images = find_similar_images(target, CANDIDATE_IMAGES_DIR)
+            if similar_images:
+                print("\n[✓] Similar images found:")
+                save_similar_images(similar_images, SIMILAR_IMAGES_DIR)
+            else:
+                print("\n[✗] No similar images found.")
+        else:
+            targets = args.targets or [path for _, path in list_candidates(INPUT_IMAGES_DIR)]
+            start = time.perf_counter()
+            if args.visual:
+                results = find_similar_images_visual(targets, CANDIDATE_IMAGES_DIR, args.threshold, args.top_k,
+                                                     encoder=args.encoder, collapse=args.collapse_duplicates,
+                                                     within_km=args.within_km, within_hours=args.within_hours)
+            elif args.index:
+                results = find_similar_images_indexed(targets, args.threshold, args.top_k,
+                                                      within_km=args.within_km, within_hours=args.within_hours)
+            elif args.streaming:
+                results = find_similar_images_streaming(targets, CANDIDATE_IMAGES_DIR, args.threshold,
+                                                        args.top_k or STREAMING_TOP_K, args.chunk_size, args.workers)
+            else:
+                results = find_similar_images_batch(targets, CANDIDATE_IMAGES_DIR, args.threshold, args.top_k,
+                                                    collapse=args.collapse_duplicates, within_km=args.within_km,
+                                                    within_hours=args.within_hours)
+            print(f"[INFO] Scored in {time.perf_counter() - start:.2f} s")
+
+            for target, similar_images in results.items():
+                target_name = os.path.splitext(os.path.basename(target))[0]
+                if similar_images:
+                    print(f"\n[✓] Similar images found for {target_name}:")
+                    save_similar_images(similar_images, os.path.join(SIMILAR_IMAGES_DIR, target_name))
+                else:
+                    print(f"\n[✗] No similar images found for {target_name}.")
@@ -0,0 +1,179 @@
+import os
+import math
+import calendar
+import numpy as np
+
+# Cells are 30-bit geohashes (15 bits of longitude interleaved with 15 of latitude, about 1.2 x 0.6 km at the
+# equator); a coarser geohash is a prefix, i.e. a contiguous range of these integers
+CELL_BITS = 15
+# Capture times are bucketed by day, so a time window is a handful of (bucket, cell range) index scans
+TIME_BUCKET_SECONDS = int(os.getenv("TIME_BUCKET_SECONDS", str(24 * 3600)))
+# A radius is covered by at most this many cells of one level, and a window by this many buckets
+# before the query falls back to one scan per cell range
+MAX_CELLS = 16
+MAX_BUCKETS = 8
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _spread(v):
+    """Insert a zero bit above each of the low 16 bits of v (numpy uint64)."""
+    v = v & np.uint64(0xFFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+    return v
+
+
+def _grid(lat, lon, bits):
+    """Column (longitude) and row (latitude) of each point in a 2**bits x 2**bits grid."""
+    n = 1 << bits
+    ix = np.clip(np.floor((np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n), 0, n - 1)
+    iy = np.clip(np.floor((np.asarray(lat, dtype=np.float64) + 90.0) / 180.0 * n), 0, n - 1)
+    return ix.astype(np.uint64), iy.astype(np.uint64)
+
+
+def _interleave(ix, iy):
+    # Longitude takes the higher bit of each pair, as in geohash
+    return ((_spread(ix) << np.uint64(1)) | _spread(iy)).astype(np.int64)
+
+
+def geohash_cells(lat, lon):
+    """30-bit geohash integer of each (lat, lon)."""
+    return _interleave(*_grid(lat, lon, CELL_BITS))
+
+
+def _spread_int(v):
+    return _SPREAD_BYTE[v & 0xFF] | (_SPREAD_BYTE[v >> 8] << 16)
+
+
+_SPREAD_BYTE = [int(b) for b in _spread(np.arange(256, dtype=np.uint64))]
+
+
+def _column(lon, n):
+    return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+
+def _row(lat, n):
+    return min(n - 1, max(0, int((lat + 90.0) / 180.0 * n)))
+
+
+def cell_ranges(lat, lon, radius_km):
+    """Sorted, merged [(lo, hi)] cell ranges covering every point within `radius_km` of (lat, lon).
+
+    Uses the finest geohash level whose cells covering the circle's
+    bounding box number at most MAX_CELLS. Plain Python: it's a handful of
+    scalars per query, where numpy's call overhead would dominate.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    coslat = math.cos(math.radians(max(abs(south), abs(north))))
+    if north >= 90.0 or south <= -90.0 or coslat < 1e-9 or radius_km / (KM_PER_DEGREE * coslat) >= 180.0:
+        lon_spans = [(-180.0, 180.0)]
+    else:
+        dlon = radius_km / (KM_PER_DEGREE * coslat)
+        west, east = lon - dlon, lon + dlon
+        if west < -180.0:
+            lon_spans = [(west + 360.0, 180.0), (-180.0, east)]
+        elif east > 180.0:
+            lon_spans = [(west, 180.0), (-180.0, east - 360.0)]
+        else:
+            lon_spans = [(west, east)]
+
+    for bits in range(CELL_BITS, -1, -1):
+        n = 1 << bits
+        rows = range(_row(south, n), _row(north, n) + 1)
+        columns = [range(_column(w, n), _column(e, n) + 1) for w, e in lon_spans]
+        if len(rows) * sum(map(len, columns)) <= MAX_CELLS or bits == 0:
+            break
+
+    shift = 2 * (CELL_BITS - bits)
+    codes = sorted({(_spread_int(x) << 1) | _spread_int(y) for span in columns for x in span for y in rows})
+    merged = [[codes[0], codes[0]]]
+    for code in codes[1:]:
+        if code == merged[-1][1] + 1:
+            merged[-1][1] = code
+        else:
+            merged.append([code, code])
+    return [(lo << shift, ((hi + 1) << shift) - 1) for lo, hi in merged]
+
+
+def capture_timestamp(date):
+    """Seconds since the epoch for a catalog date ("2015-05-23T17:21:12" or "2015-05-23"), or None.
+
+    EXIF capture times carry no time zone, so they are read as UTC: windows
+    compare wall-clock times, which is what "shot within 6 hours" means for
+    photos of one event.
+    """
+    if not date:
+        return None
+    try:
+        parts = [int(p) for p in date.replace("T", "-").replace(":", "-").split("-")]
+        return calendar.timegm((*parts[:6], *[0] * (6 - len(parts[:6])), 0, 0, 0))
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def haversine_km(lat, lon, lats, lons):
+    p1, p2 = math.radians(lat), np.radians(lats)
+    a = np.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(np.radians(np.asarray(lons) - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def capture_timestamps(dates):
+    """capture_timestamp over a list of dates, parsed by numpy in one go."""
+    try:
+        parsed = np.array([d or "NaT" for d in dates], dtype="datetime64[s]")
+    except ValueError:
+        return [capture_timestamp(d) for d in dates]
+    missing = np.isnat(parsed).tolist()
+    return [None if m else t for m, t in zip(missing, parsed.astype(np.int64).tolist())]
+
+
+def place_rows(rows):
+    """(path, cell, bucket, ts, lat, lon) index rows for (path, gps_lat, gps_lon, date) catalog rows.
+
+    Rows with neither GPS nor a date are dropped.
+    """
+    if not rows:
+        return []
+    paths, lats, lons, dates = zip(*rows)
+    has_gps = [la is not None and lo is not None for la, lo in zip(lats, lons)]
+    cells = geohash_cells([la if ok else 0.0 for la, ok in zip(lats, has_gps)],
+                          [lo if ok else 0.0 for lo, ok in zip(lons, has_gps)]).tolist()
+    out = []
+    for path, ok, cell, lat, lon, ts in zip(paths, has_gps, cells, lats, lons, capture_timestamps(dates)):
+        if ok:
+            out.append((path, cell, None if ts is None else ts // TIME_BUCKET_SECONDS, ts, lat, lon))
+        elif ts is not None:
+            out.append((path, None, ts // TIME_BUCKET_SECONDS, ts, None, None))
+    return out
+
+
+def neighbors(path, radius_km=None, hours=None, catalog=None):
+    """Catalogued images within `radius_km` and/or `hours` of image `path`'s GPS position and capture time.
+
+    Returns {abs path: distance in km or None}, nearest (or earliest) first.
+    Raises ValueError when `path` isn't catalogued, when neither criterion
+    is given, or when it lacks the GPS position (for radius_km) or capture
+    date (for hours) a given criterion needs: no image can be shown to be
+    that close, and dropping the criterion would match images that aren't.
+    """
+    if radius_km is None and hours is None:
+        raise ValueError("neighbors() needs radius_km, hours, or both")
+    if catalog is None:
+        from metadata_catalog import get_catalog
+        catalog = get_catalog()
+    record = catalog.records([path]).get(path)
+    if not record:
+        raise ValueError(f"{path} is not in the catalog")
+    lat, lon, ts = record["gps_lat"], record["gps_lon"], capture_timestamp(record["date"])
+    if radius_km is not None and (lat is None or lon is None):
+        raise ValueError(f"{path} has no GPS position to search {radius_km:g} km around")
+    if hours is not None and ts is None:
+        raise ValueError(f"{path} has no capture time to search {hours:g} hours around")
+    window = (ts - hours * 3600, ts + hours * 3600) if hours is not None else (None, None)
+    found = catalog.near(lat, lon, radius_km, *window)
+    return {row["path"]: row["distance_km"] for row in found}
+
@@ -0,0 +1,161 @@
+import os
+import threading
+from concurrent.futures import as_completed
+from downloader import Downloader
+from download_policy import DownloadPolicy
+from metadata_catalog import get_catalog
+from phash_index import HashCache, hamming, image_hashes
+from similarity_search import description_text, score_all
+
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "./downloaded_images/.thumbnails")
+# A hit's original is fetched when its thumbnail or its title scores at least this against the input image
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", "0.35"))
+# pHash distance (of 64 bits) at which the visual score reaches 0; unrelated images average 32
+VISUAL_ZERO_DISTANCE = 32
+THUMBNAIL_MAX_BYTES = 2_000_000
+
+
+def visual_score(a, b):
+    return max(0.0, 1.0 - hamming(a, b) / VISUAL_ZERO_DISTANCE)
+
+
+def title_scores(caption, titles):
+    """TF-IDF cosine of each title against the input caption (None where the caption or the title has no text)."""
+    scores = [None] * len(titles)
+    if not caption:
+        return scores
+    described = [(i, title) for i, title in enumerate(titles) if title and title.strip()]
+    for i, _ in described:
+        scores[i] = 0.0
+    if described:
+        for j, score in score_all([caption], [t.lower() for _, t in described], threshold=0.0, top_k=None)[0]:
+            scores[described[j][0]] = score
+    return scores
+
+
+class TierStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.passed = 0
+        self.skipped = 0
+        self.unfiltered = 0
+
+    def record(self, passed, unfiltered):
+        with self._lock:
+            self.hits += 1
+            if unfiltered:
+                self.unfiltered += 1
+            if passed:
+                self.passed += 1
+            else:
+                self.skipped += 1
+
+    def summary(self):
+        return (f"{self.passed} of {self.hits} originals fetched, {self.skipped} skipped by the thumbnail prefilter "
+                f"({self.unfiltered} hits had no usable thumbnail or title and were fetched unfiltered)")
+
+
+class TieredFetcher:
+    """Fetch every hit's thumbnail first and the full-size original only for hits that pass a cheap prefilter.
+
+    The prefilter scores each hit against its input image two ways: pHash
+    similarity of the thumbnail to the input image, and TF-IDF cosine of the
+    hit's title to the input caption. The better of the two must reach
+    `threshold`. A hit with neither signal (no usable thumbnail, and no
+    title or caption) is always fetched.
+    """
+
+    def __init__(self, downloader, threshold=PREFILTER_THRESHOLD, thumbnail_dir=THUMBNAIL_DIR, hashes=None):
+        self.downloader = downloader
+        self.threshold = threshold
+        self.thumbnail_dir = thumbnail_dir
+        # Thumbnails are small by design, so only the format and size limits apply. They share the originals'
+        # manifest and blob store, so they resume, revalidate and deduplicate the same way
+        self.thumbnails = Downloader(max_concurrency=downloader.max_concurrency, per_host=downloader.per_host,
+                                     manifest=downloader.manifest, blobs=downloader.blobs,
+                                     policy=DownloadPolicy(min_width=0, min_height=0, max_bytes=THUMBNAIL_MAX_BYTES))
+        self.hashes = hashes if hashes is not None else HashCache()
+        self.stats = TierStats()
+
+    def thumbnail_path(self, save_path):
+        return os.path.join(self.thumbnail_dir, os.path.splitext(os.path.basename(save_path))[0] + ".jpg")
+
+    def _reference(self, input_path):
+        """(pHash or None, caption) of the input image."""
+        if not os.path.exists(input_path):
+            return None, ""
+        caption = description_text(get_catalog().metadata([input_path])[input_path])
+        hashes = self.hashes.hashes([input_path])
+        return (hashes[input_path][1] if input_path in hashes else None), caption
+
+    def fetch(self, input_path, planned, on_done=None):
+        """Download the originals of one input image's planned (item, url, save_path) hits that pass the prefilter."""
+        return self.fetch_all([(input_path, planned)], on_done)
+
+    def fetch_all(self, plans, on_done=None):
+        """Download the originals of planned hits that pass the prefilter, for (input_path, planned) pairs.
+
+        `planned` lists (item, url, save_path). Every input's thumbnails go
+        through one thumbnail tier, so one input's slow hosts don't hold up
+        the next. Hits whose title already passes are fetched straight away,
+        and the rest as soon as their thumbnail lands and scores, so
+        originals overlap the thumbnail tier. Returns
+        [(url, save_path, nbytes or None)] for the originals fetched, like
+        Downloader.fetch_all.
+        """
+        plans = [(input_path, planned) for input_path, planned in plans if planned]
+        if not plans:
+            return []
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+        done = []
+        waiting = {}
+        futures = []
+        passed_by_input = {input_path: 0 for input_path, _ in plans}
+
+        def decide(input_path, url, save_path, score):
+            passed = score is None or score >= self.threshold
+            self.stats.record(passed, score is None)
+            if passed:
+                passed_by_input[input_path] += 1
+                futures.append(self.downloader.submit(url, save_path))
+
+        for input_path, planned in plans:
+            input_hash, caption = self._reference(input_path)
+            texts = title_scores(caption, [item.get("title") or "" for item, _, _ in planned])
+            for (item, url, save_path), text in zip(planned, texts):
+                if text is not None and text >= self.threshold:
+                    decide(input_path, url, save_path, text)
+                elif item.get("thumbnail") and input_hash is not None:
+                    waiting[self.thumbnail_path(save_path)] = (item["thumbnail"], input_path, input_hash, url,
+                                                               save_path, text)
+                else:
+                    decide(input_path, url, save_path, text)
+
+        def on_thumbnail(outcome):
+            _, thumb_path, nbytes = outcome
+            _, input_path, input_hash, url, save_path, text = waiting[thumb_path]
+            visual = None
+            if nbytes is not None:
+                # Hashed directly: a thumbnail hashes in about a millisecond, less than a cache write
+                try:
+                    visual = visual_score(input_hash, image_hashes(thumb_path)[1])
+                except Exception as e:
+                    print(f"[WARN] Couldn't hash thumbnail {thumb_path}: {e}")
+            signals = [s for s in (visual, text) if s is not None]
+            decide(input_path, url, save_path, max(signals) if signals else None)
+
+        self.thumbnails.fetch_all([(entry[0], path) for path, entry in waiting.items()], on_thumbnail)
+        for future in as_completed(futures):
+            outcome = future.result()
+            done.append(outcome)
+            if on_done:
+                on_done(outcome)
+
+        for input_path, planned in plans:
+            print(f"[INFO] {os.path.basename(input_path)}: {passed_by_input[input_path]} of {len(planned)} hits "
+                  f"passed the prefilter (threshold {self.threshold})")
+        return done
+
+    def close(self):
+        self.thumbnails.close()
@@ -0,0 +1,125 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from response_cache import get_cache
+from instrumentation import get_metrics
+
+CDX_ENDPOINT = os.getenv("WAYBACK_CDX_ENDPOINT", "https://web.archive.org/cdx/search/cdx")
+ARCHIVE_BASE = os.getenv("WAYBACK_ARCHIVE_BASE", "https://web.archive.org/web")
+# Snapshot lists change slowly; a day-old page of captures is still a good answer
+CDX_TTL = float(os.getenv("WAYBACK_TTL", str(24 * 3600)))
+PAGE_SIZE = int(os.getenv("WAYBACK_PAGE_SIZE", "500"))
+CONCURRENCY = int(os.getenv("WAYBACK_CONCURRENCY", "4"))
+TIMEOUT = 30
+RETRIES = 3
+RETRY_STATUSES = {429, 502, 503, 504}
+FIELDS = ["timestamp", "original", "mimetype", "statuscode", "digest"]
+
+
+class CdxError(Exception):
+    pass
+
+
+def archive_url(timestamp, original):
+    return f"{ARCHIVE_BASE}/{timestamp}/{original}"
+
+
+def fetch_page(params, endpoint=CDX_ENDPOINT, session=None):
+    """One CDX JSON page: (rows as dicts, resume key or None). Retries rate limits and gateway errors."""
+    http = session or requests
+    for attempt in range(RETRIES + 1):
+        response = http.get(endpoint, params=params, timeout=TIMEOUT)
+        if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+            break
+        time.sleep(float(response.headers.get("Retry-After") or 2 ** attempt))
+    if response.status_code != 200:
+        raise CdxError(f"CDX error {response.status_code}: {response.text[:200]}")
+    rows = response.json() if response.text.strip() else []
+    if not rows:
+        return [], None
+    header, rows = rows[0], rows[1:]
+    resume_key = None
+    # With showResumeKey the last two rows are [] and [key]
+    if len(rows) >= 2 and rows[-2] == []:
+        resume_key = rows[-1][0]
+        rows = rows[:-2]
+    return [dict(zip(header, row)) for row in rows], resume_key
+
+
+def snapshots(url, limit=None, start=None, end=None, collapse_digest=True, status="200",
+              page_size=PAGE_SIZE, endpoint=CDX_ENDPOINT, ttl=CDX_TTL, session=None):
+    """Lazily yield the captures of `url`, oldest first, as dicts with an `archive_url`.
+
+    Filtering happens on the server: at most `limit` captures, timestamps
+    between `start` and `end` (YYYY[MMDDhhmmss] prefixes), only `status`
+    responses, and consecutive captures with identical content (same
+    digest) collapsed. Pages are requested only as the caller iterates and
+    each is cached for `ttl` seconds, so stopping early costs nothing more.
+    """
+    params = {"url": url, "output": "json", "fl": ",".join(FIELDS), "showResumeKey": "true"}
+    if start:
+        params["from"] = start
+    if end:
+        params["to"] = end
+    if collapse_digest:
+        params["collapse"] = "digest"
+    if status:
+        params["filter"] = f"statuscode:{status}"
+
+    yielded = 0
+    resume_key = None
+    while limit is None or yielded < limit:
+        page = dict(params, limit=page_size if limit is None else min(page_size, limit - yielded))
+        if resume_key:
+            page["resumeKey"] = resume_key
+        with get_metrics().span("wayback.page", url=url):
+            rows, resume_key = get_cache().fetch("wayback", dict(page, endpoint=endpoint),
+                                                 lambda: fetch_page(page, endpoint, session), ttl)
+        for row in rows:
+            yield dict(row, archive_url=archive_url(row["timestamp"], row["original"]))
+            yielded += 1
+        if not resume_key or not rows:
+            return
+
+
+def archived_urls(urls, limit=3, start=None, end=None, workers=CONCURRENCY, **kwargs):
+    """{url: [archive URL, ...]} for many URLs, looked up `workers` at a time (failures give [])."""
+    session = requests.Session()
+    lock = threading.Lock()
+    found = {}
+
+    def lookup(url):
+        try:
+            captures = [s["archive_url"] for s in snapshots(url, limit, start, end, session=session, **kwargs)]
+        except (requests.RequestException, CdxError, ValueError) as e:
+            print(f"[ERROR] Wayback lookup failed for {url}: {e}")
+            get_metrics().count("wayback.errors")
+            captures = []
+        with lock:
+            found[url] = captures
+
+    urls = list(dict.fromkeys(urls))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls) or 1))) as pool:
+        list(pool.map(lookup, urls))
+    return {url: found[url] for url in urls}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List Wayback Machine captures of URLs")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--limit", type=int, default=10, help="captures per URL (0 for all)")
+    parser.add_argument("--from", dest="start", help="earliest timestamp, e.g. 2015 or 20150523")
+    parser.add_argument("--to", dest="end", help="latest timestamp")
+    parser.add_argument("--all-captures", action="store_true", help="don't collapse identical consecutive captures")
+    args = parser.parse_args()
+
+    results = archived_urls(args.urls, args.limit or None, args.start, args.end,
+                            collapse_digest=not args.all_captures)
+    for url, captures in results.items():
+        print(f"[✓] {url}: {len(captures)} captures")
+        for capture in captures:
+            print(f"    {capture}")
+    print(f"[✓] Wayback cache: {get_cache().summary()}")